@@ -21,6 +21,7 @@ if __name__ == '__main__':
         print('"results" folder not found')
         exit(1)
     def __exclude(fileName):
-        return '.private_existingUsers.txt' in fileName or 'statistics' in fileName
+        return '.private_existingUsers.txt' in fileName or \
+            'statistics' in fileName or fileName.endswith('.npy')
     with tarfile.open('dataset.tar.gz', mode='w:gz') as outputTar:
         outputTar.add('results', exclude=__exclude)
@@ -0,0 +1,164 @@
+"""Pack all the head movement logs of the dataset in one file.
+
+The pack is made of two .npy files:
+ - <packPath>.npy: the samples of all the logs (dtype LogCache.LOG_DTYPE)
+   concatenated in one array, read with a memory-map.
+ - <packPath>_index.npy: for each log, the (userId, testId, videoId) key,
+   the row range [start, stop) of its samples, the start offset of the
+   video and the size and modification time of the log when it was packed.
+
+Author: Xavier Corbillon
+IMT Atlantique
+"""
+
+from .LogCache import LOG_DTYPE, LoadLog, GetStartOffsetInSecond
+import logging
+import os
+import numpy as np
+
+INDEX_DTYPE = np.dtype([('userId', 'U64'),
+                        ('testId', 'U32'),
+                        ('videoId', 'U128'),
+                        ('start', np.int64),
+                        ('stop', np.int64),
+                        ('startOffsetInSecond', np.float64),
+                        ('logSize', np.int64),
+                        ('logMtime', np.int64)])
+
+global_dataset_packs = dict()
+
+
+def GetDatasetPack(packPath):
+    """Return the DatasetPack stored at packPath (opened once by process)."""
+    global global_dataset_packs
+    if packPath not in global_dataset_packs:
+        global_dataset_packs[packPath] = DatasetPack(packPath)
+    return global_dataset_packs[packPath]
+
+
+def GetPackPaths(packPath):
+    """Return the path to the samples file and to the index file."""
+    return ('{}.npy'.format(packPath), '{}_index.npy'.format(packPath))
+
+
+def ListResultLogs(resultFolder):
+    """Yield (userId, testId, videoId, logPath) for all the logs."""
+    for userDir in sorted(os.listdir(resultFolder)):
+        userPath = os.path.join(resultFolder, userDir)
+        if userDir[0:4] != 'uid-' or not os.path.isdir(userPath):
+            continue
+        userId = userDir[4:]
+        for testId in sorted(os.listdir(userPath)):
+            testPath = os.path.join(userPath, testId)
+            if testId[0:4] != 'test' or not os.path.isdir(testPath):
+                continue
+            for root, dirs, files in os.walk(testPath):
+                for videoId in sorted(dirs):
+                    logPath = os.path.join(root, videoId,
+                                           '{}_0.txt'.format(videoId))
+                    if os.path.isfile(logPath):
+                        yield (userId, testId, videoId, logPath)
+
+
+class DatasetPack(object):
+    """Read only access to a dataset pack."""
+
+    def __init__(self, packPath):
+        """Open the pack files (the samples are memory-mapped)."""
+        self.packPath = packPath
+        samplesPath, indexPath = GetPackPaths(packPath)
+        try:
+            self.samples = np.load(samplesPath, mmap_mode='r')
+        except ValueError:
+            # empty arrays cannot be memory-mapped
+            self.samples = np.load(samplesPath)
+        self.index = np.load(indexPath)
+        self.rowByKey = dict()
+        for row, entry in enumerate(self.index):
+            self.rowByKey[(str(entry['userId']), str(entry['testId']),
+                           str(entry['videoId']))] = row
+
+    def __contains__(self, key):
+        """Return True if the (userId, testId, videoId) key is in the pack."""
+        return key in self.rowByKey
+
+    def __len__(self):
+        """Number of logs in the pack."""
+        return len(self.index)
+
+    def Keys(self):
+        """Return the list of (userId, testId, videoId) keys."""
+        return list(self.rowByKey.keys())
+
+    def GetSamples(self, userId, testId, videoId):
+        """Return the samples of a log (a view on the memory-mapped pack)."""
+        entry = self.index[self.rowByKey[(userId, testId, videoId)]]
+        return self.samples[entry['start']:entry['stop']]
+
+    def GetStartOffsetInSecond(self, userId, testId, videoId):
+        """Return the start offset in seconds of the video of a log."""
+        entry = self.index[self.rowByKey[(userId, testId, videoId)]]
+        return float(entry['startOffsetInSecond'])
+
+    def GetVideoSamples(self, videoId):
+        """Return a dict (userId, testId): samples of all logs of a video."""
+        return dict(((userId, testId),
+                     self.GetSamples(userId, testId, vId))
+                    for (userId, testId, vId) in self.rowByKey
+                    if vId == videoId)
+
+    def IsUpToDate(self, userId, testId, videoId, logPath):
+        """Return True if the log was not modified since it was packed."""
+        if (userId, testId, videoId) not in self.rowByKey:
+            return False
+        entry = self.index[self.rowByKey[(userId, testId, videoId)]]
+        try:
+            stat = os.stat(logPath)
+        except OSError:
+            # the pack can be used without the raw logs
+            return True
+        return stat.st_size == entry['logSize'] and \
+            stat.st_mtime_ns == entry['logMtime']
+
+    @staticmethod
+    def Build(resultFolder, packPath):
+        """Pack all the logs of the resultFolder and return the DatasetPack.
+
+        The samples are copied log by log into a memory-mapped output file,
+        so the whole dataset is never loaded in memory.
+        """
+        logger = logging.getLogger('TestManager.Helpers.DatasetPack')
+        logList = list(ListResultLogs(resultFolder))
+        index = np.zeros(len(logList), dtype=INDEX_DTYPE)
+        start = 0
+        for row, (userId, testId, videoId, logPath) in enumerate(logList):
+            stat = os.stat(logPath)
+            nbSamples = len(LoadLog(logPath))
+            index[row] = (userId, testId, videoId, start, start + nbSamples,
+                          GetStartOffsetInSecond(logPath),
+                          stat.st_size, stat.st_mtime_ns)
+            start += nbSamples
+        samplesPath, indexPath = GetPackPaths(packPath)
+        tmpSamplesPath = '{}.{}.tmp'.format(samplesPath, os.getpid())
+        if start > 0:
+            samples = np.lib.format.open_memmap(tmpSamplesPath, mode='w+',
+                                                dtype=LOG_DTYPE,
+                                                shape=(start,))
+            for row, (userId, testId, videoId, logPath) in \
+                    enumerate(logList):
+                samples[index[row]['start']:index[row]['stop']] = \
+                    LoadLog(logPath)
+            samples.flush()
+            del samples
+        else:
+            with open(tmpSamplesPath, 'wb') as o:
+                np.save(o, np.zeros(0, dtype=LOG_DTYPE))
+        tmpIndexPath = '{}.{}.tmp'.format(indexPath, os.getpid())
+        with open(tmpIndexPath, 'wb') as o:
+            np.save(o, index)
+        os.replace(tmpSamplesPath, samplesPath)
+        os.replace(tmpIndexPath, indexPath)
+        logger.info('Dataset pack {} built: {} logs, {} samples'.format(
+            packPath, len(logList), start))
+        global_dataset_packs.pop(packPath, None)
+        return GetDatasetPack(packPath)
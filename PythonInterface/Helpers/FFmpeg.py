@@ -4,16 +4,109 @@ Author: Xavier Corbillon
 IMT Atlantique
 """
 
+import collections
+import logging
+import os
+import queue
 import subprocess as sp
+import threading
+import time
 import numpy as np
 
 FFMPEG_BIN = "ffmpeg" # on Linux ans Mac OS
+FFPROBE_BIN = "ffprobe"
+
+# max number of frames waiting to be written to the encoder
+DEFAULT_QUEUE_SIZE = 32
+# number of lines of the encoder stderr kept to report the failures
+STDERR_TAIL_SIZE = 20
+
+
+def DrainStderr(stream, tail, logger):
+    """Read the stderr stream of ffmpeg until its end.
+
+    Each line is logged (debug level) and appended to the tail (a bounded
+    deque).
+    """
+    def AddLine(line):
+        line = line.decode(errors='replace').rstrip()
+        if len(line) > 0:
+            tail.append(line)
+            logger.debug(line)
+    # the progress lines of ffmpeg end with \r instead of \n
+    remaining = b''
+    for chunk in iter(lambda: stream.read1(4096), b''):
+        lines = (remaining + chunk).replace(b'\r', b'\n').split(b'\n')
+        remaining = lines.pop()
+        for line in lines:
+            AddLine(line)
+    AddLine(remaining)
+
+
+def ProbeVideo(inputPath):
+    """Return the (width, height, fps) of the first video stream."""
+    command = [ FFPROBE_BIN,
+                '-v', 'error',
+                '-select_streams', 'v:0',
+                '-show_entries', 'stream=width,height,r_frame_rate',
+                '-of', 'csv=p=0',
+                inputPath ]
+    process = sp.run(command, stdout=sp.PIPE, stderr=sp.PIPE)
+    if process.returncode != 0:
+        raise RuntimeError('Probe of {} failed: {}'.format(
+            inputPath, process.stderr.decode(errors='replace')))
+    width, height, frameRate = \
+        process.stdout.decode().strip().split('\n')[0].split(',')[:3]
+    numerator, _, denominator = frameRate.partition('/')
+    return int(width), int(height), \
+        float(numerator)/float(denominator or 1)
+
+
+def ConcatVideos(inputPaths, outputPath):
+    """Join the videos in one video without re-encoding them.
+
+    Use the concat demuxer of ffmpeg: the videos have to be encoded with the
+    same codec and parameters (e.g. the segments of a same video).
+    """
+    listPath = outputPath + '.concat.txt'
+    with open(listPath, 'w') as o:
+        for path in inputPaths:
+            o.write("file '{}'\n".format(
+                os.path.abspath(path).replace("'", "'\\''")))
+    command = [ FFMPEG_BIN,
+                '-y',
+                '-f', 'concat',
+                '-safe', '0', # allow absolute paths in the list
+                '-i', listPath,
+                '-c', 'copy',
+                outputPath ]
+    try:
+        process = sp.run(command, stdout=sp.PIPE, stderr=sp.PIPE)
+    finally:
+        os.remove(listPath)
+    if process.returncode != 0:
+        raise RuntimeError('Concatenation of {} failed: {}'.format(
+            outputPath, process.stderr.decode(errors='replace')[-2000:]))
+
 
 class VideoWrite(object):
-    """Take pictures and encode them in a video."""
+    """Take pictures and encode them in a video.
+
+    The frames are put in a bounded queue and written to the stdin of ffmpeg
+    by a feeder thread, so the frame production and the encoding overlap.
+    When the queue is full, AddPicture and AddFrame block until the encoder
+    catches up. The stderr of ffmpeg is drained continuously by another
+    thread (otherwise ffmpeg blocks when the pipe buffer is full).
+    """
+
+    def __init__(self, outputPath, width, height, fps, codec='libx264',
+                 queueSize=DEFAULT_QUEUE_SIZE):
+        """Init the ffmpeg encoder.
 
-    def __init__(self, outputPath, width, height, fps, codec='libx264'):
-        """Init the ffmpeg encoder."""
+        :param queueSize: max number of frames waiting to be encoded
+        """
+        self.logger = logging.getLogger('TestManager.Helpers.FFmpeg')
+        self.outputPath = outputPath
         self.width = width
         self.height = height
         self.fps = fps
@@ -29,25 +122,290 @@ class VideoWrite(object):
                     '-c:v', codec,
                     outputPath ]
         self.pipe = sp.Popen( command, stdin=sp.PIPE, stderr=sp.PIPE)
+        self.frameQueue = queue.Queue(maxsize=queueSize)
+        self.stderrTail = collections.deque(maxlen=STDERR_TAIL_SIZE)
+        self.error = None
+        self.closed = False
+        self.framesCount = 0
+        self.bytesCount = 0
+        self.maxQueueDepth = 0
+        self.blockedTime = 0
+        self.startTime = time.time()
+        self.endTime = None
+        self.feederThread = threading.Thread(target=self._FeederThread,
+                                             daemon=True)
+        self.stderrThread = threading.Thread(
+            target=DrainStderr,
+            args=(self.pipe.stderr, self.stderrTail, self.logger),
+            daemon=True)
+        self.feederThread.start()
+        self.stderrThread.start()
 
     def AddPicture(self, pilImage):
-        """Add a new picture to the video (a numpy array RGB picture)."""
+        """Add a new picture to the video (a PIL image)."""
         pilImage = pilImage.resize((self.width, self.height))
         pilImage = pilImage.convert('RGB')
-        ar = np.asarray(pilImage, dtype="int8")
-        self.pipe.stdin.write( ar.tostring() )
+        self._Enqueue(np.asarray(pilImage, dtype=np.uint8))
+
+    def AddFrame(self, frame):
+        """Add a new frame to the video (a (height, width, 3) RGB array).
+
+        The frame is written as is to the encoder: it has to be at the size
+        of the video. It is not copied (if it is already a contiguous uint8
+        array), so it should not be modified after this call.
+        """
+        if frame.shape != (self.height, self.width, 3):
+            raise ValueError('Frame of shape {} in a {}x{} video'.format(
+                frame.shape, self.width, self.height))
+        self._Enqueue(np.ascontiguousarray(frame, dtype=np.uint8))
+
+    def QueueDepth(self):
+        """Number of frames waiting to be written to the encoder."""
+        return self.frameQueue.qsize()
+
+    def GetStats(self):
+        """Return a dict with the statistics of the encoding.
+
+        frames: number of frames written to the encoder, bytes: number of
+        bytes written, fps: frames written per second since the start,
+        queueDepth and maxQueueDepth: current and max number of frames
+        waiting in the queue, blockedTime: time (in seconds) the producer
+        waited for a free slot in the queue.
+        """
+        duration = (self.endTime if self.endTime is not None
+                    else time.time()) - self.startTime
+        return {'frames': self.framesCount,
+                'bytes': self.bytesCount,
+                'fps': self.framesCount/duration if duration > 0 else 0,
+                'queueDepth': self.QueueDepth(),
+                'maxQueueDepth': self.maxQueueDepth,
+                'blockedTime': self.blockedTime}
 
     def Close(self):
-        """Close the stream and finalized the writing of the video."""
-        self.pipe.stdin.close()
-        if self.pipe.stderr is not None:
-            self.pipe.stderr.close()
+        """Close the stream and finalized the writing of the video.
+
+        Raise a RuntimeError if the encoder failed.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self.frameQueue.put(None)
+        self.feederThread.join()
+        try:
+            self.pipe.stdin.close()
+        except OSError:
+            pass
         self.pipe.wait()
+        self.stderrThread.join()
+        self.pipe.stderr.close()
+        self.endTime = time.time()
+        stats = self.GetStats()
+        self.logger.info('{}: {} frames encoded at {:.1f} frames/s (max queue '
+                         'depth {}, producer blocked {:.2f}s)'.format(
+                             self.outputPath, stats['frames'], stats['fps'],
+                             stats['maxQueueDepth'], stats['blockedTime']))
+        self._CheckError()
+
+    def _Enqueue(self, frame):
+        """Put the frame in the queue of the feeder thread."""
+        if self.closed:
+            raise RuntimeError('Frame added to the closed video {}'.format(
+                self.outputPath))
+        self._CheckError()
+        try:
+            self.frameQueue.put_nowait(frame)
+        except queue.Full:
+            startTime = time.time()
+            self.frameQueue.put(frame)
+            self.blockedTime += time.time() - startTime
+        self.maxQueueDepth = max(self.maxQueueDepth, self.QueueDepth())
+
+    def _CheckError(self):
+        """Raise a RuntimeError if the encoder failed."""
+        returncode = self.pipe.poll()
+        if returncode not in (None, 0):
+            self.error = 'ffmpeg exited with the code {}'.format(returncode)
+        if self.error is not None:
+            raise RuntimeError('Encoding of {} failed: {}\n{}'.format(
+                self.outputPath, self.error, '\n'.join(self.stderrTail)))
+
+    def _FeederThread(self):
+        """Write the frames of the queue to the encoder until None."""
+        while True:
+            frame = self.frameQueue.get()
+            if frame is None:
+                return
+            if self.error is not None:
+                # drop the frames so the producer is never blocked
+                continue
+            try:
+                self.pipe.stdin.write(memoryview(frame).cast('B'))
+                self.framesCount += 1
+                self.bytesCount += frame.nbytes
+            except (OSError, ValueError) as e:
+                self.error = 'write to ffmpeg failed ({})'.format(e)
 
     def __enter__(self):
         """Nothing to do when starting the stream."""
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        """Close the stream."""
-        self.Close()
+        """Close the stream.
+
+        An encoder failure does not hide an exception already raised in the
+        with block.
+        """
+        try:
+            self.Close()
+        except RuntimeError:
+            if exc_type is None:
+                raise
+            self.logger.exception('Encoding failed')
+
+
+class VideoRead(object):
+    """Decode a video and give its frames as (height, width, 3) RGB arrays.
+
+    The frames are decoded by ffmpeg and read from its stdout by a reader
+    thread, into a bounded queue: only queueSize frames are in memory at the
+    same time, whatever the length of the video.
+    """
+
+    def __init__(self, inputPath, width=None, height=None, fps=None,
+                 queueSize=DEFAULT_QUEUE_SIZE):
+        """Start the ffmpeg decoder.
+
+        :param width: width of the frames (default: width of the video)
+        :param height: height of the frames (default: height of the video)
+        :param fps: number of frames per second (default: frame rate of the
+        video), frames are duplicated or dropped to get this frame rate
+        :param queueSize: max number of decoded frames waiting to be read
+        """
+        self.logger = logging.getLogger('TestManager.Helpers.FFmpeg')
+        self.inputPath = inputPath
+        videoWidth, videoHeight, videoFps = ProbeVideo(inputPath)
+        self.width = width if width is not None else videoWidth
+        self.height = height if height is not None else videoHeight
+        self.fps = fps if fps is not None else videoFps
+        command = [ FFMPEG_BIN,
+                    '-i', inputPath,
+                    '-an', # do not decode the audio
+                    '-vf', 'scale={}:{}'.format(self.width, self.height),
+                    '-r', '{}'.format(self.fps),
+                    '-f', 'rawvideo',
+                    '-pix_fmt', 'rgb24',
+                    '-' ] # the output goes to a pipe
+        self.pipe = sp.Popen(command, stdout=sp.PIPE, stderr=sp.PIPE)
+        self.frameQueue = queue.Queue(maxsize=queueSize)
+        self.stderrTail = collections.deque(maxlen=STDERR_TAIL_SIZE)
+        self.error = None
+        self.closed = False
+        self.framesCount = 0
+        # set by the reader thread when ffmpeg closed its output
+        self.endOfStream = threading.Event()
+        self.readerThread = threading.Thread(target=self._ReaderThread,
+                                             daemon=True)
+        self.stderrThread = threading.Thread(
+            target=DrainStderr,
+            args=(self.pipe.stderr, self.stderrTail, self.logger),
+            daemon=True)
+        self.readerThread.start()
+        self.stderrThread.start()
+
+    def ReadFrame(self):
+        """Return the next frame, or None at the end of the video.
+
+        Raise a RuntimeError if the decoder failed.
+        """
+        if self.closed:
+            return None
+        frame = self.frameQueue.get()
+        if frame is None:
+            self.Close()
+            return None
+        self.framesCount += 1
+        return frame
+
+    def __iter__(self):
+        """Iterate over the frames of the video."""
+        while True:
+            frame = self.ReadFrame()
+            if frame is None:
+                return
+            yield frame
+
+    def Close(self):
+        """Stop the decoder.
+
+        Raise a RuntimeError if the decoder failed, or exited with an error
+        after the end of the video. A decoder stopped before the end of the
+        video is killed.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        # ffmpeg may still be running after the end of the video: it is
+        # waited for
+        stopped = not self.endOfStream.is_set()
+        if stopped or self.error is not None:
+            self.pipe.kill()
+        # unblock the reader thread if the queue is full
+        while self.readerThread.is_alive():
+            try:
+                self.frameQueue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        self.pipe.wait()
+        self.stderrThread.join()
+        self.pipe.stdout.close()
+        self.pipe.stderr.close()
+        if stopped and self.error is None:
+            # the errors caused by the kill are not failures
+            return
+        if self.error is None and self.pipe.returncode != 0:
+            self.error = 'ffmpeg exited with the code {}'.format(
+                self.pipe.returncode)
+        if self.error is not None:
+            raise RuntimeError('Decoding of {} failed: {}\n{}'.format(
+                self.inputPath, self.error, '\n'.join(self.stderrTail)))
+
+    def _ReaderThread(self):
+        """Read the decoded frames and put them in the queue until None."""
+        frameSize = self.width*self.height*3
+        try:
+            while True:
+                frame = np.empty((self.height, self.width, 3), dtype=np.uint8)
+                buffer_ = memoryview(frame).cast('B')
+                nbRead = 0
+                while nbRead < frameSize:
+                    n = self.pipe.stdout.readinto(buffer_[nbRead:])
+                    if not n:
+                        self.endOfStream.set()
+                        break
+                    nbRead += n
+                if nbRead < frameSize:
+                    if nbRead > 0:
+                        self.error = 'truncated frame'
+                    break
+                self.frameQueue.put(frame)
+        except (OSError, ValueError) as e:
+            self.error = 'read from ffmpeg failed ({})'.format(e)
+        finally:
+            self.frameQueue.put(None)
+
+    def __enter__(self):
+        """Nothing to do when starting the stream."""
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """Stop the decoder.
+
+        A decoder failure does not hide an exception already raised in the
+        with block.
+        """
+        try:
+            self.Close()
+        except RuntimeError:
+            if exc_type is None:
+                raise
+            self.logger.exception('Decoding failed')
@@ -0,0 +1,172 @@
+"""Render matrices as RGB video frames without matplotlib.
+
+A frame is a (height, width, 3) uint8 RGB array: the matrix is colored with
+a 256 entries colormap lookup table, resized to the size of the video and
+an optional caption is written with a small bitmap font.
+
+Author: Xavier Corbillon
+IMT Atlantique
+"""
+
+import numpy as np
+
+# segments of the matplotlib 'hot' colormap: (x, value) for each channel
+HOT_COLORMAP = (((0, 0.0416), (0.365079, 1), (1, 1)),
+                ((0, 0), (0.365079, 0), (0.746032, 1), (1, 1)),
+                ((0, 0), (0.746032, 0), (1, 1)))
+
+# 5x7 bitmap font used by the captions (unknown characters are blank)
+FONT_WIDTH = 5
+FONT_HEIGHT = 7
+FONT = {
+    '0': ('01110', '10001', '10011', '10101', '11001', '10001', '01110'),
+    '1': ('00100', '01100', '00100', '00100', '00100', '00100', '01110'),
+    '2': ('01110', '10001', '00001', '00010', '00100', '01000', '11111'),
+    '3': ('11111', '00010', '00100', '00010', '00001', '10001', '01110'),
+    '4': ('00010', '00110', '01010', '10010', '11111', '00010', '00010'),
+    '5': ('11111', '10000', '11110', '00001', '00001', '10001', '01110'),
+    '6': ('00110', '01000', '10000', '11110', '10001', '10001', '01110'),
+    '7': ('11111', '00001', '00010', '00100', '01000', '01000', '01000'),
+    '8': ('01110', '10001', '10001', '01110', '10001', '10001', '01110'),
+    '9': ('01110', '10001', '10001', '01111', '00001', '00010', '01100'),
+    '.': ('00000', '00000', '00000', '00000', '00000', '01100', '01100'),
+    '-': ('00000', '00000', '00000', '11111', '00000', '00000', '00000'),
+    ':': ('00000', '01100', '01100', '00000', '01100', '01100', '00000'),
+    'F': ('11111', '10000', '10000', '11110', '10000', '10000', '10000'),
+    'r': ('00000', '00000', '10110', '11001', '10000', '10000', '10000'),
+    'o': ('00000', '00000', '01110', '10001', '10001', '10001', '01110'),
+    'm': ('00000', '00000', '11010', '10101', '10101', '10001', '10001'),
+    't': ('01000', '01000', '11100', '01000', '01000', '01001', '00110'),
+    's': ('00000', '00000', '01110', '10000', '01110', '00001', '11110'),
+}
+
+# number of rows of the output interpolated at once by Resize
+RESIZE_BLOCK_ROWS = 64
+
+# default opacity of the heatmap where it is at its max value
+DEFAULT_OVERLAY_ALPHA = 0.6
+
+global_colormap_luts = dict()
+
+
+def GetColormapLut(segments=HOT_COLORMAP, size=256):
+    """Return the (size, 3) uint8 lookup table of a segmented colormap."""
+    global global_colormap_luts
+    if (segments, size) not in global_colormap_luts:
+        x = np.linspace(0, 1, size)
+        lut = np.empty((size, 3), dtype=np.uint8)
+        for channel, points in enumerate(segments):
+            xp, fp = zip(*points)
+            lut[:, channel] = np.rint(255*np.interp(x, xp, fp))
+        lut.setflags(write=False)
+        global_colormap_luts[(segments, size)] = lut
+    return global_colormap_luts[(segments, size)]
+
+
+def ApplyColormap(matrix, vmin, vmax, lut=None):
+    """Return the (h, w, 3) RGB picture of a (h, w) matrix.
+
+    The values are linearly mapped from [vmin, vmax] to the entries of the
+    lookup table (values out of the range are clipped).
+    """
+    if lut is None:
+        lut = GetColormapLut()
+    size = len(lut)
+    scale = size/(vmax - vmin) if vmax > vmin else 0
+    indexes = np.clip(((np.asarray(matrix) - vmin)*scale).astype(np.int64),
+                      0, size - 1)
+    return lut[indexes]
+
+
+def Resize(picture, width, height):
+    """Resize a (h, w, c) picture to (height, width, c).
+
+    Integer upscaling factors repeat the pixels, other sizes use a bilinear
+    resampling (computed by blocks of rows to bound the memory used for
+    large outputs). The dtype of the picture is kept.
+    """
+    h, w = picture.shape[:2]
+    if (h, w) == (height, width):
+        return picture
+    if height % h == 0 and width % w == 0:
+        return np.repeat(np.repeat(picture, height//h, axis=0),
+                         width//w, axis=1)
+    # position of the center of the output pixels in the input picture
+    y = np.clip((np.arange(height) + 0.5)*h/height - 0.5, 0, h - 1)
+    x = np.clip((np.arange(width) + 0.5)*w/width - 0.5, 0, w - 1)
+    y0 = np.floor(y).astype(np.int64)
+    x0 = np.floor(x).astype(np.int64)
+    y1 = np.minimum(y0 + 1, h - 1)
+    x1 = np.minimum(x0 + 1, w - 1)
+    wy = (y - y0).reshape((-1, 1) + (1,)*(picture.ndim - 2))
+    wx = (x - x0).reshape((1, -1) + (1,)*(picture.ndim - 2))
+    # interpolate the rows of the input along x, then between the rows
+    source = picture.astype(np.float64)
+    rows = source[:, x0]*(1 - wx) + source[:, x1]*wx
+    isInteger = np.issubdtype(picture.dtype, np.integer)
+    ans = np.empty((height, width) + picture.shape[2:], dtype=picture.dtype)
+    for start in range(0, height, RESIZE_BLOCK_ROWS):
+        block = slice(start, start + RESIZE_BLOCK_ROWS)
+        values = rows[y0[block]]*(1 - wy[block]) + rows[y1[block]]*wy[block]
+        ans[block] = np.rint(values) if isInteger else values
+    return ans
+
+
+def DrawText(picture, text, x, y, scale=1, color=(255, 255, 255)):
+    """Write the text on the picture (in place), top left corner at (x, y).
+
+    The characters are drawn with the FONT bitmaps scaled by scale.
+    """
+    for k, char in enumerate(text):
+        glyph = FONT.get(char)
+        if glyph is None:
+            continue
+        bitmap = np.array([[c == '1' for c in row] for row in glyph])
+        bitmap = np.repeat(np.repeat(bitmap, scale, axis=0), scale, axis=1)
+        left = x + k*(FONT_WIDTH + 1)*scale
+        area = picture[y:y + bitmap.shape[0], left:left + bitmap.shape[1]]
+        area[bitmap[:area.shape[0], :area.shape[1]]] = color
+    return picture
+
+
+def RenderFrame(matrix, vmin, vmax, width, height, caption=None,
+                lut=None):
+    """Return the (height, width, 3) uint8 RGB frame of the matrix.
+
+    :param caption: text written on a black band on top of the frame
+    """
+    frame = Resize(ApplyColormap(matrix, vmin, vmax, lut), width, height)
+    if caption is not None:
+        scale = max(1, height//(15*FONT_HEIGHT))
+        bandHeight = (FONT_HEIGHT + 2)*scale
+        frame = frame.copy()
+        frame[:bandHeight] = 0
+        DrawText(frame, caption, scale, scale, scale)
+    return frame
+
+
+def BlendHeatmap(frame, matrix, vmin, vmax, alpha=DEFAULT_OVERLAY_ALPHA,
+                 lut=None):
+    """Alpha-blend the heatmap of the matrix on the frame (in place).
+
+    The opacity of the heatmap grows linearly with the value of the matrix,
+    from 0 at vmin to alpha at vmax: the frame stays visible where the
+    matrix is low.
+
+    :param frame: (height, width, 3) uint8 RGB frame
+    :param matrix: (h, w) matrix, resized to the size of the frame
+    :return: the frame
+    """
+    height, width = frame.shape[:2]
+    matrix = np.asarray(matrix, dtype=np.float64)
+    opacity = np.clip((matrix - vmin)/(vmax - vmin), 0, 1)*alpha \
+        if vmax > vmin else np.zeros(matrix.shape)
+    colors = Resize(ApplyColormap(matrix, vmin, vmax, lut), width, height)
+    opacity = Resize(opacity.astype(np.float32)[:, :, np.newaxis], width,
+                     height)
+    for start in range(0, height, RESIZE_BLOCK_ROWS):
+        block = slice(start, start + RESIZE_BLOCK_ROWS)
+        blended = frame[block]*(1 - opacity[block]) + \
+            colors[block]*opacity[block]
+        frame[block] = np.rint(blended)
+    return frame
@@ -0,0 +1,105 @@
+"""Load the head movement logs through a binary cache.
+
+A log file contains one sample per line: "timestamp frameId w x y z". The
+first parsing of a log stores the samples in a structured numpy array in a
+sidecar .npy file next to the log. Next loads memory-map this file.
+
+Author: Xavier Corbillon
+IMT Atlantique
+"""
+
+import configparser
+import glob
+import logging
+import os
+import numpy as np
+
+LOG_DTYPE = np.dtype([('timestamp', np.float64),
+                      ('frameId', np.int64),
+                      ('w', np.float64),
+                      ('x', np.float64),
+                      ('y', np.float64),
+                      ('z', np.float64)])
+
+
+def GetCachePath(logPath):
+    """Return the path to the cache file of the log.
+
+    The cache file name contains the size and the modification time of the
+    log: a modified log has a new cache file.
+    """
+    stat = os.stat(logPath)
+    dirPath, basename = os.path.split(logPath)
+    fileName, extension = os.path.splitext(basename)
+    return os.path.join(dirPath, '.{}_{}_{}.npy'.format(fileName,
+                                                        stat.st_size,
+                                                        stat.st_mtime_ns))
+
+
+def GetStartOffsetInSecond(logPath):
+    """Get the start offset in seconds of the video from the test config.
+
+    The config file of the test is <folder of the log>.ini
+    """
+    pathToOsvrClientIni = '{}.ini'.format(os.path.dirname(logPath))
+    configParser = configparser.ConfigParser()
+    configParser.read(pathToOsvrClientIni)
+    videoConfigSection = configParser['Config']['textureConfig']
+    return float(configParser[videoConfigSection]['startOffsetInSecond'])
+
+
+def ParseLog(logPath):
+    """Parse the log and return a structured array of dtype LOG_DTYPE."""
+    if os.path.getsize(logPath) == 0:
+        return np.zeros(0, dtype=LOG_DTYPE)
+    return np.loadtxt(logPath, dtype=LOG_DTYPE, usecols=range(6), ndmin=1)
+
+
+def LoadCacheFile(cachePath):
+    """Return the samples stored in the cache file (memory-mapped).
+
+    Raise a ValueError (or an OSError) if the cache file is damaged.
+    """
+    try:
+        samples = np.load(cachePath, mmap_mode='r')
+    except ValueError:
+        # empty arrays cannot be memory-mapped
+        samples = np.load(cachePath)
+    if samples.dtype != LOG_DTYPE or samples.ndim != 1:
+        raise ValueError('not an array of samples')
+    return samples
+
+
+def LoadLog(logPath, useCache=True):
+    """Return the samples of the log as a structured array.
+
+    :param useCache: if True, read the samples from the cache file if it is
+    up-to-date, otherwise parse the log and write the cache file. A damaged
+    cache file is logged and written again.
+    """
+    if not useCache:
+        return ParseLog(logPath)
+    cachePath = GetCachePath(logPath)
+    if os.path.exists(cachePath):
+        try:
+            return LoadCacheFile(cachePath)
+        except (OSError, ValueError, EOFError) as e:
+            logging.getLogger('TestManager.Helpers.LogCache').warning(
+                'Ignore the damaged cache file {}: {}'.format(cachePath, e))
+    samples = ParseLog(logPath)
+    dirPath, basename = os.path.split(logPath)
+    fileName, extension = os.path.splitext(basename)
+    for oldCachePath in glob.glob(os.path.join(dirPath,
+                                               '.{}_*.npy'.format(fileName))):
+        os.remove(oldCachePath)
+    tmpPath = '{}.{}.tmp'.format(cachePath, os.getpid())
+    try:
+        with open(tmpPath, 'wb') as o:
+            np.save(o, samples)
+        os.replace(tmpPath, cachePath)
+    except OSError as e:
+        logging.getLogger('TestManager.Helpers.LogCache').warning(
+            'Cannot write the cache file {}: {}'.format(cachePath, e))
+        if os.path.exists(tmpPath):
+            os.remove(tmpPath)
+    return samples
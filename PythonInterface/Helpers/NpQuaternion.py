@@ -0,0 +1,128 @@
+"""NumPy implementation of the Helpers.CQuaternion module.
+
+This module is used when the compiled CQuaternion module is not available.
+It exposes the same Vector and Quaternion classes and the same Compute*
+functions.
+
+Author: Xavier Corbillon
+IMT Atlantique
+"""
+
+from .Quaternion import Vector, Quaternion, QuaternionArray
+from .Vision import GetPixelDirections, GetViewportNormals, ViewportMasks
+from . import Trajectory
+import math
+import numpy as np
+
+# max number of float64 values of a temporary array used by the vision
+# computation (~64 MB)
+MAX_CHUNK_VALUES = 8 * 1024 * 1024
+
+
+def _GetTimestampsAndQuaternions(filteredQuaternions):
+    """Return the sorted timestamps and the QuaternionArray of a dict."""
+    timestamps = np.array(sorted(filteredQuaternions.keys()),
+                          dtype=np.float64)
+    quaternions = QuaternionArray.FromQuaternions(
+        filteredQuaternions[t] for t in timestamps.tolist())
+    return timestamps, quaternions.Normalize()
+
+
+def ComputeVision(filteredQuaternions, width, height,
+                  horizontalFoVAngle, verticalFoVAngle):
+    """Compute the vision matrix of the filteredQuaternions.
+
+    :param filteredQuaternions: dict timestamp: Quaternion
+    :return: a (width, height) array: ans[i][j] is the probability of
+    vision of the pixel (i, j)
+    """
+    ans = np.zeros(width*height)
+    length = len(filteredQuaternions)
+    if length == 0:
+        return ans.reshape(width, height)
+    _, quaternions = _GetTimestampsAndQuaternions(filteredQuaternions)
+    directions = GetPixelDirections(width, height)
+    normals = GetViewportNormals(horizontalFoVAngle, verticalFoVAngle)
+    for _, masks in ViewportMasks(quaternions, directions, normals):
+        hitsCount = masks.sum(axis=1)
+        weights = np.zeros(hitsCount.shape)
+        weights[hitsCount > 0] = 1.0/(length*hitsCount[hitsCount > 0])
+        ans += np.dot(weights, masks)
+    return ans.reshape(width, height)
+
+
+def ComputeMaxOrthodromicDistances(filteredQuaternions, segSizeList):
+    """Compute the max orthodromic distance on moving windows.
+
+    See Trajectory.ComputeMaxOrthodromicDistances.
+
+    :param filteredQuaternions: dict timestamp: Quaternion
+    :param segSizeList: the list of segment size to use
+    :return: dict segSize: list of max orthodromic distances sorted by
+    timestamps
+    """
+    if len(filteredQuaternions) == 0:
+        return dict((float(segSize), list()) for segSize in segSizeList)
+    timestamps, quaternions = \
+        _GetTimestampsAndQuaternions(filteredQuaternions)
+    return dict((segSize, distances.tolist()) for segSize, distances in
+                Trajectory.ComputeMaxOrthodromicDistances(
+                    timestamps, quaternions, segSizeList).items())
+
+
+def _VisionDistances(masks, pixelWeights):
+    """Return the list of weighted distances between each pair of masks."""
+    weightedMasks = masks * pixelWeights[np.newaxis, :]
+    areas = weightedMasks.sum(axis=1)
+    intersections = np.dot(weightedMasks, masks.T.astype(np.float64))
+    distances = areas[:, np.newaxis] + areas[np.newaxis, :] - \
+        2*intersections
+    k = masks.shape[0]
+    offDiagonal = ~np.eye(k, dtype=bool)
+    return distances[offDiagonal].tolist()
+
+
+def ComputeVisionDistanceCdfs(listOfFilteredQuaternions, width, height,
+                              horizontalFoVAngle, verticalFoVAngle):
+    """Compute the distance between the vision of each pair of users.
+
+    :param listOfFilteredQuaternions: list of dict timestamp: Quaternion
+    :return: dict timestamp: list of distances for each ordered pair of
+    filtered quaternions dict that contains this timestamp
+    """
+    countMap = dict()
+    for filteredQuaternions in listOfFilteredQuaternions:
+        for timestamp in filteredQuaternions:
+            countMap[timestamp] = countMap.get(timestamp, 0) + 1
+    timestampList = sorted(t for t in countMap if countMap[t] >= 2)
+    ans = dict()
+    if len(timestampList) == 0:
+        return ans
+    directions = GetPixelDirections(width, height)
+    normals = GetViewportNormals(horizontalFoVAngle, verticalFoVAngle)
+    phi = (math.pi*np.arange(height))/height
+    pixelWeights = np.tile(2*math.pi*math.pi*np.sin(phi)/(width*height),
+                           width)
+    nbPixels = width*height
+    chunkSize = max(1, MAX_CHUNK_VALUES //
+                    (nbPixels*len(listOfFilteredQuaternions)))
+    for start in range(0, len(timestampList), chunkSize):
+        chunkTimestamps = timestampList[start:start+chunkSize]
+        # masksPerDict[k][timestamp] = vision mask of the user k
+        masksPerDict = list()
+        for filteredQuaternions in listOfFilteredQuaternions:
+            present = [t for t in chunkTimestamps if t in filteredQuaternions]
+            masksPerDict.append(dict())
+            if len(present) == 0:
+                continue
+            quaternions = QuaternionArray.FromQuaternions(
+                filteredQuaternions[t] for t in present).Normalize()
+            for first, masks in ViewportMasks(quaternions, directions,
+                                               normals):
+                for k in range(masks.shape[0]):
+                    masksPerDict[-1][present[first+k]] = masks[k]
+        for timestamp in chunkTimestamps:
+            masks = np.array([m[timestamp] for m in masksPerDict
+                              if timestamp in m])
+            ans[timestamp] = _VisionDistances(masks, pixelWeights)
+    return ans
@@ -0,0 +1,137 @@
+"""Mergeable quantile sketch to compute CDFs with a bounded memory.
+
+The sketch is a KLL sketch: a stack of compactors, the items stored at the
+level h have a weight 2^h. When a level is full, it is sorted and one item
+out of two is promoted to the next level. Two sketches built with the same
+epsilon can be merged. As long as no level was compacted the sketch stores
+all the items and the percentiles are exact (same as np.percentile). The
+min and the max of the items are always kept: the 0-th and 100-th
+percentiles are exact.
+
+Author: Xavier Corbillon
+IMT Atlantique
+"""
+
+import math
+import numpy as np
+
+# default rank error of the sketches (0.1%)
+DEFAULT_EPSILON = 0.001
+
+
+class QuantileSketch(object):
+    """Approximate percentiles of a stream of values."""
+
+    def __init__(self, epsilon=DEFAULT_EPSILON):
+        """Init an empty sketch.
+
+        :param epsilon: target error on the rank of the returned
+        percentiles, as a fraction of the number of items. The memory used
+        by the sketch grows like 1/epsilon.
+        """
+        self.epsilon = epsilon
+        self.k = max(8, int(math.ceil(2.0/epsilon)))
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+        self.levels = [np.zeros(0)]
+        self.offsets = [0]
+
+    def __len__(self):
+        """Number of items added to the sketch."""
+        return self.count
+
+    def IsExact(self):
+        """Return True if the sketch still contains all the items."""
+        return len(self.levels) == 1
+
+    def Update(self, values):
+        """Add the values (a scalar or an array) to the sketch."""
+        values = np.asarray(values, dtype=np.float64).ravel()
+        if len(values) == 0:
+            return self
+        self.count += len(values)
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+        self.levels[0] = np.concatenate((self.levels[0], values))
+        self.__Compress()
+        return self
+
+    def Merge(self, other):
+        """Add all the items of the other sketch to this sketch."""
+        if other.k != self.k:
+            raise ValueError('Cannot merge sketches with different epsilon')
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        for h, level in enumerate(other.levels):
+            if h == len(self.levels):
+                self.levels.append(np.zeros(0))
+                self.offsets.append(0)
+            self.levels[h] = np.concatenate((self.levels[h], level))
+        self.__Compress()
+        return self
+
+    def Copy(self):
+        """Return a copy of the sketch."""
+        sketch = QuantileSketch(self.epsilon)
+        sketch.count = self.count
+        sketch.min = self.min
+        sketch.max = self.max
+        sketch.levels = [level.copy() for level in self.levels]
+        sketch.offsets = list(self.offsets)
+        return sketch
+
+    def Percentile(self, q):
+        """Return the q-th percentiles (q a scalar or an array in [0, 100]).
+
+        Use the same linear interpolation than np.percentile. The
+        interpolated values are clamped to the exact min and max.
+        """
+        if self.count == 0:
+            raise ValueError('Percentile of an empty sketch')
+        if self.IsExact():
+            return np.percentile(self.levels[0], q)
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(level), 2**h)
+                                  for h, level in enumerate(self.levels)])
+        order = np.argsort(values, kind='stable')
+        values = values[order]
+        cumulativeWeights = np.cumsum(weights[order])
+        # virtual index of the percentile in the sorted list of the items
+        rank = np.asarray(q, dtype=np.float64)/100 * (self.count - 1)
+        lowRank = np.floor(rank)
+        low = values[np.searchsorted(cumulativeWeights, lowRank,
+                                     side='right')]
+        high = values[np.searchsorted(cumulativeWeights,
+                                      np.minimum(lowRank + 1, self.count - 1),
+                                      side='right')]
+        ans = np.clip(low + (high - low) * (rank - lowRank), self.min,
+                      self.max)
+        q = np.asarray(q)
+        return np.where(q <= 0, self.min,
+                        np.where(q >= 100, self.max, ans))[()]
+
+    def __Capacity(self, h):
+        """Maximum number of items at the level h."""
+        depth = len(self.levels) - 1 - h
+        return max(2, int(math.ceil(self.k * (2/3)**depth)))
+
+    def __Compress(self):
+        """Compact the levels that are over their capacity."""
+        h = 0
+        while h < len(self.levels):
+            level = self.levels[h]
+            if len(level) > self.__Capacity(h):
+                if h + 1 == len(self.levels):
+                    self.levels.append(np.zeros(0))
+                    self.offsets.append(0)
+                level = np.sort(level)
+                # with an odd number of items the largest one stays
+                nbCompacted = len(level) - len(level) % 2
+                promoted = level[self.offsets[h]:nbCompacted:2]
+                self.offsets[h] = 1 - self.offsets[h]
+                self.levels[h] = level[nbCompacted:]
+                self.levels[h+1] = np.concatenate((self.levels[h+1],
+                                                   promoted))
+            h += 1
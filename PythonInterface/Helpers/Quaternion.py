@@ -5,6 +5,7 @@ IMT Atlantique
 """
 
 import math
+import numpy as np
 
 
 class Vector(object):
@@ -18,7 +19,9 @@ class Vector(object):
 
     def __mul__(self, s_v):
         """Scalar muliplication or ScalarProduct if s is a vector."""
-        if isinstance(s_v, Vector):
+        if isinstance(s_v, (VectorArray, QuaternionArray)):
+            return NotImplemented
+        elif isinstance(s_v, Vector):
             return Vector.ScalarProduct(s_v, self)
         elif isinstance(s_v, Quaternion):
             return Quaternion(v=self)*s_v
@@ -79,6 +82,24 @@ class Vector(object):
         phi = math.acos(self.z/self.Norm())
         return (theta, phi)
 
+    ToSpherical = ToPolar
+
+    def DotProduct(self, v):
+        """Scalar product of self and v."""
+        return Vector.ScalarProduct(self, v)
+
+    def VectorProduct(self, v):
+        """Vector product of self and v (self is the left-hand vector)."""
+        return Vector.VectorProduct(self, v)
+
+    @staticmethod
+    def FromSpherical(theta, phi):
+        """Return the unit vector of azimuth theta and inclination phi."""
+        sinP = math.sin(phi)
+        return Vector(x=sinP*math.cos(theta),
+                      y=sinP*math.sin(theta),
+                      z=math.cos(phi))
+
     @staticmethod
     def ScalarProduct(v1, v2):
         """Scalar product of two vector."""
@@ -105,6 +126,8 @@ class Quaternion(object):
         """Dot product of two quaternions."""
         return self.w * other.w + Vector.ScalarProduct(self.v, other.v)
 
+    DotProduct = Dot
+
     def Norm(self):
         """Return the norm of the quaternion."""
         if self.IsNormalized():
@@ -126,6 +149,8 @@ class Quaternion(object):
 
         other is a Quaternion, an integer, a float or a long.
         """
+        if isinstance(other, (VectorArray, QuaternionArray)):
+            return NotImplemented
         if not isinstance(other, Quaternion):
             if isinstance(other, Vector):
                 other = Quaternion(v=other)
@@ -202,8 +227,7 @@ class Quaternion(object):
         """Return a vector v' result of the rotation the vector v by self."""
         self.Normalize()
         v2 = self*v*self.Conj()
-        v2.w = 0
-        return v2
+        return v2.v
 
     def __pow__(self, k):
         """Define the power of a quaternion with k a real."""
@@ -243,8 +267,8 @@ class Quaternion(object):
     def OrthodromicDistance(q1, q2):
         """Compute the orthodromic dist between two rotation quaternions."""
         origine = Vector(x=1, y=0, z=0)
-        p1 = q1.Rotation(origine)
-        p2 = q2.Rotation(origine)
+        p1 = Quaternion(v=q1.Rotation(origine))
+        p2 = Quaternion(v=q2.Rotation(origine))
         p = p1 * p2
         # this below works because p1 and p2 are pur
         dotProd = -p.w
@@ -258,6 +282,15 @@ class Quaternion(object):
             q2 = -q2
         return q1 * (q1.Inv() * q2)**k
 
+    @staticmethod
+    def AverageAngularVelocity(q1, q2, deltaT):
+        """Compute the average angular velocity vector.
+
+        Same as the AverageAngularVelocity function but return only the
+        vector part (as the Helpers.CQuaternion module does).
+        """
+        return AverageAngularVelocity(q1, q2, deltaT).v
+
 
 def AverageAngularVelocity(q1, q2, deltaT):
     """Compute the average angular velocity.
@@ -269,11 +302,395 @@ def AverageAngularVelocity(q1, q2, deltaT):
     if q1.Dot(q2) < 0:
         q2 = -q2
     if not q1.IsPur():
-        q1 = q1.Rotation(Vector(1, 0, 0))
+        q1 = Quaternion(v=q1.Rotation(Vector(1, 0, 0)))
     if not q2.IsPur():
-        q2 = q2.Rotation(Vector(1, 0, 0))
+        q2 = Quaternion(v=q2.Rotation(Vector(1, 0, 0)))
     deltaQ = q2 - q1
     # deltaQ = q2*q1.Inv()
     # W = ((deltaQ*2)/deltaT)*q2.Inv()
     W = (2 * deltaQ / deltaT)*q1.Inv()
     return W
+
+
+class VectorArray(object):
+    """This class represent N vectors from R3 stored in a (N, 3) array."""
+
+    def __init__(self, xyz=np.zeros((0, 3))):
+        """Init function.
+
+        :param xyz: array-like of shape (N, 3) or (3,)
+        """
+        self.xyz = np.ascontiguousarray(xyz, dtype=np.float64).reshape(-1, 3)
+
+    @property
+    def x(self):
+        """Return the x coordinates as a (N,) array."""
+        return self.xyz[:, 0]
+
+    @property
+    def y(self):
+        """Return the y coordinates as a (N,) array."""
+        return self.xyz[:, 1]
+
+    @property
+    def z(self):
+        """Return the z coordinates as a (N,) array."""
+        return self.xyz[:, 2]
+
+    def __len__(self):
+        """Number of vectors stored."""
+        return self.xyz.shape[0]
+
+    def __getitem__(self, index):
+        """Return a Vector for an integer index, a VectorArray otherwise."""
+        if isinstance(index, (int, np.integer)):
+            x, y, z = self.xyz[index]
+            return Vector(x=float(x), y=float(y), z=float(z))
+        return VectorArray(self.xyz[index])
+
+    def __mul__(self, s_v):
+        """Scalar multiplication or ScalarProduct if s_v is a vector(s).
+
+        s_v can be a scalar, a (N,) array of scalars, a Vector or a
+        VectorArray.
+        """
+        if isinstance(s_v, (Vector, VectorArray)):
+            return VectorArray.ScalarProduct(self, s_v)
+        elif isinstance(s_v, (Quaternion, QuaternionArray)):
+            return QuaternionArray.FromVectorArray(self) * s_v
+        else:
+            return VectorArray(_AsColumn(s_v) * self.xyz)
+
+    def __rmul__(self, s_v):
+        """Reverse multiplication."""
+        if isinstance(s_v, Quaternion):
+            return s_v * QuaternionArray.FromVectorArray(self)
+        return self.__mul__(s_v)
+
+    def __truediv__(self, s):
+        """Divide by a scalar or by a (N,) array of scalars."""
+        return VectorArray(self.xyz / _AsColumn(s))
+
+    def __xor__(self, v):
+        """Vectorial product (self is the left-hand vector)."""
+        return VectorArray.VectorProduct(self, v)
+
+    def __add__(self, v):
+        """Addition of two vectors."""
+        return VectorArray(self.xyz + _AsXyz(v))
+
+    def __sub__(self, v):
+        """Substraction of two vectors."""
+        return VectorArray(self.xyz - _AsXyz(v))
+
+    def __neg__(self):
+        """Return -v."""
+        return VectorArray(-self.xyz)
+
+    def __str__(self):
+        """To string function."""
+        return str(self.xyz)
+
+    def Norm(self):
+        """Return the norms of the vectors as a (N,) array."""
+        return np.sqrt(np.einsum('ij,ij->i', self.xyz, self.xyz))
+
+    def ToSpherical(self):
+        """Return theta and phi (two (N,) arrays) of the vectors.
+
+        theta = azimuth
+        phi = inclination
+        """
+        theta = np.arctan2(self.y, self.x)
+        phi = np.arccos(np.clip(self.z/self.Norm(), -1, 1))
+        return (theta, phi)
+
+    @staticmethod
+    def FromSpherical(theta, phi):
+        """Build the unit vectors from the arrays theta and phi."""
+        theta = np.asarray(theta, dtype=np.float64).ravel()
+        phi = np.asarray(phi, dtype=np.float64).ravel()
+        sinP = np.sin(phi)
+        return VectorArray(np.stack((sinP*np.cos(theta),
+                                     sinP*np.sin(theta),
+                                     np.cos(phi)), axis=-1))
+
+    @staticmethod
+    def FromVectors(vectorList):
+        """Build a VectorArray from an iterable of Vector."""
+        return VectorArray(np.array([(v.x, v.y, v.z) for v in vectorList],
+                                    dtype=np.float64).reshape(-1, 3))
+
+    def ToVectors(self, vectorClass=Vector):
+        """Return a list of vectorClass objects (Vector by default)."""
+        return [vectorClass(x, y, z) for x, y, z in self.xyz.tolist()]
+
+    @staticmethod
+    def ScalarProduct(v1, v2):
+        """Scalar product of two vectors, return a (N,) array."""
+        return np.einsum('ij,ij->i',
+                         *np.broadcast_arrays(_AsXyz(v1), _AsXyz(v2)))
+
+    @staticmethod
+    def VectorProduct(v1, v2):
+        """Vector product of two vectors."""
+        return VectorArray(np.cross(_AsXyz(v1), _AsXyz(v2)))
+
+
+class QuaternionArray(object):
+    """This class represent N quaternions stored in a (N, 4) array.
+
+    Each row is (w, x, y, z). The operations are vectorized versions of the
+    ones of the Quaternion class.
+    """
+
+    def __init__(self, wxyz=np.zeros((0, 4))):
+        """Init function.
+
+        :param wxyz: array-like of shape (N, 4) or (4,)
+        """
+        self.wxyz = np.ascontiguousarray(wxyz,
+                                         dtype=np.float64).reshape(-1, 4)
+
+    @property
+    def w(self):
+        """Return the real parts as a (N,) array."""
+        return self.wxyz[:, 0]
+
+    @property
+    def v(self):
+        """Return the imaginary parts as a VectorArray."""
+        return VectorArray(self.wxyz[:, 1:])
+
+    def __len__(self):
+        """Number of quaternions stored."""
+        return self.wxyz.shape[0]
+
+    def __getitem__(self, index):
+        """Return a Quaternion for an integer index, a QuaternionArray else."""
+        if isinstance(index, (int, np.integer)):
+            w, x, y, z = self.wxyz[index]
+            return Quaternion(w=float(w),
+                              v=Vector(x=float(x), y=float(y), z=float(z)))
+        return QuaternionArray(self.wxyz[index])
+
+    def Dot(self, other):
+        """Dot product of two quaternions, return a (N,) array."""
+        return np.einsum('ij,ij->i',
+                         *np.broadcast_arrays(self.wxyz, _AsWxyz(other)))
+
+    def Norm(self):
+        """Return the norms of the quaternions as a (N,) array."""
+        return np.sqrt(np.einsum('ij,ij->i', self.wxyz, self.wxyz))
+
+    def Normalize(self):
+        """Return a new QuaternionArray with unit quaternions."""
+        return QuaternionArray(self.wxyz / self.Norm()[:, np.newaxis])
+
+    def __mul__(self, other):
+        """Hamilton product (self is the left-hand quaternion).
+
+        other is a QuaternionArray, a Quaternion, a VectorArray, a Vector, a
+        scalar or a (N,) array of scalars.
+        """
+        if isinstance(other, (Quaternion, QuaternionArray,
+                              Vector, VectorArray)):
+            return QuaternionArray(_HamiltonProduct(self.wxyz,
+                                                    _AsWxyz(other)))
+        return QuaternionArray(_AsColumn(other) * self.wxyz)
+
+    def __rmul__(self, other):
+        """Hamilton product (other is the left-hand quaternion)."""
+        if isinstance(other, (Quaternion, Vector)):
+            return QuaternionArray(_HamiltonProduct(_AsWxyz(other),
+                                                    self.wxyz))
+        return self.__mul__(other)
+
+    def __truediv__(self, s):
+        """Divide by a scalar or by a (N,) array of scalars."""
+        return QuaternionArray(self.wxyz / _AsColumn(s))
+
+    def __add__(self, other):
+        """Addition of two quaternions."""
+        return QuaternionArray(self.wxyz + _AsWxyz(other))
+
+    def __sub__(self, other):
+        """Substraction of two quaternions."""
+        return QuaternionArray(self.wxyz - _AsWxyz(other))
+
+    def __neg__(self):
+        """Return -q."""
+        return QuaternionArray(-self.wxyz)
+
+    def __str__(self):
+        """To string function."""
+        return str(self.wxyz)
+
+    def Conj(self):
+        """Return the conjugates."""
+        return QuaternionArray(self.wxyz * np.array([1.0, -1.0, -1.0, -1.0]))
+
+    def Inv(self):
+        """Return the inverses."""
+        return self.Conj() / np.einsum('ij,ij->i', self.wxyz, self.wxyz)
+
+    def Rotation(self, v):
+        """Return the VectorArray result of the rotation of v by self.
+
+        v can be a single Vector (rotated by every quaternion) or a
+        VectorArray of the same length.
+        """
+        q = self.Normalize().wxyz
+        w = q[:, 0:1]
+        u = q[:, 1:]
+        p = _AsXyz(v)
+        # v' = v + w*t + u x t with t = 2 * u x v
+        t = 2 * np.cross(u, p)
+        return VectorArray(p + w * t + np.cross(u, t))
+
+    def RotationMatrices(self):
+        """Return the (N,3,3) array of the rotation matrices.
+
+        The column i of the matrix n is the vector e_i rotated by the
+        normalized quaternion n (i.e. R[n] @ v == self[n].Rotation(v)).
+        """
+        w, x, y, z = self.Normalize().wxyz.T
+        r = np.empty((len(w), 3, 3))
+        r[:, 0, 0] = 1 - 2*(y*y + z*z)
+        r[:, 0, 1] = 2*(x*y - w*z)
+        r[:, 0, 2] = 2*(x*z + w*y)
+        r[:, 1, 0] = 2*(x*y + w*z)
+        r[:, 1, 1] = 1 - 2*(x*x + z*z)
+        r[:, 1, 2] = 2*(y*z - w*x)
+        r[:, 2, 0] = 2*(x*z - w*y)
+        r[:, 2, 1] = 2*(y*z + w*x)
+        r[:, 2, 2] = 1 - 2*(x*x + y*y)
+        return r
+
+    def __pow__(self, k):
+        """Define the power of the quaternions with k a real or (N,) array."""
+        return QuaternionArray.Exp(QuaternionArray.Log(self) * k)
+
+    @staticmethod
+    def Exp(q):
+        """Exponential function for quaternions.
+
+        As Quaternion.Exp (and the C++ CQuaternion module), only the real
+        part is scaled by exp(w): the result is the exponential for the pur
+        quaternions (the logarithms of unit quaternions used by pow).
+        """
+        expW = np.exp(q.w)
+        normV = q.v.Norm()
+        # if normV == 0 then q is a real number
+        scale = np.ones(normV.shape)
+        nonReal = normV != 0
+        scale[nonReal] = np.sin(normV[nonReal])/normV[nonReal]
+        out = np.empty(q.wxyz.shape)
+        out[:, 0] = np.cos(normV)*expW
+        out[:, 1:] = scale[:, np.newaxis] * q.wxyz[:, 1:]
+        return QuaternionArray(out)
+
+    @staticmethod
+    def Log(q):
+        """Logarithm of quaternions."""
+        normQ = q.Norm()
+        normV = q.v.Norm()
+        # if normV == 0 then q is a real number
+        scale = np.ones(normV.shape)
+        nonReal = normV != 0
+        scale[nonReal] = \
+            np.arccos(np.clip(q.w[nonReal]/normQ[nonReal], -1, 1)) / \
+            normV[nonReal]
+        out = np.empty(q.wxyz.shape)
+        out[:, 0] = np.log(normQ)
+        out[:, 1:] = scale[:, np.newaxis] * q.wxyz[:, 1:]
+        return QuaternionArray(out)
+
+    @staticmethod
+    def Distance(q1, q2):
+        """Distance between two quaternions, return a (N,) array."""
+        return QuaternionArray(_AsWxyz(q2) - _AsWxyz(q1)).Norm()
+
+    @staticmethod
+    def OrthodromicDistance(q1, q2):
+        """Compute the orthodromic dists between two rotation quaternions."""
+        origine = Vector(x=1, y=0, z=0)
+        p1 = _AsQuaternionArray(q1).Rotation(origine).xyz
+        p2 = _AsQuaternionArray(q2).Rotation(origine).xyz
+        p1, p2 = np.broadcast_arrays(p1, p2)
+        dotProd = np.einsum('ij,ij->i', p1, p2)
+        vectProd = np.cross(p1, p2)
+        return np.arctan2(np.sqrt(np.einsum('ij,ij->i', vectProd, vectProd)),
+                          dotProd)
+
+    @staticmethod
+    def SLERP(q1, q2, k):
+        """Compute the slerp interpolation of q1, q2 with weights k."""
+        q1 = _AsQuaternionArray(q1)
+        q2 = _AsQuaternionArray(q2)
+        sign = np.where(q1.Dot(q2) < 0, -1.0, 1.0)
+        return q1 * (q1.Inv() * (q2 * sign))**k
+
+    @staticmethod
+    def FromVectorArray(v):
+        """Build pur quaternions from a VectorArray."""
+        xyz = _AsXyz(v)
+        return QuaternionArray(np.hstack((np.zeros((xyz.shape[0], 1)), xyz)))
+
+    @staticmethod
+    def FromQuaternions(quaternionList):
+        """Build a QuaternionArray from an iterable of Quaternion."""
+        return QuaternionArray(np.array([(q.w, q.v.x, q.v.y, q.v.z)
+                                         for q in quaternionList],
+                                        dtype=np.float64).reshape(-1, 4))
+
+    def ToQuaternions(self, quaternionClass=Quaternion, vectorClass=Vector):
+        """Return a list of quaternionClass objects (Quaternion by default)."""
+        return [quaternionClass(w, vectorClass(x, y, z))
+                for w, x, y, z in self.wxyz.tolist()]
+
+
+def _AsColumn(s):
+    """Return s as a scalar or as a (N, 1) column for broadcasting."""
+    s = np.asarray(s, dtype=np.float64)
+    return s[:, np.newaxis] if s.ndim == 1 else s
+
+
+def _AsXyz(v):
+    """Return the (N, 3) array of a Vector or a VectorArray."""
+    if isinstance(v, VectorArray):
+        return v.xyz
+    elif isinstance(v, Vector):
+        return np.array([[v.x, v.y, v.z]], dtype=np.float64)
+    return np.asarray(v, dtype=np.float64).reshape(-1, 3)
+
+
+def _AsWxyz(q):
+    """Return the (N, 4) array of a quaternion, a vector or an array of them."""
+    if isinstance(q, QuaternionArray):
+        return q.wxyz
+    elif isinstance(q, Quaternion):
+        return np.array([[q.w, q.v.x, q.v.y, q.v.z]], dtype=np.float64)
+    elif isinstance(q, (Vector, VectorArray)):
+        return QuaternionArray.FromVectorArray(q).wxyz
+    return np.asarray(q, dtype=np.float64).reshape(-1, 4)
+
+
+def _AsQuaternionArray(q):
+    """Return q as a QuaternionArray."""
+    if isinstance(q, QuaternionArray):
+        return q
+    return QuaternionArray(_AsWxyz(q))
+
+
+def _HamiltonProduct(a, b):
+    """Hamilton product of two (N, 4) arrays (broadcasting on N)."""
+    a, b = np.broadcast_arrays(a, b)
+    w1, x1, y1, z1 = a[:, 0], a[:, 1], a[:, 2], a[:, 3]
+    w2, x2, y2, z2 = b[:, 0], b[:, 1], b[:, 2], b[:, 3]
+    out = np.empty(a.shape)
+    out[:, 0] = w1*w2 - x1*x2 - y1*y2 - z1*z2
+    out[:, 1] = w1*x2 + x1*w2 + y1*z2 - z1*y2
+    out[:, 2] = w1*y2 - x1*z2 + y1*w2 + z1*x2
+    out[:, 3] = w1*z2 + x1*y2 - y1*x2 + z1*w2
+    return out
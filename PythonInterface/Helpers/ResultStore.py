@@ -0,0 +1,293 @@
+"""Crash-safe storage of the cached statistics.
+
+A dump file holds one object stored with dill, followed by a checksum
+footer: the magic string DUMP_FOOTER_MAGIC and the md5 digest of the
+pickled bytes. A dump file is written in a temporary file published with
+os.replace: a killed process never leaves a truncated dump, and a damaged
+dump is detected by its checksum when it is read.
+
+A store is a directory of named numpy arrays made of:
+ - one <name>.npy file per array, memory-mapped when it is loaded,
+ - a meta.dump dump file with the schema version of the store, the md5 of
+   each .npy file and a dict of small python objects (scalars, sketches,
+   ...).
+
+The arrays are loaded one by one, when they are needed. When a store is
+opened the size of each .npy file is checked against its header, the
+checksum of an array is checked the first time it is loaded. A damaged
+store is logged and invalidated (its meta.dump is removed): it is not
+opened anymore and its users compute it again.
+
+A store is replaced as a whole: the new store is written in a temporary
+directory, the old store is moved away and the new one is renamed in
+place. The arrays memory-mapped from the old store stay valid. A process
+killed between the two renames leaves no store: it is computed again by
+the next run.
+
+Author: Xavier Corbillon
+IMT Atlantique
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+import dill
+import numpy as np
+
+# increase it when the layout of the stores changes: the stores with an
+# other schema version are ignored (and written again by their users)
+STORE_SCHEMA_VERSION = 2
+
+META_FILE_NAME = 'meta.dump'
+
+DUMP_FOOTER_MAGIC = b'\nDUMPMD5'
+DUMP_FOOTER_SIZE = len(DUMP_FOOTER_MAGIC) + hashlib.md5().digest_size
+
+# size of the blocks read to compute the checksum of a file
+CHECKSUM_BLOCK_SIZE = 1024 * 1024
+
+
+def WriteFileAtomically(filePath, data):
+    """Write data (bytes) in the file filePath.
+
+    The data are written in a temporary file synced on the disk then
+    renamed: filePath contains either its old content or data.
+    """
+    tmpPath = '{}.{}.tmp'.format(filePath, os.getpid())
+    try:
+        with open(tmpPath, 'wb') as o:
+            o.write(data)
+            o.flush()
+            os.fsync(o.fileno())
+        os.replace(tmpPath, filePath)
+    finally:
+        if os.path.exists(tmpPath):
+            os.remove(tmpPath)
+
+
+def WriteDump(obj, filePath):
+    """Store the object in the dump file filePath (see ReadDump)."""
+    payload = dill.dumps(obj)
+    WriteFileAtomically(filePath, payload + DUMP_FOOTER_MAGIC +
+                        hashlib.md5(payload).digest())
+
+
+def ReadDumpPayload(filePath):
+    """Return the pickled bytes of the dump file filePath.
+
+    :raise ValueError: if the checksum footer is missing or wrong
+    """
+    with open(filePath, 'rb') as f:
+        data = f.read()
+    if len(data) < DUMP_FOOTER_SIZE or \
+            data[-DUMP_FOOTER_SIZE:-hashlib.md5().digest_size] != \
+            DUMP_FOOTER_MAGIC:
+        raise ValueError('No checksum footer in {}'.format(filePath))
+    payload = data[:-DUMP_FOOTER_SIZE]
+    if hashlib.md5(payload).digest() != \
+            data[-hashlib.md5().digest_size:]:
+        raise ValueError('Wrong checksum of {}'.format(filePath))
+    return payload
+
+
+def ReadDump(filePath):
+    """Return the object stored by WriteDump in filePath.
+
+    :raise ValueError: if the checksum of the dump is wrong
+    """
+    return dill.loads(ReadDumpPayload(filePath))
+
+
+def GetFileChecksum(filePath):
+    """Return the md5 hex digest of the file."""
+    d = hashlib.md5()
+    with open(filePath, 'rb') as f:
+        for block in iter(lambda: f.read(CHECKSUM_BLOCK_SIZE), b''):
+            d.update(block)
+    return d.hexdigest()
+
+
+def GetArrayPath(storePath, name):
+    """Return the path to the .npy file of the array name."""
+    return os.path.join(storePath, '{}.npy'.format(name))
+
+
+def WriteStore(storePath, arrays, meta):
+    """Write the store (an existing store is replaced).
+
+    :param arrays: dict name: numpy array
+    :param meta: dict of picklable objects
+    """
+    tmpPath = '{}.{}.tmp'.format(storePath, os.getpid())
+    oldPath = '{}.{}.old'.format(storePath, os.getpid())
+    if os.path.exists(tmpPath):
+        shutil.rmtree(tmpPath)
+    os.makedirs(tmpPath)
+    try:
+        checksums = dict()
+        for name, array in arrays.items():
+            arrayPath = GetArrayPath(tmpPath, name)
+            with open(arrayPath, 'wb') as o:
+                np.save(o, np.ascontiguousarray(array))
+                o.flush()
+                os.fsync(o.fileno())
+            checksums[name] = GetFileChecksum(arrayPath)
+        WriteDump((STORE_SCHEMA_VERSION, checksums, meta),
+                  os.path.join(tmpPath, META_FILE_NAME))
+        if os.path.exists(storePath):
+            os.rename(storePath, oldPath)
+        try:
+            os.rename(tmpPath, storePath)
+        except BaseException:
+            # keep the old store
+            if os.path.exists(oldPath) and not os.path.exists(storePath):
+                os.rename(oldPath, storePath)
+            raise
+    finally:
+        for path in (tmpPath, oldPath):
+            if os.path.exists(path):
+                shutil.rmtree(path)
+
+
+def CheckArrayFile(arrayPath):
+    """Return None if the size of the .npy file matches its header.
+
+    :return: the error message if the file is missing, truncated or too
+    long
+    """
+    try:
+        with open(arrayPath, 'rb') as f:
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                header = np.lib.format.read_array_header_1_0(f)
+            else:
+                header = np.lib.format.read_array_header_2_0(f)
+            shape, _, dtype = header
+            expectedSize = f.tell() + int(np.prod(shape))*dtype.itemsize
+            size = os.fstat(f.fileno()).st_size
+    except (OSError, ValueError) as e:
+        return str(e)
+    if size != expectedSize:
+        return 'Wrong size of {}: {} bytes instead of {}'.format(
+            arrayPath, size, expectedSize)
+    return None
+
+
+def InvalidateStore(storePath, error):
+    """Log the error of a damaged store and remove its meta data.
+
+    OpenStore returns None for the store afterwards.
+    """
+    logging.getLogger('TestManager.Helpers.ResultStore').warning(
+        'Damaged store {}: {}'.format(storePath, error))
+    try:
+        os.remove(os.path.join(storePath, META_FILE_NAME))
+    except FileNotFoundError:
+        pass
+
+
+def OpenStore(storePath):
+    """Return the ResultStore at storePath or None if it cannot be used.
+
+    The store cannot be used if it does not exist, if its meta data are
+    damaged, if it has an other schema version or if the size of one of
+    its .npy files does not match its header (the store is invalidated, see
+    InvalidateStore). The checksums of the arrays are checked when they are
+    loaded (see ResultStore.LoadArray and VerifyStore).
+    """
+    metaPath = os.path.join(storePath, META_FILE_NAME)
+    if not os.path.exists(metaPath):
+        return None
+    try:
+        schemaVersion, checksums, meta = ReadDump(metaPath)
+    except Exception as e:
+        logging.getLogger('TestManager.Helpers.ResultStore').warning(
+            'Cannot read the store {}: {}'.format(storePath, e))
+        return None
+    if schemaVersion != STORE_SCHEMA_VERSION:
+        return None
+    for name in checksums:
+        error = CheckArrayFile(GetArrayPath(storePath, name))
+        if error is not None:
+            InvalidateStore(storePath, error)
+            return None
+    return ResultStore(storePath, checksums, meta)
+
+
+def VerifyDump(filePath):
+    """Return None if the dump file is valid, the error message else."""
+    try:
+        ReadDumpPayload(filePath)
+    except (OSError, ValueError) as e:
+        return str(e)
+    return None
+
+
+def VerifyStore(storePath):
+    """Return None if the store is valid, the error message else.
+
+    The checksums of the meta data and of all the arrays are checked.
+    """
+    metaPath = os.path.join(storePath, META_FILE_NAME)
+    try:
+        schemaVersion, checksums, meta = ReadDump(metaPath)
+    except Exception as e:
+        return str(e)
+    if schemaVersion != STORE_SCHEMA_VERSION:
+        return 'Schema version {} of {}'.format(schemaVersion, storePath)
+    for name, checksum in checksums.items():
+        arrayPath = GetArrayPath(storePath, name)
+        try:
+            if GetFileChecksum(arrayPath) != checksum:
+                return 'Wrong checksum of {}'.format(arrayPath)
+        except OSError as e:
+            return str(e)
+    return None
+
+
+class ResultStore(object):
+    """Read only access to a store."""
+
+    def __init__(self, storePath, checksums, meta):
+        """Init the store (use OpenStore to open an existing store).
+
+        :param checksums: dict name: md5 of the .npy file of the array
+        :param meta: dict of the python objects of the store
+        """
+        self.storePath = storePath
+        self.names = frozenset(checksums.keys())
+        self.checksums = checksums
+        self.meta = meta
+        # names of the arrays whose checksum was checked
+        self.verifiedNames = set()
+
+    def __contains__(self, name):
+        """Return True if the array name is in the store."""
+        return name in self.names
+
+    def LoadArray(self, name):
+        """Return the array name (memory-mapped, read only).
+
+        The checksum of the array is checked the first time it is loaded.
+
+        :raise ValueError: if the array is damaged (the store is
+        invalidated, see InvalidateStore)
+        """
+        arrayPath = GetArrayPath(self.storePath, name)
+        if name not in self.verifiedNames:
+            try:
+                isValid = GetFileChecksum(arrayPath) == self.checksums[name]
+                error = None if isValid else \
+                    'Wrong checksum of {}'.format(arrayPath)
+            except OSError as e:
+                error = str(e)
+            if error is not None:
+                InvalidateStore(self.storePath, error)
+                raise ValueError(error)
+            self.verifiedNames.add(name)
+        try:
+            return np.load(arrayPath, mmap_mode='r')
+        except ValueError:
+            # empty arrays cannot be memory-mapped
+            return np.load(arrayPath)
@@ -0,0 +1,200 @@
+"""Hand-off of objects with large numpy arrays between processes.
+
+Share pickles an object (protocol 5) with the data of its contiguous numpy
+arrays out-of-band: the data are copied in one
+multiprocessing.shared_memory segment and only a small SharedObject
+descriptor (segment name, pickled payload, offsets and sizes of the
+buffers) is sent between the processes. Attach rebuilds the object with
+arrays that are views of the segment (no copy).
+
+A segment is not tracked by the resource tracker of the process that
+creates it (a pool worker that exits would remove it). The process that
+owns the object attaches it with own=True (or calls Own) and calls Release
+when the object is not used anymore: if this process is killed before, its
+resource tracker removes the segment. Until then nothing removes it: the
+SharedObject returned by a task has to be owned or released even if the
+computation fails (see TaskGraph.Run onAbandoned). A segment whose process
+is killed between Share and Own is left in /dev/shm.
+
+Author: Xavier Corbillon
+IMT Atlantique
+"""
+
+from multiprocessing import resource_tracker, shared_memory
+import pickle
+
+# alignment (in bytes) of the buffers in a segment
+BUFFER_ALIGNMENT = 64
+
+global_attached_segments = dict()  # key: segment name, value: Segment
+# names of the segments owned by this process (tracked by its resource
+# tracker)
+global_owned_segments = set()
+# detached segments that could not be unmapped yet (arrays still alive)
+global_closing_segments = list()
+
+
+class Segment(shared_memory.SharedMemory):
+    """Shared memory segment that can be garbage collected while in use.
+
+    The arrays that use the segment keep it mapped.
+    """
+
+    def __del__(self):
+        """Unmap the segment if it is not used anymore."""
+        try:
+            self.close()
+        except BufferError:
+            pass
+
+
+class SharedObject(object):
+    """Descriptor of an object shared by Share."""
+
+    def __init__(self, segmentName, payload, buffers):
+        """Init the descriptor.
+
+        :param segmentName: name of the segment or None if the object has
+        no out-of-band buffer
+        :param payload: the pickled object (without the buffers)
+        :param buffers: list of (offset, size) of the buffers in the segment
+        """
+        self.segmentName = segmentName
+        self.payload = payload
+        self.buffers = buffers
+
+
+def _Untrack(segment):
+    """Remove the segment from the resource tracker of the process."""
+    resource_tracker.unregister(segment._name, 'shared_memory')
+
+
+def _Unlink(segment, isTracked):
+    """Remove the segment (it is mapped until it is closed).
+
+    :param isTracked: True if the segment is tracked by the resource tracker
+    """
+    # unlink unregisters the segment from the resource tracker
+    if not isTracked:
+        resource_tracker.register(segment._name, 'shared_memory')
+    segment.unlink()
+
+
+def _Close(segment):
+    """Unmap the segment, return False if arrays still use it."""
+    try:
+        segment.close()
+    except BufferError:
+        return False
+    return True
+
+
+def _Detach(segmentName):
+    """Forget the segment attached by this process and try to unmap it.
+
+    The segments used by living arrays are unmapped by a next call.
+    """
+    global global_closing_segments
+    segment = global_attached_segments.pop(segmentName, None)
+    if segment is not None:
+        global_closing_segments.append(segment)
+    global_closing_segments = [segment for segment in
+                               global_closing_segments
+                               if not _Close(segment)]
+    return segment
+
+
+def Share(obj):
+    """Copy the arrays of obj in a new segment, return its SharedObject."""
+    pickleBuffers = list()
+    payload = pickle.dumps(obj, protocol=5,
+                           buffer_callback=pickleBuffers.append)
+    if len(pickleBuffers) == 0:
+        return SharedObject(None, payload, list())
+    raws = [b.raw() for b in pickleBuffers]
+    buffers = list()
+    offset = 0
+    for raw in raws:
+        buffers.append((offset, raw.nbytes))
+        offset += -(-raw.nbytes // BUFFER_ALIGNMENT) * BUFFER_ALIGNMENT
+    segment = Segment(create=True, size=max(1, offset))
+    _Untrack(segment)
+    try:
+        for raw, (offset, size) in zip(raws, buffers):
+            segment.buf[offset:offset+size] = raw
+    except BaseException:
+        segment.close()
+        _Unlink(segment, False)
+        raise
+    segment.close()
+    return SharedObject(segment.name, payload, buffers)
+
+
+def Attach(sharedObject, own=False):
+    """Return the object of the SharedObject.
+
+    Its arrays are views of the segment: the segment is mapped once by
+    process and stays mapped until Detach or Release.
+
+    :param own: if True this process owns the segment: it is removed when
+    this process exits if it was not released before
+    """
+    if sharedObject.segmentName is None:
+        return pickle.loads(sharedObject.payload)
+    segmentName = sharedObject.segmentName
+    segment = global_attached_segments.get(segmentName)
+    if segment is None:
+        # the segment is registered to the resource tracker when it is opened
+        segment = Segment(name=segmentName)
+        global_attached_segments[segmentName] = segment
+        if own:
+            global_owned_segments.add(segmentName)
+        elif segmentName not in global_owned_segments:
+            _Untrack(segment)
+    elif own:
+        Own(sharedObject)
+    return pickle.loads(sharedObject.payload,
+                        buffers=[segment.buf[offset:offset+size]
+                                 for offset, size in sharedObject.buffers])
+
+
+def Own(sharedObject):
+    """Make this process the owner of the segment of the SharedObject.
+
+    The segment is removed when this process exits if it was not released
+    before (see Release). It does not need to be attached.
+    """
+    segmentName = sharedObject.segmentName
+    if segmentName is None or segmentName in global_owned_segments:
+        return
+    segment = global_attached_segments.get(segmentName)
+    if segment is None:
+        # the segment is registered to the resource tracker when it is opened
+        Segment(name=segmentName).close()
+    else:
+        resource_tracker.register(segment._name, 'shared_memory')
+    global_owned_segments.add(segmentName)
+
+
+def Detach(sharedObject):
+    """Unmap the segment of the SharedObject from this process.
+
+    The segment is unmapped once the arrays of the objects attached from it
+    are garbage collected. It is not removed (see Release).
+    """
+    if sharedObject.segmentName is not None:
+        _Detach(sharedObject.segmentName)
+
+
+def Release(sharedObject):
+    """Detach and remove the segment of the SharedObject."""
+    if sharedObject.segmentName is None:
+        return
+    isTracked = sharedObject.segmentName in global_owned_segments
+    global_owned_segments.discard(sharedObject.segmentName)
+    segment = _Detach(sharedObject.segmentName)
+    if segment is None:
+        segment = Segment(name=sharedObject.segmentName)
+        segment.close()
+        isTracked = True
+    _Unlink(segment, isTracked)
@@ -5,17 +5,37 @@ IMT Atlantique
 """
 
 # import Helpers.Quaternion as Q
-import Helpers.CQuaternion as Q
+try:
+    import Helpers.CQuaternion as Q
+except ImportError:
+    # the compiled module is not available: use the numpy implementation
+    import Helpers.NpQuaternion as Q
 import Helpers.FFmpeg as FFmpeg
+import Helpers.FrameRenderer as FrameRenderer
+import Helpers.Trajectory as Trajectory
+import Helpers.LogCache as LogCache
+import Helpers.DatasetPack as DatasetPack
+import Helpers.ResultStore as ResultStore
+import Helpers.SharedArrays as SharedArrays
+import Helpers.TaskGraph as TaskGraph
+import Helpers.Vision as Vision
+from Helpers.QuantileSketch import QuantileSketch
+from Helpers.Quaternion import QuaternionArray, VectorArray
 import math
 import numpy as np
 import matplotlib.pyplot as plt
 import os
 import sys
 import threading
-import configparser
+import time
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
 from functools import partial
+import copy
+import hashlib
 import io
+import logging
+import shutil
 import PIL
 from pathos.multiprocessing import ProcessingPool
 import dill
@@ -24,185 +44,346 @@ import sys
 
 PATH_TO_STATISTIC_RESULTS = 'results/statistics'
 
+# increase it when the content of ProcessedResult changes to invalidate the
+# stored processed results
+PROCESSED_RESULT_VERSION = 6
+
+# arrays of a ProcessedResult written in its ResultStore: attribute name:
+# (attribute of the stored array, class of the attribute) or None for the
+# numpy arrays
+PROCESSED_RESULT_ARRAYS = {
+    'timestamps': None,
+    'sampleFrameIds': None,
+    'quaternionArray': ('wxyz', QuaternionArray),
+    'filteredTimestamps': None,
+    'filteredQuaternionArray': ('wxyz', QuaternionArray),
+    'angularVelocityTimestamps': None,
+    'angularVelocityQuaternionArray': ('wxyz', QuaternionArray),
+    'angularVelocityArray': ('xyz', VectorArray),
+    'positionMatrix': None,
+    'positionCountMatrix': None,
+    'visionMatrix': None
+    }
+
+# default memory budget of the processed results kept in memory by each
+# process (~256 MB)
+DEFAULT_RESULT_CACHE_BYTES = 256 * 1024 * 1024
+
+# estimated memory used by an entry of the dicts that ProcessedResult
+# builds on demand (a float key and a Quaternion or a frameId)
+DICT_ENTRY_BYTES = 400
+
+global_result_cache = None
+
+# estimated cost of a task of the statistics pipeline whose duration was
+# never measured (see Statistics._ComputationWorkThread)
+DEFAULT_TASK_COST = 1.0
+
+# number of the slowest tasks logged (debug level) after a computation
+SLOWEST_TASKS_LOGGED = 10
+
+# min number of frames of a segment when a video is encoded in parallel
+MIN_SEGMENT_FRAMES = 25
+
+# number of source frames whose heatmaps are computed at once by
+# AggregatedResults.WriteVideoOverlay
+OVERLAY_BLOCK_FRAMES = 256
+
+# segment sizes (in second) of the angular velocity per segment
+ANGULAR_VELOCITY_SEGMENT_SIZES = (1, 2, 3)
+
+# parameters of the processing of each result, of the heatmap videos and of
+# the heatmap overlays (they are part of the cache keys: changing them
+# invalidates the stored results and aggregates). The viewport masks are
+# exact (maskPrecision None), set maskPrecision to use the approximate
+# masks of quantized orientations (see Vision.ViewportMaskCache)
+RESULT_PARAMETERS = dict(skiptime=10,
+                         segSizeList=(1, 2, 3, 5, 10),
+                         positionWidth=100,
+                         positionHeight=100,
+                         visionWidth=100,
+                         visionHeight=50,
+                         horizontalFoVAngle=110,
+                         verticalFoVAngle=90,
+                         maskPrecision=None)
+HEATMAP_VIDEO_PARAMETERS = dict(fps=5,
+                                segmentSize=1/5,
+                                widthVideo=960,
+                                heightVideo=480,
+                                widthEqui=100,
+                                heightEqui=50,
+                                horizontalFoVAngle=110,
+                                verticalFoVAngle=90,
+                                maskPrecision=None)
+OVERLAY_VIDEO_PARAMETERS = dict(segmentSize=1/5,
+                                widthEqui=100,
+                                heightEqui=50,
+                                horizontalFoVAngle=110,
+                                verticalFoVAngle=90,
+                                maskPrecision=None)
+
 ORIGINAL_POSITION = Q.Vector(-1, 0, 0)
 
-def StoreAngularVelocity(processedResultList, filePath, isAggr):
-    """Store angular velocity cdf to file."""
-    angVel = list()
-    if isAggr:
-        for processedResult in processedResultList:
-            for p in processedResult.angularVelocityDict.values():
-                angVel.append(p)
-    else:
-        for p in processedResultList.values():
-            angVel.append(p)
-    angVelNorm = list()
-    verticalAngVel = list()
-    horizontalAngVel = list()
-    yawAngVel = list()
-    pitchAngVel = list()
-    rollAngVel = list()
-    for q, w in angVel:
-        angVelNorm.append(w.Norm())
-        horizontalAngVel.append(abs(w.z))
-        verticalAngVel.append(
-            (Q.Vector(w.x, w.y, 0)).Norm())
-        q.Normalize()
-        yawAngVel.append(abs(q.Rotation(Q.Vector(0, 0, 1)) * w))
-        pitchAngVel.append(abs(q.Rotation(Q.Vector(0, 1, 0)) * w))
-        rollAngVel.append(abs(q.Rotation(Q.Vector(1, 0, 0)) * w))
-    angVelNorm = sorted(angVelNorm)
-    verticalAngVel = sorted(verticalAngVel)
-    horizontalAngVel = sorted(horizontalAngVel)
-    yawAngVel = sorted(yawAngVel)
-    pitchAngVel = sorted(pitchAngVel)
-    rollAngVel = sorted(rollAngVel)
+def StoreAngularVelocity(angularVelocitySketches, filePath):
+    """Store angular velocity cdf to file.
+
+    :param angularVelocitySketches: list of the QuantileSketch of each
+    angular velocity component (see Trajectory.VELOCITY_COMPONENTS)
+    """
     with open(filePath, 'w') as o:
         o.write('cdf angVel angVelDeg verticalAngVel ' +
                 'verticalAngVelDeg horizontalAngVel horizontalAngVelDeg' +
                 'yawAngVel yawAngVelDeg pitchAngVel pitchAngVelDeg ' +
                 'rollAngVel rollAngVelDeg\n')
+        percentiles = [sketch.Percentile(range(0, 101)) if len(sketch) > 0
+                       else -np.ones(101)
+                       for sketch in angularVelocitySketches]
         for r in range(0, 101):
-            values = np.percentile(angVelNorm, r) if len(angVelNorm) > 0 else -1
-            o.write('{} {} {} '.format(r, values, values*180/math.pi))
-            values = np.percentile(verticalAngVel, r) if len(verticalAngVel) > 0 else -1
-            o.write('{} {} '.format(values, values*180/math.pi))
-            values = np.percentile(horizontalAngVel, r) if len(horizontalAngVel) > 0 else -1
-            o.write('{} {} '.format(values, values*180/math.pi))
-            values = np.percentile(yawAngVel, r) if len(yawAngVel) > 0 else -1
-            o.write('{} {} '.format(values, values*180/math.pi))
-            values = np.percentile(pitchAngVel, r) if len(pitchAngVel) > 0 else -1
-            o.write('{} {} '.format(values, values*180/math.pi))
-            values = np.percentile(rollAngVel, r) if len(rollAngVel) > 0 else -1
-            o.write('{} {}\n'.format(values, values*180/math.pi))
-
-
-def StoreAngularVelocityPerSegment(processedResultList, segmentSize, filePath,
-                                   useRealTimestamp=True):
-    """Compute the min, max, median angular velocity on all segments.
+            o.write('{}'.format(r))
+            for values in percentiles:
+                o.write(' {} {}'.format(values[r], values[r]*180/math.pi))
+            o.write('\n')
+
+
+def ComputeAngularVelocityPerSegment(processedResult, segmentSize,
+                                     useRealTimestamp=True):
+    """Split the angular velocities of the result in segments.
 
     :param segmentSize: the segment size in second
+    :param useRealTimestamp: if set to True will use real timestamp,
+    otherwise timestamp relatif to the beginning of the test
+    :return: dict segmentId: list of the QuantileSketch of each angular
+    velocity component of the segment (see Trajectory.VELOCITY_COMPONENTS)
+    """
+    segmentSketches = dict()
+    timestamps = processedResult.angularVelocityTimestamps
+    if len(timestamps) == 0:
+        return segmentSketches
+    if not useRealTimestamp:
+        timestamps = timestamps - (processedResult.startOffsetInSecond +
+                                   processedResult.skiptime)
+    segmentIds = np.floor(timestamps/segmentSize).astype(np.int64)
+    # the timestamps are sorted: each segment is a contiguous block
+    bounds = np.flatnonzero(np.diff(segmentIds)) + 1
+    for segmentId, components in zip(
+            segmentIds[np.concatenate(([0], bounds))].tolist(),
+            np.split(processedResult.velocityComponents, bounds)):
+        segmentSketches[segmentId] = [QuantileSketch().Update(values)
+                                      for values in components.T]
+    return segmentSketches
+
+
+def StoreAngularVelocityPerSegment(segmentSketches, filePath):
+    """Store the min, max, median angular velocity on all segments.
+
+    :param segmentSketches: dict segmentId: list of the QuantileSketch of
+    each angular velocity component (see ComputeAngularVelocityPerSegment)
     """
-    results = dict() # segmentId: AngVelValues
-    class AngVelValues(object):
-        def __init__(self):
-            self.angVelNorm = list()
-            self.verticalAngVel = list()
-            self.horizontalAngVel = list()
-            self.yawAngVel = list()
-            self.pitchAngVel = list()
-            self.rollAngVel = list()
-
-        def GetMinMedMaxString(self, angVelTypeList):
-            s = ''
-            listOfOutputList = []
-            for angVelName in angVelTypeList:
-                listOfOutputList.append(getattr(self, angVelName))
-            for l in listOfOutputList:
-                minA = np.percentile(l, 10) if len(l) > 0 else -1
-                p25A = np.percentile(l, 25) if len(l) > 0 else -1
-                medA = np.percentile(l, 50) if len(l) > 0 else -1
-                p75A = np.percentile(l, 75) if len(l) > 0 else -1
-                maxA = np.percentile(l, 90) if len(l) > 0 else -1
-                s += '{}{} {} {} {} {}'.format(' ' if len(s) > 0 else '',
-                                         minA, p25A,  medA, p75A, maxA)
-            return s
-    for processedResult in processedResultList:
-        angVel = processedResult.angularVelocityDict
-        for t in angVel:
-            t_used = t
-            if not useRealTimestamp:
-                t_used -= processedResult.startOffsetInSecond + processedResult.skiptime
-            segmentId = math.floor(t_used/segmentSize)
-            if segmentId not in results:
-                results[segmentId] = AngVelValues()
-            (q, w) = angVel[t]
-            r = results[segmentId]
-            r.angVelNorm.append(w.Norm())
-            r.horizontalAngVel.append(abs(w.z))
-            r.verticalAngVel.append(
-                (Q.Vector(w.x, w.y, 0)).Norm())
-            r.yawAngVel.append(abs(q.Rotation(Q.Vector(0, 0, 1)) * w))
-            r.pitchAngVel.append(abs(q.Rotation(Q.Vector(0, 1, 0)) * w))
-            r.rollAngVel.append(abs(q.Rotation(Q.Vector(1, 0, 0)) * w))
-    for segId in results:
-        r = results[segId]
-        r.angVelNorm = sorted(r.angVelNorm)
-        r.verticalAngVel = sorted(r.verticalAngVel)
-        r.horizontalAngVel = sorted(r.horizontalAngVel)
-        r.yawAngVel = sorted(r.yawAngVel)
-        r.pitchAngVel = sorted(r.pitchAngVel)
-        r.rollAngVel = sorted(r.rollAngVel)
     with open(filePath, 'w') as o:
-        angVelTypeList = ['angVelNorm', 'verticalAngVel', 'horizontalAngVel',
-                          'yawAngVel', 'pitchAngVel', 'rollAngVel']
         colName = 'segId'
-        for angVelName in angVelTypeList:
+        for angVelName in Trajectory.VELOCITY_COMPONENTS:
             colName += ' min{0} 25{0} med{0} 75{0} max{0}'.format(
                 angVelName[0].upper() + angVelName[1:])
         colName += '\n'
         o.write(colName)
-        firstSegId = min(results.keys())
-        for segId in results:
-            r = results[segId]
-            o.write('{} {}\n'.format(segId - firstSegId,
-                                     r.GetMinMedMaxString(angVelTypeList)))
+        firstSegId = min(segmentSketches.keys())
+        for segId in segmentSketches:
+            o.write('{} {}\n'.format(
+                segId - firstSegId,
+                ' '.join(' '.join(str(v) for v in
+                                  sketch.Percentile([10, 25, 50, 75, 90]))
+                         for sketch in segmentSketches[segId])))
+
+
+def WriteMatrixFrames(videoWriter, posMatList, vmax, highQuality=False,
+                      **savefigKwargs):
+    """Write the matrices in the video, one frame by matrix.
+
+    :param posMatList: list of (startTime, endTime, matrix)
+    :param highQuality: if True render the frames with matplotlib (with a
+    colorbar), otherwise with the FrameRenderer
+    :param savefigKwargs: arguments of plt.savefig in high quality mode
+    """
+    for (startTime, endTime, posMat) in posMatList:
+        caption = 'From {:6.2f} s to {:6.2f} s'.format(startTime, endTime)
+        if not highQuality:
+            videoWriter.AddFrame(FrameRenderer.RenderFrame(
+                posMat, 0, vmax, videoWriter.width, videoWriter.height,
+                caption))
+            continue
+        plt.matshow(posMat, cmap='hot', vmax=vmax, vmin=0)
+        buffer_ = io.BytesIO()
+        plt.axis('off')
+        plt.title(caption)
+        plt.colorbar()
+        plt.savefig(buffer_, format = "png", **savefigKwargs)
+        buffer_.seek(0)
+        image = PIL.Image.open(buffer_)
+        image.load()
+        buffer_.close()
+        plt.close()
+        videoWriter.AddPicture(image)
+        plt.close()
+
+
+def WriteMatrixVideo(outputPath, fps, width, height, posMatList, vmax,
+                     highQuality=False, nbSegments=None, **savefigKwargs):
+    """Write the matrices in a video, one frame by matrix.
 
+    The timeline is split in nbSegments segments, each segment is rendered
+    and encoded in its own file by a thread pool (the encoding runs in one
+    ffmpeg process per segment) and the segments are joined without
+    re-encoding.
 
-class AggregatedResults(object):
-    """Contains aggregated results (i.e. results of results)."""
+    :param posMatList: list of (startTime, endTime, matrix)
+    :param nbSegments: number of segments (default: one per CPU core, with
+    at least MIN_SEGMENT_FRAMES frames by segment). A caller that writes
+    several videos at the same time (as the pool of the statistics) gives
+    the share of the cores of each video. The high quality mode always use
+    one segment (pyplot is not thread safe).
+    """
+    if nbSegments is None:
+        nbSegments = os.cpu_count() or 1
+    nbSegments = max(1, min(nbSegments,
+                            len(posMatList)//MIN_SEGMENT_FRAMES))
+    if highQuality:
+        nbSegments = 1
+    if nbSegments == 1:
+        with FFmpeg.VideoWrite(outputPath, width=width, height=height,
+                               fps=fps) as vo:
+            WriteMatrixFrames(vo, posMatList, vmax, highQuality,
+                              **savefigKwargs)
+        return
+    root, ext = os.path.splitext(outputPath)
+    segmentPaths = ['{}.part{}{}'.format(root, k, ext)
+                    for k in range(nbSegments)]
+    bounds = np.linspace(0, len(posMatList), nbSegments + 1).astype(int)
+    queueSize = max(2, FFmpeg.DEFAULT_QUEUE_SIZE//nbSegments)
+
+    def WriteSegment(k):
+        with FFmpeg.VideoWrite(segmentPaths[k], width=width, height=height,
+                               fps=fps, queueSize=queueSize) as vo:
+            WriteMatrixFrames(vo, posMatList[bounds[k]:bounds[k+1]], vmax)
+
+    try:
+        with ThreadPoolExecutor(max_workers=nbSegments) as executor:
+            # list() to raise the exceptions of the segments
+            list(executor.map(WriteSegment, range(nbSegments)))
+        FFmpeg.ConcatVideos(segmentPaths, outputPath)
+    finally:
+        for path in segmentPaths:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class AggregateState(object):
+    """Compact and mergeable summary of a set of results.
+
+    It contains the sums of the position and vision matrices, the time range
+    and the sketches of the angular velocity and max orthodromic distance
+    CDFs (globally and per segment), but not the results: two states can be
+    merged in any order without loading the results again.
+    """
 
     def __init__(self):
-        """Generate an aggregate with nothing.
+        """Generate an empty state.
 
-        To fill it use the __add__ function.
+        To fill it use Merge or FromProcessedResult.
         """
+        self.count = 0
         self.aggPositionMatrix = None
         self.aggVisionMatrix = None
-        self.processedResultList = list()
         self.minStartTime = sys.maxsize
         self.maxEndTime = 0
-        self.maxOrthodromicDistance = None
+        self.angularVelocitySketches = None
+        self.maxOrthodromicDistanceSketches = None
+        # key: (segmentSize, useRealTimestamp), value: dict segmentId: list
+        # of sketches (see ComputeAngularVelocityPerSegment)
+        self.angularVelocityPerSegment = dict()
         self.step = None
 
-    def __add__(self, processedResult):
-        """Add results to the aggregator."""
-        if isinstance(processedResult, ResultContainer):
-            processedResult = processedResult.GetProcessedResult()
-        self.processedResultList.append(processedResult)
-        self.minStartTime = min(self.minStartTime,
-                                min(processedResult.quaternions.keys())  # +
-                                # processedResult.startOffsetInSecond +
-                                # processedResult.skiptime
-                                )
-        self.maxEndTime = max(self.maxEndTime,
-                              max(processedResult.quaternions.keys())  # +
-                              # processedResult.startOffsetInSecond +
-                              # processedResult.skiptime
-                              )
-        if self.maxOrthodromicDistance is None:
-            self.maxOrthodromicDistance = \
-                processedResult.maxOrthodromicDistance.copy()
+    @staticmethod
+    def FromProcessedResult(processedResult):
+        """Return the state of one result."""
+        state = AggregateState()
+        state.count = 1
+        # copies of the arrays (they can be memory-mapped from a store)
+        state.aggPositionMatrix = np.array(processedResult.positionMatrix)
+        state.aggVisionMatrix = np.array(processedResult.visionMatrix)
+        if len(processedResult.timestamps) > 0:
+            state.minStartTime = processedResult.timestamps[0]  # +
+            # processedResult.startOffsetInSecond +
+            # processedResult.skiptime
+            state.maxEndTime = processedResult.timestamps[-1]  # +
+            # processedResult.startOffsetInSecond +
+            # processedResult.skiptime
+        state.angularVelocitySketches = \
+            [sketch.Copy()
+             for sketch in processedResult.angularVelocitySketches]
+        state.maxOrthodromicDistanceSketches = \
+            dict((segSize, sketch.Copy()) for segSize, sketch in
+                 processedResult.maxOrthodromicDistanceSketches.items())
+        for segmentSize in ANGULAR_VELOCITY_SEGMENT_SIZES:
+            for useRealTimestamp in (True, False):
+                state.angularVelocityPerSegment[
+                    (segmentSize, useRealTimestamp)] = \
+                    ComputeAngularVelocityPerSegment(
+                        processedResult, segmentSize, useRealTimestamp)
+        state.step = processedResult.step
+        return state
+
+    def Copy(self):
+        """Return a copy of the state."""
+        return AggregateState().Merge(self)
+
+    def Merge(self, other):
+        """Add the results of the other state to this state."""
+        if other.count == 0:
+            return self
+        self.count += other.count
+        self.minStartTime = min(self.minStartTime, other.minStartTime)
+        self.maxEndTime = max(self.maxEndTime, other.maxEndTime)
+        if self.angularVelocitySketches is None:
+            self.angularVelocitySketches = \
+                [sketch.Copy() for sketch in other.angularVelocitySketches]
         else:
-            for segSize in processedResult.maxOrthodromicDistance:
-                if segSize not in self.maxOrthodromicDistance:
+            for sketch, otherSketch in zip(self.angularVelocitySketches,
+                                           other.angularVelocitySketches):
+                sketch.Merge(otherSketch)
+        if self.maxOrthodromicDistanceSketches is None:
+            self.maxOrthodromicDistanceSketches = \
+                dict((segSize, sketch.Copy()) for segSize, sketch in
+                     other.maxOrthodromicDistanceSketches.items())
+        else:
+            for segSize in other.maxOrthodromicDistanceSketches:
+                if segSize not in self.maxOrthodromicDistanceSketches:
                     print('ERR: cannot aggregate if do not '
                           'have the same segSize')
                     exit(1)
                 else:
-                    self.maxOrthodromicDistance[segSize] += \
-                        processedResult.maxOrthodromicDistance[segSize]
+                    self.maxOrthodromicDistanceSketches[segSize].Merge(
+                        other.maxOrthodromicDistanceSketches[segSize])
+        for key, otherSegments in other.angularVelocityPerSegment.items():
+            segments = self.angularVelocityPerSegment.setdefault(key, dict())
+            for segmentId, otherSketches in otherSegments.items():
+                if segmentId not in segments:
+                    segments[segmentId] = [sketch.Copy()
+                                           for sketch in otherSketches]
+                else:
+                    for sketch, otherSketch in zip(segments[segmentId],
+                                                   otherSketches):
+                        sketch.Merge(otherSketch)
         if self.aggPositionMatrix is None:
-            self.aggPositionMatrix = processedResult.positionMatrix.copy()
+            self.aggPositionMatrix = other.aggPositionMatrix.copy()
         else:
-            self.aggPositionMatrix += processedResult.positionMatrix
+            self.aggPositionMatrix += other.aggPositionMatrix
         if self.aggVisionMatrix is None:
-            self.aggVisionMatrix = processedResult.visionMatrix.copy()
+            self.aggVisionMatrix = other.aggVisionMatrix.copy()
         else:
-            self.aggVisionMatrix += processedResult.visionMatrix
+            self.aggVisionMatrix += other.aggVisionMatrix
         if self.step is None:
-            self.step = processedResult.step
-        if self.step != processedResult.step:
+            self.step = other.step
+        if self.step != other.step:
             print('ERR: cannot aggregate if do not have the same step')
             exit(1)
         return self
@@ -215,34 +396,38 @@ class AggregatedResults(object):
         """Store the orthodrimic distance CDFs to a file."""
         with open(filePath, 'w') as o:
             o.write('cdf')
-            for segSize in self.maxOrthodromicDistance:
+            percentiles = list()
+            for segSize, sketch in \
+                    self.maxOrthodromicDistanceSketches.items():
                 o.write(' {}s'.format(segSize))
-                self.maxOrthodromicDistance[segSize].sort()
+                percentiles.append(sketch.Percentile(range(0, 101))
+                                   if len(sketch) > 0 else -np.ones(101))
             o.write('\n')
             for r in range(0, 101):
                 o.write('{}'.format(r))
-                for segSize in self.maxOrthodromicDistance:
-                    val = np.percentile(self.maxOrthodromicDistance[segSize],
-                                        r) \
-                        if len(self.maxOrthodromicDistance[segSize]) > 0 \
-                        else -1
-                    o.write(' {}'.format(val))
+                for values in percentiles:
+                    o.write(' {}'.format(values[r]))
                 o.write('\n')
 
     def StoreAngularVelocity(self, filePath):
         """Store angular velocity cdf to file."""
-        StoreAngularVelocity(self.processedResultList, filePath, True)
+        StoreAngularVelocity(self.angularVelocitySketches, filePath)
 
     def StoreAngularVelocityPerSegment(self, segmentSize, filePath,
                                        useRealTimestamp=True):
         """Store angular velocity per segment to file.
 
-        :param segmentSize: segment size in second
+        :param segmentSize: segment size in second (one of
+        ANGULAR_VELOCITY_SEGMENT_SIZES)
         :param useRealTimestamp: if set to True will use real timestamp,
         otherwise timestamp relatif to the beginning of the test
         """
-        StoreAngularVelocityPerSegment(self.processedResultList,
-                                       segmentSize, filePath, useRealTimestamp)
+        key = (segmentSize, useRealTimestamp)
+        if key not in self.angularVelocityPerSegment:
+            raise ValueError('No angular velocity segments of {}s'.format(
+                segmentSize))
+        StoreAngularVelocityPerSegment(self.angularVelocityPerSegment[key],
+                                       filePath)
 
     def StorePositions(self, filePath, vmax=None):
         """Store the position matrix image in a file."""
@@ -279,111 +464,266 @@ class AggregatedResults(object):
                         i, j, self.aggVisionMatrix[j, i]
                     ))
 
-    def WriteVideo(self, outputPath, fps, segmentSize, width, height):
-        """Generate a video of the average position in time."""
-        with FFmpeg.VideoWrite(outputPath,
-                               width=width,
-                               height=height,
-                               fps=fps) as vo:
-            posMatList = list()
-            vmax = 0
-            for timestamp in np.arange(self.minStartTime,
-                                       self.maxEndTime,
-                                       1/fps):
-                startTime = timestamp
-                endTime = timestamp + segmentSize
-                posMat = np.zeros(self.aggPositionMatrix.shape)
-                posMatList.append((startTime, endTime, posMat))
 
-            for result in self.processedResultList:
-                for t in result.filteredQuaternions.keys():
-                    for (startTime, endTime, posMat) in posMatList:
-                        t_real = t # + result.startOffsetInSecond + \
-                                 # result.skiptime
-                        if t_real >= startTime and t_real <= endTime:
-                            h, w = posMat.shape
-                            q = result.filteredQuaternions[t]
-                            v = q.Rotation(ORIGINAL_POSITION)
-                            theta, phi = v.ToPolar()
-                            i = int(w*(theta + math.pi)/(2*math.pi))
-                            j = int(h*phi/math.pi)
-                            posMat[j, i] += 1
-            for (startTime, endTime, posMat) in posMatList:
-                if endTime <= self.maxEndTime:
-                    sumPos = posMat.sum()
-                    if sumPos > 0:
-                        posMat /= sumPos
-                    vmax = max(vmax, posMat.max())
-
-            for (startTime, endTime, posMat) in posMatList:
-                plt.matshow(posMat, cmap='hot', vmax=vmax, vmin=0)
-                buffer_ = io.BytesIO()
-                plt.axis('off')
-                plt.title('From {:6.2f} s to {:6.2f} s'.format(startTime,
-                                                               endTime))
-                plt.colorbar()
-                plt.savefig(buffer_, format = "png",
-                            bbox_inches='tight') # ,
-                            # pad_inches = 0)
-                buffer_.seek(0)
-                image = PIL.Image.open(buffer_)
-                image.load()
-                buffer_.close()
-                plt.close()
-                vo.AddPicture(image)
-                plt.close()
+def GetAggregateState(value):
+    """Return the AggregateState of value.
 
-    def WriteVideoVision(self, outputPath, fps, segmentSize, widthVideo,
-                         heightVideo, widthEqui, heightEqui,
-                         horizontalFoVAngle, verticalFoVAngle):
-        """Generate a video of the average position in time."""
-        with FFmpeg.VideoWrite(outputPath,
-                               width=widthVideo,
-                               height=heightVideo,
-                               fps=fps) as vo:
-            posMatList = list()
-            vmax = 0
-            for timestamp in np.arange(self.minStartTime,
-                                       self.maxEndTime,#-segmentSize,
-                                       1/fps):
-                startTime = timestamp
-                endTime = timestamp + segmentSize
-                posMat = np.zeros((heightEqui, widthEqui))
-                posMatList.append((startTime, endTime, posMat))
+    :param value: an AggregateState, a ResultSummary or the
+    SharedArrays.SharedObject of a ResultSummary (attached by this process)
+    """
+    if isinstance(value, SharedArrays.SharedObject):
+        value = SharedArrays.Attach(value)
+    if isinstance(value, ResultSummary):
+        value = value.state
+    return value
 
-            for result in self.processedResultList:
+
+def MergeAggregateStates(first, second):
+    """Return the merge of the two states (the states are not modified).
+
+    The states are given as in GetAggregateState. The merged state does not
+    use the arrays of the shared summaries: they are detached.
+    """
+    merged = GetAggregateState(first).Copy().Merge(
+        GetAggregateState(second))
+    for value in (first, second):
+        if isinstance(value, SharedArrays.SharedObject):
+            SharedArrays.Detach(value)
+    return merged
+
+
+def ReduceAggregateStates(stateGroups, pool=None):
+    """Merge the states of each group with a pairwise tree reduction.
+
+    At each round the states of each group are merged two by two (the
+    merges of all the groups run in parallel in the pool), until one state
+    remains by group. The order of the states in a group is kept.
+
+    :param stateGroups: dict key: list of states (see GetAggregateState)
+    :param pool: pathos pool that runs the merges of a round, if None the
+    merges run in this process
+    :return: dict key: merged AggregateState (empty state for empty lists)
+    """
+    groups = dict((key, list(states)) for key, states in stateGroups.items())
+    while True:
+        pairs = [(states[k], states[k+1]) for states in groups.values()
+                 for k in range(0, len(states) - 1, 2)]
+        if len(pairs) == 0:
+            break
+        firsts, seconds = zip(*pairs)
+        if pool is not None:
+            merged = iter(pool.map(MergeAggregateStates, firsts, seconds))
+        else:
+            merged = map(MergeAggregateStates, firsts, seconds)
+        for key, states in groups.items():
+            groups[key] = [next(merged) for _ in range(len(states)//2)] + \
+                states[len(states) - len(states) % 2:]
+    return dict((key, GetAggregateState(states[0]) if len(states) > 0
+                 else AggregateState())
+                for key, states in groups.items())
+
+
+class AggregatedResults(AggregateState):
+    """Contains aggregated results (i.e. results of results).
+
+    In addition to the AggregateState, it keeps the list of the results
+    used by the outputs that need each trajectory (videos and vision
+    distances).
+    """
+
+    def __init__(self):
+        """Generate an aggregate with nothing.
+
+        To fill it use the __add__ function.
+        """
+        super().__init__()
+        self.processedResultList = list()
+
+    @staticmethod
+    def FromState(state, processedResultList):
+        """Return the aggregate of already merged results.
+
+        :param state: AggregateState of the results
+        :param processedResultList: the ProcessedResult merged in the state
+        """
+        aggregatedResults = AggregatedResults()
+        aggregatedResults.Merge(state)
+        aggregatedResults.processedResultList = list(processedResultList)
+        return aggregatedResults
+
+    def __add__(self, processedResult):
+        """Add results to the aggregator."""
+        if isinstance(processedResult, AggregatedResults):
+            self.processedResultList += processedResult.processedResultList
+            return self.Merge(processedResult)
+        if isinstance(processedResult, ResultContainer):
+            processedResult = processedResult.GetProcessedResult()
+        self.processedResultList.append(processedResult)
+        return self.Merge(AggregateState.FromProcessedResult(processedResult))
+
+    def WriteVideo(self, outputPath, fps, segmentSize, width, height,
+                   highQuality=False, nbSegments=None):
+        """Generate a video of the average position in time.
+
+        :param highQuality: if True render the frames with matplotlib
+        :param nbSegments: see WriteMatrixVideo
+        """
+        posMatList = list()
+        vmax = 0
+        for timestamp in np.arange(self.minStartTime,
+                                   self.maxEndTime,
+                                   1/fps):
+            startTime = timestamp
+            endTime = timestamp + segmentSize
+            posMat = np.zeros(self.aggPositionMatrix.shape)
+            posMatList.append((startTime, endTime, posMat))
+
+        for result in self.processedResultList:
+            for t in result.filteredQuaternions.keys():
                 for (startTime, endTime, posMat) in posMatList:
-                    h, w = posMat.shape
-                    d = dict((t, q) for (t, q) in result.filteredQuaternions.items()
-                             if t >= startTime and t < endTime)
-                    ans = Q.ComputeVision(d, w, h,
-                                          horizontalFoVAngle, verticalFoVAngle)
-                    for i in range(len(ans)):
-                        for j in range(len(ans[i])):
-                            posMat[j, i] += ans[i][j]
-            for (startTime, endTime, posMat) in posMatList:
+                    t_real = t # + result.startOffsetInSecond + \
+                             # result.skiptime
+                    if t_real >= startTime and t_real <= endTime:
+                        h, w = posMat.shape
+                        q = result.filteredQuaternions[t]
+                        v = q.Rotation(ORIGINAL_POSITION)
+                        theta, phi = v.ToPolar()
+                        i = int(w*(theta + math.pi)/(2*math.pi))
+                        j = int(h*phi/math.pi)
+                        posMat[j, i] += 1
+        for (startTime, endTime, posMat) in posMatList:
+            if endTime <= self.maxEndTime:
                 sumPos = posMat.sum()
                 if sumPos > 0:
                     posMat /= sumPos
                 vmax = max(vmax, posMat.max())
 
-            for (startTime, endTime, posMat) in posMatList:
-                plt.matshow(posMat, cmap='hot', vmax=vmax, vmin=0)
-                buffer_ = io.BytesIO()
-                plt.axis('off')
-                plt.title('From {:6.2f} s to {:6.2f} s'.format(startTime,
-                                                               endTime))
-                plt.colorbar()
-                plt.savefig(buffer_, format = "png",
-                            bbox_inches='tight',
-                            pad_inches = 0)
-                buffer_.seek(0)
-                image = PIL.Image.open(buffer_)
-                image.load()
-                buffer_.close()
-                plt.close()
-                vo.AddPicture(image)
-                plt.close()
+        WriteMatrixVideo(outputPath, fps, width, height, posMatList,
+                         vmax, highQuality, nbSegments,
+                         bbox_inches='tight')
+
+    def WriteVideoVision(self, outputPath, fps, segmentSize, widthVideo,
+                         heightVideo, widthEqui, heightEqui,
+                         horizontalFoVAngle, verticalFoVAngle,
+                         maskPrecision=None,
+                         highQuality=False, nbSegments=None):
+        """Generate a video of the average position in time.
+
+        :param maskPrecision: see ProcessedResult.ComputeVision
+        :param highQuality: if True render the frames with matplotlib
+        :param nbSegments: see WriteMatrixVideo
+        """
+        posMatList = list()
+        vmax = 0
+        for timestamp in np.arange(self.minStartTime,
+                                   self.maxEndTime,#-segmentSize,
+                                   1/fps):
+            startTime = timestamp
+            endTime = timestamp + segmentSize
+            posMat = np.zeros((heightEqui, widthEqui))
+            posMatList.append((startTime, endTime, posMat))
+
+        # each frame window is a range of buckets of the vision cubes
+        startTimes = np.array([startTime for (startTime, _, _) in
+                               posMatList])
+        endTimes = np.array([endTime for (_, endTime, _) in posMatList])
+        boundaries = np.unique(np.concatenate((startTimes, endTimes)))
+        firstBuckets = np.searchsorted(boundaries, startTimes)
+        lastBuckets = np.searchsorted(boundaries, endTimes)
+        for result in self.processedResultList:
+            visionCube = Vision.VisionCube(
+                result.filteredTimestamps, result.filteredQuaternionArray,
+                boundaries, widthEqui, heightEqui, horizontalFoVAngle,
+                verticalFoVAngle, maskPrecision)
+            visions = visionCube.ComputeVision(firstBuckets, lastBuckets)
+            for (_, _, posMat), vision in zip(posMatList, visions):
+                posMat += vision.T
+        for (startTime, endTime, posMat) in posMatList:
+            sumPos = posMat.sum()
+            if sumPos > 0:
+                posMat /= sumPos
+            vmax = max(vmax, posMat.max())
+
+        WriteMatrixVideo(outputPath, fps, widthVideo, heightVideo,
+                         posMatList, vmax, highQuality, nbSegments,
+                         bbox_inches='tight', pad_inches=0)
+
+    def WriteVideoOverlay(self, outputPath, sourcePath, segmentSize,
+                          widthEqui, heightEqui, horizontalFoVAngle,
+                          verticalFoVAngle, width=None, height=None,
+                          alpha=FrameRenderer.DEFAULT_OVERLAY_ALPHA,
+                          maskPrecision=None,
+                          vmax=None):
+        """Generate the source video with the average vision heatmap on it.
+
+        The heatmap of a source frame is the vision during segmentSize
+        seconds from the display of the frame (aligned with the logged
+        frameIds). The decoding, the blending and the encoding run in a
+        pipeline: only a few frames are in memory at the same time.
+
+        :param sourcePath: path to the source (equirectangular) video
+        :param width: width of the output video (default: source width)
+        :param height: height of the output video (default: source height)
+        :param alpha: opacity of the heatmap at its max
+        :param maskPrecision: see ProcessedResult.ComputeVision
+        :param vmax: value of the heatmap with the max opacity (default: max
+        value of the heatmaps, needs one more pass on the vision)
+        """
+        with FFmpeg.VideoRead(sourcePath, width, height) as vi, \
+                FFmpeg.VideoWrite(outputPath, width=vi.width,
+                                  height=vi.height, fps=vi.fps) as vo:
+            heatmapArgs = (vi.fps, segmentSize, widthEqui, heightEqui,
+                           horizontalFoVAngle, verticalFoVAngle,
+                           maskPrecision)
+            # no heatmap after the last displayed frame
+            nbFrames = 0
+            for result in self.processedResultList:
+                frameIndexes, _ = result.GetDisplayedFrames(vi.fps)
+                if len(frameIndexes) > 0:
+                    nbFrames = max(nbFrames, frameIndexes[-1] + 1)
+            if vmax is None:
+                vmax = 0
+                for firstFrame in range(0, nbFrames, OVERLAY_BLOCK_FRAMES):
+                    vmax = max(vmax, self.__GetFrameHeatmaps(
+                        firstFrame, *heatmapArgs).max())
+            for frameIndex, frame in enumerate(vi):
+                if frameIndex < nbFrames and vmax > 0:
+                    blockIndex = frameIndex % OVERLAY_BLOCK_FRAMES
+                    if blockIndex == 0:
+                        heatmaps = self.__GetFrameHeatmaps(frameIndex,
+                                                           *heatmapArgs)
+                    FrameRenderer.BlendHeatmap(frame, heatmaps[blockIndex], 0,
+                                               vmax, alpha)
+                vo.AddFrame(frame)
+
+    def __GetFrameHeatmaps(self, firstFrame, fps, segmentSize, widthEqui,
+                           heightEqui, horizontalFoVAngle, verticalFoVAngle,
+                           maskPrecision):
+        """Return the normalized vision heatmaps of a block of source frames.
+
+        :return: (OVERLAY_BLOCK_FRAMES, heightEqui, widthEqui) array
+        """
+        frameIndexes = np.arange(firstFrame, firstFrame + OVERLAY_BLOCK_FRAMES)
+        heatmaps = np.zeros((len(frameIndexes), heightEqui, widthEqui))
+        for result in self.processedResultList:
+            startTimes = result.GetFrameTimestamps(frameIndexes, fps)
+            displayed = np.flatnonzero(~np.isnan(startTimes))
+            if len(displayed) == 0:
+                continue
+            startTimes = startTimes[displayed]
+            endTimes = startTimes + segmentSize
+            boundaries = np.unique(np.concatenate((startTimes, endTimes)))
+            visionCube = Vision.VisionCube(
+                result.filteredTimestamps, result.filteredQuaternionArray,
+                boundaries, widthEqui, heightEqui, horizontalFoVAngle,
+                verticalFoVAngle, maskPrecision)
+            visions = visionCube.ComputeVision(
+                np.searchsorted(boundaries, startTimes),
+                np.searchsorted(boundaries, endTimes))
+            heatmaps[displayed] += visions.transpose(0, 2, 1)
+        sums = heatmaps.sum(axis=(1, 2))
+        heatmaps[sums > 0] /= sums[sums > 0, np.newaxis, np.newaxis]
+        return heatmaps
 
     def StoreVisionDistance(self, pathToFile):
         """Compute the vision distance cdf per quaternion sample and store it."""
@@ -442,55 +782,309 @@ class AggregatedResults(object):
 class ProcessedResult(object):
     """Contains the quaternions and timestamp information of a result."""
 
-    def __init__(self, resultPath, skiptime=10, step=0.03):
+    def __init__(self, resultPath, skiptime=10, step=0.03, samples=None,
+                 startOffsetInSecond=None):
         """Get the results from the result file.
 
         :param skiptime: time in second to skip
         :param step: step in second for the filtering
+        :param samples: samples of the result (dtype LogCache.LOG_DTYPE). If
+        None the samples are read from the result file.
+        :param startOffsetInSecond: start offset of the video. If None it is
+        read from the config file of the test.
         """
+        self.version = PROCESSED_RESULT_VERSION
+        self.cacheKey = None
         self.step = step
         self.skiptime = skiptime
-        self.quaternions = dict()
-        self.filteredQuaternions = dict()
-        self.frameIds = dict()
-        self.angularVelocityDict = dict()
+        self.timestamps = np.zeros(0)
+        self.quaternionArray = QuaternionArray()
+        self.sampleFrameIds = np.zeros(0, dtype=np.int64)
+        self._quaternions = None
+        self._frameIds = None
+        self._filteredQuaternions = None
+        self._store = None
+        self.filteredTimestamps = np.zeros(0)
+        self.filteredQuaternionArray = QuaternionArray()
+        self.angularVelocityTimestamps = np.zeros(0)
+        self.angularVelocityQuaternionArray = QuaternionArray()
+        self.angularVelocityArray = VectorArray()
+        self._angularVelocityDict = None
+        self._velocityComponents = None
         self.maxOrthodromicDistance = dict()  # key: seg size for moving window
+        # CDF sketches of the angular velocity components and of the max
+        # orthodromic distances (key: seg size)
+        self.angularVelocitySketches = \
+            [QuantileSketch() for _ in Trajectory.VELOCITY_COMPONENTS]
+        self.maxOrthodromicDistanceSketches = dict()
         self.positionMatrix = np.zeros((1, 1))
+        self.positionCountMatrix = np.zeros((1, 1), dtype=np.int64)
         self.visionMatrix = np.zeros((1, 1))
-        firstTimestamp = None
-        isSkiping = True
-        pathToOsvrClientIni = '{}.ini'.format(os.path.dirname(resultPath))
-        self.__GetStartOffset(pathToOsvrClientIni)
-
-        with open(resultPath, 'r') as i:
-            for line in i:
-                values = line.split(' ')
-                timestamp = float(values[0])
-                if firstTimestamp is None:
-                    firstTimestamp = timestamp
-                timestamp -= firstTimestamp
-                if isSkiping:
-                    if timestamp > skiptime:
-                        firstTimestamp = timestamp
-                        isSkiping = False
-                else:
-                    timestamp += self.startOffsetInSecond + self.skiptime
-                    q = Q.Quaternion(w=float(values[2]),
-                                      v=Q.Vector(x=float(values[3]),
-                                                 y=float(values[4]),
-                                                 z=float(values[5])
-                                                 )
-                                     )
-                    # print('x\'=',q.Rotation(Q.Vector(1, 0, 0)),'y\'=',q.Rotation(Q.Vector(0, 1, 0)),'z\'=',q.Rotation(Q.Vector(0, 0, 1)))
-                    q.Normalize()
-                    frameId = int(values[1])
-                    self.frameIds[timestamp] = frameId
-                    self.quaternions[timestamp] = q
-        # print(resultPath, max(self.quaternions.keys())
-        #                   if len(self.quaternions.keys()) > 0 else -1,
-        #                   self.startOffsetInSecond)
+        if startOffsetInSecond is None:
+            startOffsetInSecond = LogCache.GetStartOffsetInSecond(resultPath)
+        self.startOffsetInSecond = startOffsetInSecond
+        if samples is None:
+            samples = LogCache.LoadLog(resultPath)
+
+        self.__ReadSamples(samples)
         self.__filterQuaternion()
 
+    @staticmethod
+    def FromDatasetPack(datasetPack, userId, testId, videoId, skiptime=10,
+                        step=0.03):
+        """Get the results of a log stored in a DatasetPack."""
+        return ProcessedResult(None, skiptime=skiptime, step=step,
+                               samples=datasetPack.GetSamples(userId, testId,
+                                                              videoId),
+                               startOffsetInSecond=datasetPack
+                               .GetStartOffsetInSecond(userId, testId,
+                                                       videoId))
+
+    @property
+    def quaternions(self):
+        """Dict timestamp: Quaternion of the samples (built on first use)."""
+        if self._quaternions is None:
+            self._quaternions = dict()
+            for t, q in zip(self.timestamps.tolist(),
+                            self.quaternionArray.ToQuaternions(Q.Quaternion,
+                                                               Q.Vector)):
+                q.Normalize()
+                self._quaternions[t] = q
+        return self._quaternions
+
+    @property
+    def filteredQuaternions(self):
+        """Dict timestamp: filtered Quaternion (built on first use)."""
+        if self._filteredQuaternions is None:
+            self._filteredQuaternions = dict()
+            for t, q in zip(self.filteredTimestamps.tolist(),
+                            self.filteredQuaternionArray
+                            .ToQuaternions(Q.Quaternion, Q.Vector)):
+                q.Normalize()
+                self._filteredQuaternions[t] = q
+        return self._filteredQuaternions
+
+    @property
+    def angularVelocityDict(self):
+        """Dict timestamp: (Quaternion, angular velocity Vector).
+
+        Built on first use from the angular velocity arrays.
+        """
+        if self._angularVelocityDict is None:
+            self._angularVelocityDict = dict()
+            quaternionList = self.angularVelocityQuaternionArray\
+                .ToQuaternions(Q.Quaternion, Q.Vector)
+            velocityList = self.angularVelocityArray.ToVectors(Q.Vector)
+            for t, q, w in zip(self.angularVelocityTimestamps.tolist(),
+                               quaternionList, velocityList):
+                q.Normalize()
+                self._angularVelocityDict[t] = (q, w)
+        return self._angularVelocityDict
+
+    @property
+    def velocityComponents(self):
+        """(N, 6) array of the angular velocity components.
+
+        The columns are given by Trajectory.VELOCITY_COMPONENTS. Computed on
+        first use and shared by all the angular velocity writers.
+        """
+        if self._velocityComponents is None:
+            self._velocityComponents = \
+                Trajectory.ComputeVelocityComponents(
+                    self.angularVelocityQuaternionArray,
+                    self.angularVelocityArray)
+        return self._velocityComponents
+
+    def __getstate__(self):
+        """Do not store the dicts built on demand from the arrays.
+
+        The arrays of a stored result are not stored either: they are
+        loaded again from the store on first access.
+        """
+        state = self.__dict__.copy()
+        if state.get('_store') is not None:
+            for name in list(PROCESSED_RESULT_ARRAYS.keys()) + \
+                    ['maxOrthodromicDistance']:
+                state.pop(name, None)
+        state['_quaternions'] = None
+        state['_frameIds'] = None
+        state['_filteredQuaternions'] = None
+        state['_angularVelocityDict'] = None
+        state['_velocityComponents'] = None
+        return state
+
+    def __getattr__(self, name):
+        """Load the arrays of a stored result on first access.
+
+        If the array is damaged (see ResultStore.LoadArray) the result is
+        computed again by the ResultContainer that opened it.
+        """
+        store = self.__dict__.get('_store')
+        if store is None or name not in PROCESSED_RESULT_ARRAYS and \
+                name != 'maxOrthodromicDistance':
+            raise AttributeError(name)
+        try:
+            if name in PROCESSED_RESULT_ARRAYS:
+                value = store.LoadArray(name)
+                if PROCESSED_RESULT_ARRAYS[name] is not None:
+                    value = PROCESSED_RESULT_ARRAYS[name][1](value)
+            else:
+                value = dict((segSize, store.LoadArray(
+                    'maxOrthodromicDistance_{}'.format(k))) for k, segSize in
+                    enumerate(store.meta['maxOrthodromicDistanceSegSizes']))
+        except ValueError:
+            resultContainer = self.__dict__.get('_resultContainer')
+            if resultContainer is None:
+                raise
+            computedResult = resultContainer.ComputeProcessedResult(
+                self.step, self.cacheKey)
+            self.__dict__.clear()
+            self.__dict__.update(computedResult.__dict__)
+            return getattr(self, name)
+        setattr(self, name, value)
+        return value
+
+    def WriteStore(self, storePath):
+        """Write the result in a ResultStore (see FromStore)."""
+        arrays = dict()
+        for name, stored in PROCESSED_RESULT_ARRAYS.items():
+            value = getattr(self, name)
+            arrays[name] = value if stored is None else \
+                getattr(value, stored[0])
+        segSizes = list(self.maxOrthodromicDistance.keys())
+        for k, segSize in enumerate(segSizes):
+            arrays['maxOrthodromicDistance_{}'.format(k)] = \
+                np.asarray(self.maxOrthodromicDistance[segSize],
+                           dtype=np.float64)
+        meta = dict((name, getattr(self, name)) for name in
+                    ('version', 'cacheKey', 'step', 'skiptime',
+                     'startOffsetInSecond', 'angularVelocitySketches',
+                     'maxOrthodromicDistanceSketches'))
+        meta['maxOrthodromicDistanceSegSizes'] = segSizes
+        ResultStore.WriteStore(storePath, arrays, meta)
+
+    @staticmethod
+    def FromStore(storePath):
+        """Open a result written by WriteStore.
+
+        The arrays are loaded (memory-mapped) on first access.
+
+        :return: the ProcessedResult or None if the store cannot be used or
+        has an other PROCESSED_RESULT_VERSION
+        """
+        store = ResultStore.OpenStore(storePath)
+        if store is None or \
+                store.meta.get('version') != PROCESSED_RESULT_VERSION:
+            return None
+        processedResult = ProcessedResult.__new__(ProcessedResult)
+        processedResult.__dict__.update(
+            (name, value) for name, value in store.meta.items()
+            if name != 'maxOrthodromicDistanceSegSizes')
+        processedResult._quaternions = None
+        processedResult._frameIds = None
+        processedResult._filteredQuaternions = None
+        processedResult._angularVelocityDict = None
+        processedResult._velocityComponents = None
+        processedResult._store = store
+        return processedResult
+
+    def GetMemorySize(self):
+        """Return the estimated memory used by the result (in bytes).
+
+        Only the arrays already loaded (or computed) and the dicts already
+        built are counted.
+        """
+        size = 0
+        for name, value in self.__dict__.items():
+            if name in ('_quaternions', '_frameIds', '_filteredQuaternions',
+                        '_angularVelocityDict'):
+                if value is not None:
+                    size += len(value)*DICT_ENTRY_BYTES
+            else:
+                size += GetArraysSize(value)
+        return size
+
+    @property
+    def frameIds(self):
+        """Dict timestamp: frameId of the samples (built on first use)."""
+        if self._frameIds is None:
+            self._frameIds = dict(zip(self.timestamps.tolist(),
+                                      self.sampleFrameIds.tolist()))
+        return self._frameIds
+
+    def GetDisplayedFrames(self, fps):
+        """Return the source frames displayed during the test.
+
+        The logged frameIds count the frames decoded from the
+        startOffsetInSecond of the video. Without logged frameIds the frames
+        are assumed displayed at their presentation time.
+
+        :param fps: frame rate of the source video
+        :return: (frameIndexes, timestamps): the indexes in the source video
+        of the displayed frames and the timestamp of their first display
+        """
+        valid = self.sampleFrameIds >= 0
+        frameIds, first = np.unique(self.sampleFrameIds[valid],
+                                    return_index=True)
+        if len(frameIds) >= 2:
+            return frameIds + int(round(self.startOffsetInSecond*fps)), \
+                self.timestamps[valid][first]
+        if len(self.timestamps) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        frameIndexes = np.arange(math.ceil(self.timestamps[0]*fps),
+                                 math.floor(self.timestamps[-1]*fps) + 1)
+        return frameIndexes, frameIndexes/fps
+
+    def GetFrameTimestamps(self, frameIndexes, fps):
+        """Return the display timestamps of the source frames.
+
+        The timestamps are interpolated between the displayed frames, they
+        are nan for the frames not displayed during the test.
+
+        :param frameIndexes: array of indexes of frames of the source video
+        :param fps: frame rate of the source video
+        """
+        displayedIndexes, timestamps = self.GetDisplayedFrames(fps)
+        if len(displayedIndexes) == 0:
+            return np.full(len(frameIndexes), np.nan)
+        return np.interp(frameIndexes, displayedIndexes, timestamps,
+                         left=np.nan, right=np.nan)
+
+    def __ReadSamples(self, samples):
+        """Get the timestamps, frameIds and quaternions from the log samples.
+
+        The samples of the first skiptime seconds are skipped. Then the
+        timestamps are shifted to be relative to the start of the video.
+
+        :param samples: structured array of dtype LogCache.LOG_DTYPE
+        """
+        if len(samples) == 0:
+            return
+        rawTimestamps = samples['timestamp']
+        relativeTimestamps = rawTimestamps - rawTimestamps[0]
+        afterSkip = np.flatnonzero(relativeTimestamps > self.skiptime)
+        if len(afterSkip) == 0:
+            return
+        # the first sample after skiptime is not kept but its relative
+        # timestamp is the new time origin
+        skipIndex = afterSkip[0]
+        samples = samples[skipIndex+1:]
+        timestamps = (rawTimestamps[skipIndex+1:] -
+                      relativeTimestamps[skipIndex]) + \
+            (self.startOffsetInSecond + self.skiptime)
+        # sort the samples and keep only the last sample of each timestamp
+        order = np.argsort(timestamps, kind='stable')
+        timestamps = timestamps[order]
+        isLast = np.ones(len(timestamps), dtype=bool)
+        isLast[:-1] = timestamps[1:] != timestamps[:-1]
+        order = order[isLast]
+        self.timestamps = timestamps[isLast]
+        self.sampleFrameIds = np.array(samples['frameId'][order])
+        self.quaternionArray = QuaternionArray(
+            np.stack((samples['w'][order], samples['x'][order],
+                      samples['y'][order], samples['z'][order]), axis=-1)
+            ).Normalize()
+
     def __radd__(self, other):
         """To be able to generate an AggregatedResults from sum()."""
         if other is 0:
@@ -499,44 +1093,27 @@ class ProcessedResult(object):
             print('Error')
             exit(3)
 
-    def __GetStartOffset(self, pathToOsvrClientIni):
-        """Get the start offset in seconds from the config file of the test."""
-        configParser = configparser.ConfigParser()
-        configParser.read(pathToOsvrClientIni)
-        videoConfigSection = configParser['Config']['textureConfig']
-        self.startOffsetInSecond = \
-            float(configParser[videoConfigSection]['startOffsetInSecond'])
-
     def ComputeAngularVelocity(self):
         """Compute the angular velocity."""
-        qList = list()
-        tList = list()
-        for t in self.filteredQuaternions:
-            q = self.filteredQuaternions[t]
-            qList.append(q)
-            tList.append(t)
-            if len(qList) == 2:
-                q1 = qList[0]
-                q2 = qList[1]
-                # q3 = qList[2]
-
-                # velocity = (Q.Quaternion.Distance(q1, q2) +
-                #             Q.Quaternion.Distance(q2, q3))/2
-                # velocity /= (tList[2]-tList[0])
-                velocity = Q.Quaternion.AverageAngularVelocity(q1,
-                                                               q2,
-                                                               tList[1]-tList[0])
-                self.angularVelocityDict[tList[0] + (tList[1]-tList[0])/2] = \
-                    (q2, velocity)
-
-                qList = qList[1:]
-                tList = tList[1:]
+        self.angularVelocityTimestamps, \
+            self.angularVelocityQuaternionArray, \
+            self.angularVelocityArray = \
+            Trajectory.ComputeAngularVelocities(self.filteredTimestamps,
+                                                self.filteredQuaternionArray)
+        self._angularVelocityDict = None
+        self._velocityComponents = None
+        self.angularVelocitySketches = \
+            [QuantileSketch().Update(values)
+             for values in self.velocityComponents.T]
         self.__filterVelocity()
 
-    def ComputeMaxOrthodromicDistances(self, segSizeList):
+    def ComputeMaxOrthodromicDistances(self, segSizeList,
+                                       earlyTermination=False):
         """Compute the max ortho distance on moving windows.
 
         :param segSizeList: the list of segment size to use
+        :param earlyTermination: see
+        Trajectory.ComputeMaxOrthodromicDistances
         """
         # tmpDict = dict()  # key: timestamp, values: dict key: seg size,
         # # values maxOrthoDist
@@ -559,28 +1136,34 @@ class ProcessedResult(object):
         #         self.maxOrthodromicDistance[segSize].append(
         #             tmpDict[t][segSize])
         self.maxOrthodromicDistance = \
-            Q.ComputeMaxOrthodromicDistances(self.filteredQuaternions,
-                                             segSizeList)
-
-    def ComputePositions(self, width=50, height=50):
+            Trajectory.ComputeMaxOrthodromicDistances(
+                self.filteredTimestamps, self.filteredQuaternionArray,
+                segSizeList, earlyTermination=earlyTermination)
+        self.maxOrthodromicDistanceSketches = \
+            dict((segSize, QuantileSketch().Update(distances))
+                 for segSize, distances in self.maxOrthodromicDistance.items())
+
+    def ComputePositions(self, width=50, height=50,
+                         solidAngleWeighting=False):
         """Compute the position matrix.
 
         :param width: the width of the equirectangular picture generated
         :param height: the height of the equirectangular picture generated
+        :param solidAngleWeighting: if True, weight each pixel by the inverse
+        of its solid angle (see Trajectory.ComputePositionMatrix)
+        :return: (positionCountMatrix, positionMatrix)
         """
-        self.positionMatrix = np.zeros((height, width))
-        for t in self.filteredQuaternions:
-            q = self.filteredQuaternions[t]
-            v = q.Rotation(ORIGINAL_POSITION)
-            theta, phi = v.ToSpherical()
-            i = int(width*(theta + math.pi)/(2*math.pi))
-            j = int(height*phi/math.pi)
-            self.positionMatrix[j, i] += 1
-        if len(self.filteredQuaternions) > 0:
-            self.positionMatrix /= self.positionMatrix.sum()
+        self.positionCountMatrix, self.positionMatrix = \
+            Trajectory.ComputePositionMatrix(
+                self.filteredQuaternionArray,
+                (ORIGINAL_POSITION.x, ORIGINAL_POSITION.y,
+                 ORIGINAL_POSITION.z),
+                width, height, solidAngleWeighting=solidAngleWeighting)
+        return self.positionCountMatrix, self.positionMatrix
 
     def ComputeVision(self, width=50, height=50, horizontalFoVAngle=110,
-                      verticalFoVAngle=90):
+                      verticalFoVAngle=90,
+                      maskPrecision=None):
         """Compute the vision matrix.
 
         The vision matrix is the matrix that contains the probability of vision
@@ -588,8 +1171,10 @@ class ProcessedResult(object):
 
         :param width: the width of the equirectangular picture generated
         :param height: the height of the equirectangular picture generated
+        :param maskPrecision: None to compute the exact mask of each sample
+        or precision in degree of the orientations used to compute
+        approximate viewport masks (see Vision.ViewportMaskCache)
         """
-        self.visionMatrix = np.zeros((height, width))
         # #  compute viewport delimination vector in the original orientation
         # y = math.sqrt(1-math.cos(horizontalFoVAngle))
         # z = math.sqrt(1-math.cos(verticalFoVAngle))
@@ -621,12 +1206,17 @@ class ProcessedResult(object):
         #                     p_headFrame * n_cd > 0 and \
         #                     p_headFrame * n_da > 0:
         #                 self.visionMatrix[j, i] += 1
-        ans = Q.ComputeVision(self.filteredQuaternions, width, height,
-                              horizontalFoVAngle, verticalFoVAngle)
-        for i in range(len(ans)):
-            for j in range(len(ans[i])):
-                self.visionMatrix[j, i] = ans[i][j]
-        if len(self.filteredQuaternions) > 0:
+        if maskPrecision is None:
+            ans = Q.ComputeVision(self.filteredQuaternions, width, height,
+                                  horizontalFoVAngle, verticalFoVAngle)
+        else:
+            ans = Vision.GetViewportMaskCache(width, height,
+                                              horizontalFoVAngle,
+                                              verticalFoVAngle,
+                                              maskPrecision)\
+                .ComputeVision(self.filteredQuaternionArray)
+        self.visionMatrix = np.array(ans).T.copy()
+        if len(self.filteredTimestamps) > 0:
             self.visionMatrix /= self.visionMatrix.sum()
 
 
@@ -650,11 +1240,10 @@ class ProcessedResult(object):
         """Filter the quaternions."""
         step = self.step
         # self.filteredQuaternions = self.quaternions
-        if len(self.quaternions.keys()) == 0:
-            self.filteredQuaternions = self.quaternions
+        if len(self.timestamps) == 0:
             return
         minTimestamp = self.startOffsetInSecond + self.skiptime
-        maxTimestamp = max(self.quaternions.keys())
+        maxTimestamp = self.timestamps[-1]
         # timestampList = sorted(self.quaternions.keys())
         # for t_mid in np.arange(0, maxTimestamp, step/2):
         #     t1 = None
@@ -683,35 +1272,15 @@ class ProcessedResult(object):
         #                                    k)
         #     if q_mid is not None:
         #         self.filteredQuaternions[t_mid] = q_mid
-        timestampList1 = sorted(self.quaternions.keys())
-        timestampList2 = timestampList1.copy()
-        t1 = timestampList1[0]
-        t2 = timestampList2[0]
-        startTime = minTimestamp
-        for t_mid in np.arange(minTimestamp, maxTimestamp, step/2):
-            if t_mid >= t1:
-                minTimestamp = t_mid
-                break
-        for t_mid in np.arange(minTimestamp, maxTimestamp, step/2):
-            while len(timestampList1) > 0 and timestampList1[0] <= t_mid:
-                t1 = timestampList1.pop(0)
-            while len(timestampList2) > 0 and timestampList2[0] < t_mid:
-                timestampList2.pop(0)
-                t2 = timestampList2[0]
-            if t1 != t2:
-                k = (t_mid - t1)/(t2 - t1)
-                q_mid = Q.Quaternion.SLERP(self.quaternions[t1],
-                                           self.quaternions[t2],
-                                           k)
-                # q_mid = self.quaternions[t1]
-            else:
-                q_mid = self.quaternions[t1]
-            q_mid.Normalize()
-            self.filteredQuaternions[t_mid] = q_mid
+        self.filteredTimestamps, self.filteredQuaternionArray = \
+            Trajectory.ResampleQuaternions(self.timestamps,
+                                           self.quaternionArray,
+                                           minTimestamp, maxTimestamp, step)
+        self._filteredQuaternions = None
 
     def StoreAngularVelocity(self, filePath):
-        """Store the position matrix image in a file."""
-        StoreAngularVelocity(self.angularVelocityDict, filePath, False)
+        """Store angular velocity cdf to file."""
+        StoreAngularVelocity(self.angularVelocitySketches, filePath)
 
     def StorePositions(self, filePath, vmax=None):
         """Store the position matrix image in a file."""
@@ -734,152 +1303,443 @@ class ProcessedResult(object):
                         i, j, self.positionMatrix[j, i]
                     ))
 
+class ResultSummary(object):
+    """Compact summary of a ProcessedResult shared by all the aggregates.
+
+    It is computed once from the processed result and stored next to it:
+    the user, age, video and total aggregates merge the states of the
+    summaries and the global statistics read their time series, without
+    loading the processed results.
+    """
+
+    def __init__(self, processedResult):
+        """Summarize the processedResult."""
+        self.version = PROCESSED_RESULT_VERSION
+        self.cacheKey = processedResult.cacheKey
+        self.step = processedResult.step
+        self.state = AggregateState.FromProcessedResult(processedResult)
+        filteredTimestamps = processedResult.filteredTimestamps.tolist()
+        self.filteredStartTime = min(filteredTimestamps, default=None)
+        self.filteredEndTime = max(filteredTimestamps, default=None)
+        # copies of the arrays (they can be memory-mapped from a store)
+        self.angularVelocityTimestamps = \
+            np.array(processedResult.angularVelocityTimestamps)
+        # same operations than Vector.Norm
+        x, y, z = processedResult.angularVelocityArray.xyz.T
+        self.angularVelocityNorms = np.sqrt(x*x + y*y + z*z)
+        self.maxOrthodromicDistance = \
+            dict((segSize, np.array(distances)) for segSize, distances in
+                 processedResult.maxOrthodromicDistance.items())
+
     @staticmethod
-    def StoreAngVelStats(processedResultList, outputPath):
+    def StoreAngVelStats(resultSummaryList, outputPath):
         """Store all angVelStats.
 
-        :param processedResultList: List of tuple (userId, videoId,
-        ProcessedResult)  from which we want to get the angular velocity data
+        :param resultSummaryList: List of tuple (userId, videoId,
+        ResultSummary)  from which we want to get the angular velocity data
         :param outputPath: path without extension to the output file
         """
         minStartTime = dict()
         maxEndTime = dict()
         segSize = 2
-        for userId, videoId, processedResult in processedResultList:
+        for userId, videoId, summary in resultSummaryList:
             if videoId not in minStartTime:
                 minStartTime[videoId] = sys.maxsize
             if videoId not in maxEndTime:
                 maxEndTime[videoId] = 0
             minStartTime[videoId] = min(minStartTime[videoId],
-                                        min(processedResult
-                                            .filteredQuaternions.keys()))
+                                        summary.filteredStartTime)
             maxEndTime[videoId] = max(maxEndTime[videoId],
-                                      max(processedResult
-                                          .filteredQuaternions.keys()))
+                                      summary.filteredEndTime)
         with open('{}_angVelGlobal.txt'.format(outputPath), 'w') as o:
-            for userId, videoId, processedResult in processedResultList:
+            for userId, videoId, summary in resultSummaryList:
                 o.write('{};{}'.format(userId, videoId))
-                for angVelTimestamp in processedResult.angularVelocityDict:
-                    q, angVel = \
-                        processedResult.angularVelocityDict[angVelTimestamp]
-                    o.write(';{}'.format(angVel.Norm()))
+                for angVelNorm in summary.angularVelocityNorms.tolist():
+                    o.write(';{}'.format(angVelNorm))
                 o.write('\n')
         with open('{}_angVelSegment.txt'.format(outputPath), 'w') as o:
-            for userId, videoId, processedResult in processedResultList:
+            for userId, videoId, summary in resultSummaryList:
+                segmentIds = np.floor(
+                    (summary.angularVelocityTimestamps -
+                     minStartTime[videoId]) / segSize).astype(np.int64)
                 for segId in range(0, math.floor((maxEndTime[videoId] -
                                                   minStartTime[videoId]) /
                                                  segSize)):
                     o.write('{};{};{}'.format(userId, videoId, segId))
-                    for angVelTimestamp in processedResult.angularVelocityDict:
-                        q, angVel = \
-                            processedResult\
-                            .angularVelocityDict[angVelTimestamp]
-                        if math.floor((angVelTimestamp -
-                                       minStartTime[videoId]) /
-                                      segSize) == segId:
-                            o.write(';{}'.format(angVel.Norm()))
+                    for angVelNorm in \
+                            summary.angularVelocityNorms[segmentIds ==
+                                                         segId].tolist():
+                        o.write(';{}'.format(angVelNorm))
                     o.write('\n')
         with open('{}_angVelGlobalTimeSerie.txt'.format(outputPath), 'w') as o:
-            for userId, videoId, processedResult in processedResultList:
+            for userId, videoId, summary in resultSummaryList:
                 o.write('{};{}'.format(userId, videoId))
-                for angVelTimestamp in processedResult.angularVelocityDict:
-                    q, angVel = \
-                        processedResult.angularVelocityDict[angVelTimestamp]
-                    o.write(';{};{}'.format(angVelTimestamp, angVel.Norm()))
+                for angVelTimestamp, angVelNorm in zip(
+                        summary.angularVelocityTimestamps.tolist(),
+                        summary.angularVelocityNorms.tolist()):
+                    o.write(';{};{}'.format(angVelTimestamp, angVelNorm))
                 o.write('\n')
         with open('{}_orthoDistGlobal.txt'.format(outputPath), 'w') as o:
-            for userId, videoId, processedResult in processedResultList:
+            for userId, videoId, summary in resultSummaryList:
                 o.write('{};{}'.format(userId, videoId))
-                for orthoDist in processedResult.maxOrthodromicDistance[2]:
+                for orthoDist in summary.maxOrthodromicDistance[2]:
                     o.write(';{}'.format(orthoDist))
                 o.write('\n')
         with open('{}_orthoDistSegment.txt'.format(outputPath), 'w') as o:
-            for userId, videoId, processedResult in processedResultList:
+            for userId, videoId, summary in resultSummaryList:
                 for segId in range(0, math.floor((maxEndTime[videoId] -
                                                   minStartTime[videoId]) /
                                                  segSize)):
                     o.write('{};{};{}'.format(userId, videoId, segId))
-                    currentTs = min(processedResult.filteredQuaternions.keys())
-                    for orthoDist in processedResult.maxOrthodromicDistance[2]:
+                    currentTs = summary.filteredStartTime
+                    for orthoDist in summary.maxOrthodromicDistance[2]:
                         if math.floor((currentTs -
                                        minStartTime[videoId]) /
                                       segSize) == segId:
                             o.write(';{}'.format(orthoDist))
-                        currentTs += processedResult.step
+                        currentTs += summary.step
                     o.write('\n')
         with open('{}_orthoDistGlobalTimeSerie.txt'.format(outputPath), 'w') \
                 as o:
-            for userId, videoId, processedResult in processedResultList:
+            for userId, videoId, summary in resultSummaryList:
                 o.write('{};{}'.format(userId, videoId))
-                currentTs = min(processedResult.filteredQuaternions.keys())
-                for orthoDist in processedResult.maxOrthodromicDistance[2]:
+                currentTs = summary.filteredStartTime
+                for orthoDist in summary.maxOrthodromicDistance[2]:
                     o.write(';{};{}'.format(currentTs, orthoDist))
-                    currentTs += processedResult.step
+                    currentTs += summary.step
                 o.write('\n')
 
 
+def GetArraysSize(value):
+    """Return the size in bytes of the arrays in value.
+
+    value is a numpy array, a QuaternionArray, a VectorArray, a
+    QuantileSketch or a list, tuple or dict of them (other objects are
+    ignored).
+    """
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, QuaternionArray):
+        return value.wxyz.nbytes
+    if isinstance(value, VectorArray):
+        return value.xyz.nbytes
+    if isinstance(value, QuantileSketch):
+        return sum(level.nbytes for level in value.levels)
+    if isinstance(value, dict):
+        value = value.values()
+    if isinstance(value, (list, tuple, type({}.values()))):
+        return sum(GetArraysSize(v) for v in value)
+    return 0
+
+
+def GetProcessedResultCache(maxBytes=None):
+    """Return the ProcessedResultCache of the process.
+
+    :param maxBytes: if not None, new memory budget of the cache
+    """
+    global global_result_cache
+    if global_result_cache is None:
+        global_result_cache = ProcessedResultCache()
+    if maxBytes is not None:
+        global_result_cache.SetMaxBytes(maxBytes)
+    return global_result_cache
+
+
+class ProcessedResultCache(object):
+    """LRU cache of the ProcessedResults used by a process.
+
+    The results are stored with their cache key (see
+    ResultContainer.GetCacheKey). The size of a result (see
+    ProcessedResult.GetMemorySize) is measured again at each access: it
+    grows with the arrays loaded and the dicts built on demand.
+    """
+
+    def __init__(self, maxBytes=DEFAULT_RESULT_CACHE_BYTES):
+        """Init an empty cache.
+
+        :param maxBytes: memory budget of the stored results (0 disables
+        the cache)
+        """
+        self.maxBytes = maxBytes
+        self.results = OrderedDict()  # key: cacheKey, value: (result, size)
+        self.usedBytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def SetMaxBytes(self, maxBytes):
+        """Change the memory budget (the extra results are removed)."""
+        self.maxBytes = maxBytes
+        self.__Evict()
+
+    def Get(self, cacheKey):
+        """Return the result stored with cacheKey or None."""
+        entry = self.results.get(cacheKey)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.Put(cacheKey, entry[0])
+        return entry[0]
+
+    def Put(self, cacheKey, processedResult):
+        """Store the result as the most recently used one.
+
+        The least recently used results are removed to fit in the budget,
+        the result itself is not kept if it is larger than the budget.
+        """
+        if cacheKey in self.results:
+            self.usedBytes -= self.results.pop(cacheKey)[1]
+        size = processedResult.GetMemorySize()
+        self.results[cacheKey] = (processedResult, size)
+        self.usedBytes += size
+        self.__Evict()
+
+    def PopCounters(self):
+        """Return the hits, misses and evictions counts and reset them.
+
+        The counts of all the tasks run by the processes of a pool can be
+        summed (see AddCounters).
+        """
+        counters = {'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        return counters
+
+    def __Evict(self):
+        """Remove the least recently used results over the budget."""
+        while self.usedBytes > self.maxBytes and len(self.results) > 0:
+            _, (_, size) = self.results.popitem(last=False)
+            self.usedBytes -= size
+            self.evictions += 1
+
+
+def AddCounters(counters, otherCounters):
+    """Add the counts of otherCounters to counters (in place)."""
+    for name, count in otherCounters.items():
+        counters[name] = counters.get(name, 0) + count
+    return counters
+
+
 class ResultContainer(object):
     """This class contains information about a result but not the result."""
 
-    def __init__(self, resultPath, resultId, user, videoId):
+    def __init__(self, resultPath, resultId, user, testId, videoId,
+                 datasetPackPath=None):
         """Init the class.
 
         :param resultPath: the path to the raw result file.
+        :param testId: id of the test of the result (name of the test
+        folder)
+        :param datasetPackPath: path to a DatasetPack that contains the
+        result or None to read the raw result file.
         """
         self.resultPath = resultPath
+        self.datasetPackPath = datasetPackPath
         self.resultId = resultId
         self.user = user
+        self.userId = user.uid
+        self.testId = testId
         self.videoId = videoId
         self.pathToIndividualStatistic = os.path.join(PATH_TO_STATISTIC_RESULTS,
                                                       'individual',
                                                       self.resultId)
         self.step = None
-        self.processedResult = None
+        self._sourceFingerprint = None
         self.resultContainerDumpPath = \
             '{}.dump'.format(self.pathToIndividualStatistic)
-        self.resultProcessedDumpPath = \
-            '{}_processed.dump'.format(self.pathToIndividualStatistic)
         self.isNew = False
 
+    def GetSourceFingerprint(self):
+        """Return the md5 of the samples and start offset of the result.
+
+        The samples are read from the DatasetPack or from the log cache,
+        the fingerprint is computed once per container.
+        """
+        if self._sourceFingerprint is None:
+            datasetPack = self.GetDatasetPack()
+            if datasetPack is not None:
+                samples = datasetPack.GetSamples(*self.GetPackKey())
+                startOffsetInSecond = \
+                    datasetPack.GetStartOffsetInSecond(*self.GetPackKey())
+            else:
+                samples = LogCache.LoadLog(self.resultPath)
+                startOffsetInSecond = \
+                    LogCache.GetStartOffsetInSecond(self.resultPath)
+            d = hashlib.md5(np.ascontiguousarray(samples).tobytes())
+            d.update(repr(float(startOffsetInSecond)).encode())
+            self._sourceFingerprint = d.hexdigest()
+        return self._sourceFingerprint
+
+    def GetCacheKey(self, step=None):
+        """Return the key of the processed result and of its summary.
+
+        The key changes if the samples of the result or any parameter of
+        the processing change.
+        """
+        if step is None:
+            step = self.step
+        return GetCacheKey(PROCESSED_RESULT_VERSION, self.resultId,
+                           self.GetSourceFingerprint(), step,
+                           RESULT_PARAMETERS)
+
     def GetProcessedResult(self, step=None):
-        """Get the stored processedResult or compute it."""
+        """Get the processedResult from the cache, from its store or compute it.
+
+        A cached or stored processedResult is used only if it has the current
+        cache key (see GetCacheKey). The processedResult is kept in the
+        ProcessedResultCache of the process.
+        """
         if step is None:
             step = self.step
-        if self.step == step:
-            if self.processedResult is None:
-                pr = Load(self.resultProcessedDumpPath)
-                if pr is not None:
-                    self.processedResult = pr
-                else:
-                    self.step = 0
-        elif self.step != step:
-            self.step = step
-            self.processedResult = None
-            Store(self, self.resultContainerDumpPath)
-            self.processedResult = ProcessedResult(self.resultPath,
-                                                   skiptime=10,
-                                                   step=step)
-            self.processedResult.ComputeAngularVelocity()
-            self.processedResult.ComputeMaxOrthodromicDistances([1,
-                                                                 2,
-                                                                 3,
-                                                                 5,
-                                                                 10])
-            self.processedResult.ComputePositions(width=100, height=100)
-            self.processedResult.ComputeVision(width=100, height=50,
-                                               horizontalFoVAngle=110,
-                                               verticalFoVAngle=90)
-            Store(self.processedResult, self.resultProcessedDumpPath)
-        return self.processedResult
+        cacheKey = self.GetCacheKey(step)
+        self.step = step
+        resultCache = GetProcessedResultCache()
+        processedResult = resultCache.Get(cacheKey)
+        if processedResult is None:
+            processedResult = ProcessedResult.FromStore(self.resultStorePath)
+            if processedResult is not None:
+                # computes the result again if the store is damaged
+                processedResult._resultContainer = self
+        if processedResult is None or \
+                getattr(processedResult, 'cacheKey', None) != cacheKey:
+            processedResult = self.ComputeProcessedResult(step, cacheKey)
+        resultCache.Put(cacheKey, processedResult)
+        return processedResult
+
+    def ComputeProcessedResult(self, step, cacheKey):
+        """Compute the processedResult and write its store.
+
+        :param cacheKey: cache key of the processedResult (see GetCacheKey)
+        """
+        self.StoreContainer()
+        parameters = RESULT_PARAMETERS
+        datasetPack = self.GetDatasetPack()
+        if datasetPack is not None:
+            processedResult = ProcessedResult.FromDatasetPack(
+                datasetPack, *self.GetPackKey(),
+                skiptime=parameters['skiptime'], step=step)
+        else:
+            processedResult = ProcessedResult(
+                self.resultPath, skiptime=parameters['skiptime'],
+                step=step)
+        processedResult.ComputeAngularVelocity()
+        processedResult.ComputeMaxOrthodromicDistances(
+            parameters['segSizeList'])
+        processedResult.ComputePositions(
+            width=parameters['positionWidth'],
+            height=parameters['positionHeight'])
+        processedResult.ComputeVision(
+            width=parameters['visionWidth'],
+            height=parameters['visionHeight'],
+            horizontalFoVAngle=parameters['horizontalFoVAngle'],
+            verticalFoVAngle=parameters['verticalFoVAngle'],
+            maskPrecision=parameters['maskPrecision'])
+        processedResult.cacheKey = cacheKey
+        processedResult.WriteStore(self.resultStorePath)
+        # dill dump of the processed results of the older versions
+        legacyDumpPath = \
+            '{}_processed.dump'.format(self.pathToIndividualStatistic)
+        if os.path.exists(legacyDumpPath):
+            os.remove(legacyDumpPath)
+        return processedResult
+
+    @property
+    def resultStorePath(self):
+        """Path to the ResultStore of the processed result."""
+        return '{}_processed'.format(self.pathToIndividualStatistic)
+
+    @property
+    def resultSummaryDumpPath(self):
+        """Path to the dump of the ResultSummary."""
+        return '{}_summary.dump'.format(self.pathToIndividualStatistic)
+
+    def LoadResultSummary(self, step=None):
+        """Return the stored ResultSummary or None if it is not up to date.
+
+        The processed result is not loaded.
+        """
+        summary = Load(self.resultSummaryDumpPath)
+        if summary is not None and \
+                getattr(summary, 'cacheKey', None) == self.GetCacheKey(step):
+            return summary
+        return None
+
+    def GetResultSummary(self, step=None):
+        """Get the stored ResultSummary or compute it."""
+        summary = self.LoadResultSummary(step)
+        if summary is None:
+            summary = ResultSummary(self.GetProcessedResult(step))
+            Store(summary, self.resultSummaryDumpPath)
+        return summary
+
+    def StoreContainer(self):
+        """Store the container in its dump file.
+
+        The source fingerprint is not stored: it is computed again at each
+        run (the source may change between two runs).
+        """
+        rc = copy.copy(self)
+        rc._sourceFingerprint = None
+        Store(rc, self.resultContainerDumpPath)
+
+    def __getstate__(self):
+        """Do not store (or send to the workers) the User.
+
+        It is set by LoadResultContainer. The source fingerprint is sent to
+        the workers with the container: it is computed once per run (see
+        StoreContainer).
+        """
+        state = self.__dict__.copy()
+        state['user'] = None
+        return state
+
+    def __setstate__(self, state):
+        """Restore the container.
+
+        The old dumps have no fingerprint and no userId, they have a
+        processedResult attribute (the processed results are now kept by the
+        ProcessedResultCache).
+        """
+        self.__dict__.update(state)
+        self.__dict__.pop('processedResult', None)
+        if 'userId' not in state:
+            self.userId = state['user'].uid
+        self.__dict__.setdefault('_sourceFingerprint', None)
 
     def __radd__(self, other):
         """Right hand addition."""
         return other + self.GetProcessedResult()
 
+    def GetPackKey(self):
+        """Return the (userId, testId, videoId) key of the result."""
+        return (str(self.userId), self.testId, self.videoId)
+
+    def GetDatasetPack(self):
+        """Return the DatasetPack to use or None if the result is not in it.
+
+        The pack is not used if the raw result file changed since the pack
+        was built.
+        """
+        if self.datasetPackPath is None:
+            return None
+        datasetPack = DatasetPack.GetDatasetPack(self.datasetPackPath)
+        if datasetPack.IsUpToDate(*self.GetPackKey(),
+                                  logPath=self.resultPath):
+            return datasetPack
+        return None
 
     @staticmethod
-    def LoadResultContainer(resultPath, resultId, user, videoId):
-        """Load the existing result container or create it."""
+    def LoadResultContainer(resultPath, resultId, user, testId, videoId,
+                            datasetPackPath=None):
+        """Load the existing result container or create it.
+
+        The User, the testId (missing in the old dumps) and the
+        datasetPackPath of a loaded container are set again.
+        """
         pathToIndividualStatistic = os.path.join(PATH_TO_STATISTIC_RESULTS,
                                                  'individual',
                                                  resultId)
@@ -888,8 +1748,12 @@ class ResultContainer(object):
         rc = Load(resultContainerDumpPath)
         if rc is not None:
             rc.isNew = False
+            rc.user = user
+            rc.testId = testId
+            rc.datasetPackPath = datasetPackPath
         else:
-            rc = ResultContainer(resultPath, resultId, user, videoId)
+            rc = ResultContainer(resultPath, resultId, user, testId, videoId,
+                                 datasetPackPath)
             rc.isNew = True
         return rc
 
@@ -897,20 +1761,26 @@ class ResultContainer(object):
 class AggregateContainer(object):
     """Contains informations about an aggregate."""
 
-    def __init__(self, step, size):
-        """Init the container."""
-        self.step = step
-        self.size = size
+    def __init__(self, cacheKey):
+        """Init the container.
+
+        :param cacheKey: key of the aggregate (see GetCacheKey)
+        """
+        self.cacheKey = cacheKey
         self.isNew = False
 
     @staticmethod
-    def Load(dumpPath, step, size):
-        """Load or create the AggregateContainer."""
+    def Load(dumpPath, cacheKey):
+        """Load or create the AggregateContainer.
+
+        The stored aggregate is up to date (isNew is False) only if it has
+        the same cache key.
+        """
         ac = Load(dumpPath)
-        if ac is not None and ac.step == step and ac.size == size:
+        if ac is not None and getattr(ac, 'cacheKey', None) == cacheKey:
             ac.isNew = False
         else:
-            ac = AggregateContainer(step, size)
+            ac = AggregateContainer(cacheKey)
             ac.isNew = True
         return ac
 
@@ -918,21 +1788,83 @@ global_statistics = None
 
 
 def Load(pathToFile):
-    """Load the object of exist or return None."""
+    """Load the object if it exists or return None.
+
+    A damaged file (wrong checksum, see ResultStore.ReadDump) or a file that
+    cannot be unpickled is logged and ignored: None is returned.
+    """
     if not os.path.exists(pathToFile):
         return None
-    else:
-        try:
-            with open(pathToFile, 'rb') as f:
-                return dill.load(f)
-        except:
-            return None
+    try:
+        return ResultStore.ReadDump(pathToFile)
+    except Exception as e:
+        logging.getLogger('TestManager.Helpers.Statistics').warning(
+            'Ignore the cache file {}: {}'.format(pathToFile, e))
+        return None
+
+
+def GetCacheKey(*parts):
+    """Return the cache key (md5 hex string) of the parts.
+
+    The parts are hashed through their repr: they have to be built from
+    strings, numbers and tuples, lists or dicts of them.
+    """
+    return hashlib.md5(repr(parts).encode()).hexdigest()
 
 
 def Store(obj, pathToFile):
-    """Store the object."""
-    with open(pathToFile, 'wb') as f:
-        dill.dump(obj, f)
+    """Store the object (atomically, with a checksum footer)."""
+    ResultStore.WriteDump(obj, pathToFile)
+
+
+def ListCacheEntries(rootPath=PATH_TO_STATISTIC_RESULTS):
+    """Yield the paths to the dump files and to the stores in rootPath."""
+    for dirPath, dirNames, fileNames in os.walk(rootPath):
+        for dirName in list(dirNames):
+            if os.path.exists(os.path.join(dirPath, dirName,
+                                           ResultStore.META_FILE_NAME)):
+                dirNames.remove(dirName)
+                yield os.path.join(dirPath, dirName)
+        for fileName in fileNames:
+            if fileName.endswith('.dump'):
+                yield os.path.join(dirPath, fileName)
+
+
+def VerifyCacheEntry(path):
+    """Return None if the dump file or store is valid, the error else."""
+    if os.path.isdir(path):
+        return ResultStore.VerifyStore(path)
+    return ResultStore.VerifyDump(path)
+
+
+def VerifyCache(rootPath=PATH_TO_STATISTIC_RESULTS, pool=None):
+    """Check the checksums of all the cache entries in rootPath.
+
+    The damaged entries are logged and removed: they are computed again by
+    the next run.
+
+    :param pool: pathos pool used to check the entries in parallel (a new
+    ProcessingPool if None)
+    :return: the list of the paths of the damaged entries
+    """
+    logger = logging.getLogger('TestManager.Helpers.Statistics')
+    if pool is None:
+        pool = ProcessingPool()
+    entries = list(ListCacheEntries(rootPath))
+    damagedEntries = list()
+    for path, error in zip(entries, pool.map(VerifyCacheEntry, entries)):
+        if error is None:
+            continue
+        logger.warning('Remove the damaged cache entry {}: {}'.format(path,
+                                                                      error))
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+        damagedEntries.append(path)
+    logger.info('{} cache entries checked, {} damaged'.format(
+        len(entries), len(damagedEntries)))
+    return damagedEntries
 
 
 def GetGlobalStatistics(*args, **kwargs):
@@ -946,9 +1878,21 @@ def GetGlobalStatistics(*args, **kwargs):
 class Statistics(object):
     """Class that compute statistics information about the different tests."""
 
-    def __init__(self, userManager):
-        """Init the statistics with the userManager object."""
+    def __init__(self, userManager, datasetPackPath=None, videoManager=None,
+                 resultCacheBytes=DEFAULT_RESULT_CACHE_BYTES):
+        """Init the statistics with the userManager object.
+
+        :param datasetPackPath: path to a DatasetPack used to read the
+        results or None to read the raw result files
+        :param videoManager: VideoManager used to find the source videos of
+        the heatmap overlays
+        :param resultCacheBytes: memory budget of the ProcessedResultCache
+        of each process
+        """
         self.userManager = userManager
+        self.datasetPackPath = datasetPackPath
+        self.videoManager = videoManager
+        self.resultCacheBytes = resultCacheBytes
         self.workingThread = None
         self.progressBar = None
         self.done = True
@@ -965,8 +1909,13 @@ class Statistics(object):
         print(s, end='')
         sys.stdout.flush()
 
-    def RunComputation(self, withVideo=False):
-        """Do the work to compute the statistics."""
+    def RunComputation(self, withVideo=False, withOverlay=False):
+        """Do the work to compute the statistics.
+
+        :param withVideo: if True generate the heatmap videos
+        :param withOverlay: if True generate the heatmaps overlaid on the
+        source videos (needs the videoManager)
+        """
         self.progressBar = dict()
         self.doneCallback = None
         # self.resultsByIdInfo = dict()
@@ -1003,10 +1952,9 @@ class Statistics(object):
                             #                                   user.age)
 
                             self.resultsContainers[resultId] = \
-                                ResultContainer.LoadResultContainer(resultPath,
-                                                                    resultId,
-                                                                    user,
-                                                                    videoId)
+                                ResultContainer.LoadResultContainer(
+                                    resultPath, resultId, user, testId,
+                                    videoId, self.datasetPackPath)
                         # resultsById[resultId] = ProcessedResult(resultPath)
                         # resultsByUser[userId].append(resultsById[resultId])
                         # resultsByVideo[videoId].append(resultsById[resultId])
@@ -1021,7 +1969,7 @@ class Statistics(object):
         #self.workingThread = threading.Thread(
             # target=partial(Statistics._ComputationWorkThread, self, withVideo)
             # )
-        self._ComputationWorkThread(withVideo)
+        self._ComputationWorkThread(withVideo, withOverlay)
         self.done = False
         #self.workingThread.start()
 
@@ -1036,7 +1984,7 @@ class Statistics(object):
             # self.workingThread.join()
             self.workingThread = None
 
-    def _ComputationWorkThread(self, withVideo):
+    def _ComputationWorkThread(self, withVideo, withOverlay=False):
         """Thread main function that do the actual computation."""
         if not os.path.exists(PATH_TO_STATISTIC_RESULTS + '/individual'):
             os.makedirs(PATH_TO_STATISTIC_RESULTS + '/individual')
@@ -1076,10 +2024,40 @@ class Statistics(object):
             #         self.resultsById[resultId].positionMatrix.max()
             #         )
 
-        print('\r\033[2KProcess individual results')
+        # the processed results are kept in the ProcessedResultCache of each
+        # process: the results computed by the first stage can be reused by
+        # the video aggregates
+        resultCacheBytes = self.resultCacheBytes
+        resultCacheCounters = dict()
+
+        # the statistics are computed by a graph of tasks: one task by
+        # result, one aggregate task by user, age group and video that
+        # depends only on the tasks of its results and the total task that
+        # depends on all the result tasks. A task runs as soon as the tasks
+        # it depends on are done, the tasks on the critical path first
+        # (their costs are the durations measured by the previous run)
+        timingsPath = PATH_TO_STATISTIC_RESULTS + '/total/timings.dump'
+        previousTimings = Load(timingsPath)
+        if not isinstance(previousTimings, dict):
+            previousTimings = dict()
+        # default cost of a new task: mean duration of the tasks of its kind
+        kindDurations = dict()
+        for name, duration in previousTimings.items():
+            kindDurations.setdefault(name[0], list()).append(duration)
+        kindCosts = dict((kind, sum(durations)/len(durations))
+                         for kind, durations in kindDurations.items())
+        def GetTaskCost(name):
+            return previousTimings.get(name,
+                                       kindCosts.get(name[0],
+                                                     DEFAULT_TASK_COST))
+        graph = TaskGraph.TaskGraph()
+
+        print('\r\033[2KProcess the results and the aggregates')
         self.PrintProgress()
         def WorkerResults(step, rc):
-            if rc.isNew:
+            resultCache = GetProcessedResultCache(resultCacheBytes)
+            summary = rc.LoadResultSummary(step)
+            if rc.isNew or summary is None:
                 processedResult = rc.GetProcessedResult(step)
                 processedResult.StorePositions(
                     PATH_TO_STATISTIC_RESULTS+'/individual/{}'.format(rc.resultId),
@@ -1088,199 +2066,276 @@ class Statistics(object):
                 processedResult.StoreAngularVelocity(
                     PATH_TO_STATISTIC_RESULTS+'/individual/{}.txt'.format(rc.resultId)
                 )
-            return rc
-        async_result = [
-            pool.apipe(
-                WorkerResults,
-                step, self.resultsContainers[resultId]
-                ) for resultId in self.resultsContainers
-            ]
-        for r in async_result:
-            rc = r.get()
-            self.resultsContainers[rc.resultId] = rc
-            self.progressBar['value'] += 1
-            self.PrintProgress()
-        aggrUserResults = dict()
-        aggrVideoResults = dict()
-        aggrAgeResults = dict()
-        print('\r\033[2KProcess results by user')
-        self.PrintProgress()
-        def WorkerUsers(resultsByUser, userId, step):
-            aggSize = len(resultsByUser)
-            if aggSize > 0:
-                dumpPath = \
-                    PATH_TO_STATISTIC_RESULTS+'/users/uid-{}.dump'.format(userId)
-                ac = AggregateContainer.Load(dumpPath, step, aggSize)
-                if ac.isNew:
-                    aggResult = sum(resultsByUser)
-                    aggResult.StorePositions(
-                        PATH_TO_STATISTIC_RESULTS+'/users/uid-{}'.format(userId),
-                        vmax=None
-                    )
-                    aggResult.StoreVision(
-                        PATH_TO_STATISTIC_RESULTS+'/users/uid-{}_vision'.format(userId)
-                    )
-                    aggResult.StoreAngularVelocity(
-                        PATH_TO_STATISTIC_RESULTS+'/users/uid-{}.txt'.format(userId)
-                    )
-                    aggResult.StoreOrthodromicDistance(
-                        PATH_TO_STATISTIC_RESULTS +
-                        '/users/uid-{}_orthoDist.txt'.format(userId)
-                    )
-                    # vmax = max(vmax,
-                    #            aggResult.aggPositionMatrix.max())
-                    Store(ac, dumpPath)
+                summary = rc.GetResultSummary(step)
+            # the arrays of the summary are sent through shared memory, the
+            # source fingerprint is sent to the container of the parent (it
+            # is sent with it to the video aggregate)
+            return SharedArrays.Share(summary), summary.cacheKey, \
+                resultCache.PopCounters(), rc.GetSourceFingerprint()
+        # the results of a video are dispatched one after the other (the
+        # tasks with the same priority are dispatched in insertion order)
+        # so the video aggregate is ready early. They run in any process of
+        # the pool: the video aggregate opens them again from their stores
+        # (memory-mapped), the ProcessedResultCache of a process only serves
+        # the accesses of its own tasks
+        videoOrder = list(self.resultsByVideo.keys())
+        for videoId in videoOrder:
+            for rc in self.resultsByVideo[videoId]:
+                name = ('result', rc.resultId)
+                graph.AddTask(name, WorkerResults, (step, rc),
+                              cost=GetTaskCost(name))
+
+        # an aggregate is computed again only if its key changed
+        def GetAggregate(dumpPath, resultOutputs, *parameters):
+            return AggregateContainer.Load(
+                dumpPath, GetCacheKey([cacheKey for _, cacheKey, _, _ in
+                                       resultOutputs], *parameters))
+
+        # the states of the results are merged in the worker, the shared
+        # summaries are then detached from it
+        def MergeResultStates(resultOutputs):
+            sharedSummaries = [sharedSummary for sharedSummary, _, _, _ in
+                               resultOutputs]
+            aggResult = ReduceAggregateStates({None: sharedSummaries})[None]
+            for sharedSummary in sharedSummaries:
+                SharedArrays.Detach(sharedSummary)
+            return aggResult
+
+        def WorkerUsers(userId, *resultOutputs):
+            dumpPath = \
+                PATH_TO_STATISTIC_RESULTS+'/users/uid-{}.dump'.format(userId)
+            ac = GetAggregate(dumpPath, resultOutputs)
+            if ac.isNew:
+                aggResult = MergeResultStates(resultOutputs)
+                aggResult.StorePositions(
+                    PATH_TO_STATISTIC_RESULTS+'/users/uid-{}'.format(userId),
+                    vmax=None
+                )
+                aggResult.StoreVision(
+                    PATH_TO_STATISTIC_RESULTS+'/users/uid-{}_vision'.format(userId)
+                )
+                aggResult.StoreAngularVelocity(
+                    PATH_TO_STATISTIC_RESULTS+'/users/uid-{}.txt'.format(userId)
+                )
+                aggResult.StoreOrthodromicDistance(
+                    PATH_TO_STATISTIC_RESULTS +
+                    '/users/uid-{}_orthoDist.txt'.format(userId)
+                )
+                # vmax = max(vmax,
+                #            aggResult.aggPositionMatrix.max())
+                Store(ac, dumpPath)
             return None
-        async_result = [
-            pool.apipe(
-                WorkerUsers,
-                self.resultsByUser[userId], userId, step
-                ) for userId in self.resultsByUser
-            ]
-        for r in async_result:
-            r.get()
-            self.progressBar['value'] += 1
-            self.PrintProgress()
 
-        print('\r\033[2KProcess results by age')
-        self.PrintProgress()
-        def WorkerAge(resultsByAge, ageStep, age, step):
-            aggSize = len(resultsByAge)
-            if aggSize > 0:
-                dumpPath = PATH_TO_STATISTIC_RESULTS+'/byAge/{}_{}.dump'.format(
-                    age, age + ageStep
-                    )
-                ac = AggregateContainer.Load(dumpPath, step, aggSize)
-                if ac.isNew:
-                    aggResult = sum(resultsByAge)
-                    aggResult.StorePositions(
-                        PATH_TO_STATISTIC_RESULTS+'/byAge/{}_{}'.format(
-                            age, age + ageStep),
-                        vmax=None
+        def WorkerAge(ageStep, age, *resultOutputs):
+            dumpPath = PATH_TO_STATISTIC_RESULTS+'/byAge/{}_{}.dump'.format(
+                age, age + ageStep
+                )
+            ac = GetAggregate(dumpPath, resultOutputs)
+            if ac.isNew:
+                aggResult = MergeResultStates(resultOutputs)
+                aggResult.StorePositions(
+                    PATH_TO_STATISTIC_RESULTS+'/byAge/{}_{}'.format(
+                        age, age + ageStep),
+                    vmax=None
+                )
+                aggResult.StoreVision(
+                    PATH_TO_STATISTIC_RESULTS+'/byAge/{}_{}_vision'.format(
+                        age, age + ageStep)
+                )
+                aggResult.StoreAngularVelocity(
+                    PATH_TO_STATISTIC_RESULTS+'/byAge/{}_{}.txt'.format(
+                        age, age + ageStep)
+                )
+                aggResult.StoreOrthodromicDistance(
+                    PATH_TO_STATISTIC_RESULTS +
+                    '/byAge/{}_{}_orthoDist.txt'.format(age, age + ageStep)
+                )
+                # vmax = max(vmax,
+                #            aggResult.aggPositionMatrix.max())
+                Store(ac, dumpPath)
+            return None
+
+        def WorkerVideo(resultsByVideo, videoId, step, withVideo,
+                        sourcePath, keyParameters, nbSegments,
+                        *resultOutputs):
+            resultCache = GetProcessedResultCache(resultCacheBytes)
+            dumpPath = PATH_TO_STATISTIC_RESULTS+'/videos/{}.dump'.format(videoId)
+            ac = GetAggregate(dumpPath, resultOutputs, *keyParameters)
+            if ac.isNew:
+                # the vision distances and the videos need the
+                # trajectories of the results
+                aggResult = AggregatedResults.FromState(
+                    MergeResultStates(resultOutputs),
+                    [rc.GetProcessedResult(step) for rc in resultsByVideo])
+                aggResult.StoreVisionDistance(PATH_TO_STATISTIC_RESULTS + \
+                                              '/videos/'
+                                              '{}_visionDistance'.format(
+                                                  videoId))
+                # DEBUG
+                aggResult.StorePositions(
+                    PATH_TO_STATISTIC_RESULTS+'/videos/{}'.format(videoId),
+                    vmax=None
+                )
+                aggResult.StoreVision(
+                    PATH_TO_STATISTIC_RESULTS+'/videos/{}_vision'.format(videoId)
+                )
+                aggResult.StoreAngularVelocity(
+                    PATH_TO_STATISTIC_RESULTS+'/videos/{}.txt'.format(videoId)
+                )
+                aggResult.StoreOrthodromicDistance(
+                    PATH_TO_STATISTIC_RESULTS +
+                    '/videos/{}_orthoDist.txt'.format(videoId)
+                )
+                for segmentSize in ANGULAR_VELOCITY_SEGMENT_SIZES:
+                    aggResult.StoreAngularVelocityPerSegment(
+                        segmentSize=segmentSize,
+                        filePath=PATH_TO_STATISTIC_RESULTS+'/videos/' +
+                        '{}_angVelPerSegment_{}s.txt'.format(videoId,
+                                                             segmentSize)
                     )
-                    aggResult.StoreVision(
-                        PATH_TO_STATISTIC_RESULTS+'/byAge/{}_{}_vision'.format(
-                            age, age + ageStep)
+                if withVideo:
+                    # aggResult.WriteVideo(
+                    aggResult.WriteVideoVision(
+                        PATH_TO_STATISTIC_RESULTS+'/videos/{}.mkv'.format(videoId),
+                        nbSegments=nbSegments,
+                        **HEATMAP_VIDEO_PARAMETERS
                     )
-                    aggResult.StoreAngularVelocity(
-                        PATH_TO_STATISTIC_RESULTS+'/byAge/{}_{}.txt'.format(
-                            age, age + ageStep)
+                if sourcePath is not None:
+                    aggResult.WriteVideoOverlay(
+                        PATH_TO_STATISTIC_RESULTS+'/videos/{}_overlay.mkv'.format(videoId),
+                        sourcePath,
+                        **OVERLAY_VIDEO_PARAMETERS
                     )
-                    aggResult.StoreOrthodromicDistance(
-                        PATH_TO_STATISTIC_RESULTS +
-                        '/byAge/{}_{}_orthoDist.txt'.format(age, age + ageStep)
+                # vmax = max(vmax,
+                #            aggResult.aggPositionMatrix.max())
+                Store(ac, dumpPath)
+            return resultCache.PopCounters()
+
+        def WorkerTotal(*resultOutputs):
+            dumpPath = PATH_TO_STATISTIC_RESULTS+'/total/{}.dump'.format('total')
+            ac = GetAggregate(dumpPath, resultOutputs,
+                              ANGULAR_VELOCITY_SEGMENT_SIZES)
+            if ac.isNew:
+                aggTotal = MergeResultStates(resultOutputs)
+                aggTotal.StorePositions(
+                    PATH_TO_STATISTIC_RESULTS+'/total/{}'.format('total'),
+                    vmax=None
+                )
+                aggTotal.StoreVision(
+                    PATH_TO_STATISTIC_RESULTS+'/total/{}_vision'.format('total')
+                )
+                aggTotal.StoreAngularVelocity(
+                    PATH_TO_STATISTIC_RESULTS+'/total/{}.txt'.format('total')
+                )
+                aggTotal.StoreOrthodromicDistance(
+                    PATH_TO_STATISTIC_RESULTS+'/total/{}.txt'.format('orthoDist')
+                )
+                for segmentSize in ANGULAR_VELOCITY_SEGMENT_SIZES:
+                    aggTotal.StoreAngularVelocityPerSegment(
+                        segmentSize=segmentSize,
+                        filePath=PATH_TO_STATISTIC_RESULTS+'/total/' +
+                        '{}_angVelPerSegment_{}s.txt'.format('total',
+                                                             segmentSize),
+                        useRealTimestamp=False
                     )
-                    # vmax = max(vmax,
-                    #            aggResult.aggPositionMatrix.max())
-                    Store(ac, dumpPath)
+                Store(ac, dumpPath)
             return None
 
-        async_result = [
-            pool.apipe(
-                WorkerAge,
-                self.resultsByAge[age], self.ageStep, age, step
-                ) for age in self.resultsByAge
-            ]
-        for r in async_result:
-            r.get()
-            self.progressBar['value'] += 1
-            self.PrintProgress()
+        def GetResultTaskNames(results):
+            return [('result', rc.resultId) for rc in results]
 
-        print('\r\033[2KProcess results by video')
+        # the aggregates without results are not computed
+        for userId in self.resultsByUser:
+            name = ('user', userId)
+            if len(self.resultsByUser[userId]) > 0:
+                graph.AddTask(name, WorkerUsers, (userId,),
+                              GetResultTaskNames(self.resultsByUser[userId]),
+                              GetTaskCost(name))
+            else:
+                self.progressBar['value'] += 1
+        for age in self.resultsByAge:
+            name = ('age', age)
+            if len(self.resultsByAge[age]) > 0:
+                graph.AddTask(name, WorkerAge, (self.ageStep, age),
+                              GetResultTaskNames(self.resultsByAge[age]),
+                              GetTaskCost(name))
+            else:
+                self.progressBar['value'] += 1
+        # a heatmap video runs in each process of the pool: the CPU cores
+        # are shared by the segments of the videos (see WriteMatrixVideo)
+        videoSegments = max(1, (os.cpu_count() or 1)//pool.ncpus)
+        sourceVideos = dict()
+        if withOverlay and self.videoManager is not None:
+            sourceVideos = self.videoManager.GetVideoDict()
+        for videoId in videoOrder:
+            sourceVideo = sourceVideos.get(videoId)
+            keyParameters = (
+                ANGULAR_VELOCITY_SEGMENT_SIZES,
+                HEATMAP_VIDEO_PARAMETERS if withVideo else None,
+                (sourceVideo.md5sum, OVERLAY_VIDEO_PARAMETERS)
+                if sourceVideo is not None else None)
+            name = ('video', videoId)
+            graph.AddTask(name, WorkerVideo,
+                          (self.resultsByVideo[videoId], videoId, step,
+                           withVideo,
+                           sourceVideo.path if sourceVideo is not None
+                           else None,
+                           keyParameters, videoSegments),
+                          GetResultTaskNames(self.resultsByVideo[videoId]),
+                          GetTaskCost(name))
+        graph.AddTask(('total',), WorkerTotal, (),
+                      GetResultTaskNames(rc for videoId in videoOrder
+                                         for rc in
+                                         self.resultsByVideo[videoId]),
+                      GetTaskCost(('total',)))
         self.PrintProgress()
-        def WorkerVideo(resultsByVideo, videoId, step, withVideo):
-            aggSize = len(resultsByVideo)
-            if aggSize > 0:
-                dumpPath = PATH_TO_STATISTIC_RESULTS+'/videos/{}.dump'.format(videoId)
-                ac = AggregateContainer.Load(dumpPath, step, aggSize)
-                if ac.isNew:
-                    aggResult = sum(resultsByVideo)
-                    aggResult.StoreVisionDistance(PATH_TO_STATISTIC_RESULTS + \
-                                                  '/videos/'
-                                                  '{}_visionDistance'.format(
-                                                      videoId))
-                    # DEBUG
-                    aggResult.StorePositions(
-                        PATH_TO_STATISTIC_RESULTS+'/videos/{}'.format(videoId),
-                        vmax=None
-                    )
-                    aggResult.StoreVision(
-                        PATH_TO_STATISTIC_RESULTS+'/videos/{}_vision'.format(videoId)
-                    )
-                    aggResult.StoreAngularVelocity(
-                        PATH_TO_STATISTIC_RESULTS+'/videos/{}.txt'.format(videoId)
-                    )
-                    aggResult.StoreOrthodromicDistance(
-                        PATH_TO_STATISTIC_RESULTS +
-                        '/videos/{}_orthoDist.txt'.format(videoId)
-                    )
-                    for segmentSize in [1, 2, 3]:
-                        aggResult.StoreAngularVelocityPerSegment(
-                            segmentSize=segmentSize,
-                            filePath=PATH_TO_STATISTIC_RESULTS+'/videos/' +
-                            '{}_angVelPerSegment_{}s.txt'.format(videoId,
-                                                                 segmentSize)
-                        )
-                    if withVideo:
-                        # aggResult.WriteVideo(
-                        aggResult.WriteVideoVision(
-                            PATH_TO_STATISTIC_RESULTS+'/videos/{}.mkv'.format(videoId),
-                            fps=5,
-                            segmentSize=1/5,
-                            widthVideo=960,
-                            heightVideo=480,
-                            widthEqui=100,
-                            heightEqui=50,
-                            horizontalFoVAngle=110,
-                            verticalFoVAngle=90
-                        )
-                    # vmax = max(vmax,
-                    #            aggResult.aggPositionMatrix.max())
-                    Store(ac, dumpPath)
-            return None
 
-        async_result = [
-            pool.apipe(
-                WorkerVideo,
-                self.resultsByVideo[videoId], videoId, step, withVideo
-                ) for videoId in self.resultsByVideo
-            ]
-        for r in async_result:
-            r.get()
+        # each result is read once: the aggregates and the global
+        # statistics use the result summaries. They stay in the shared
+        # memory segments of the workers, owned by this process until the
+        # end of the computation
+        sharedSummaries = dict()
+        resultSummaries = dict()
+        def TaskDone(name, output):
+            if name[0] == 'result':
+                sharedSummary, _, counters, sourceFingerprint = output
+                sharedSummaries[name[1]] = sharedSummary
+                self.resultsContainers[name[1]]._sourceFingerprint = \
+                    sourceFingerprint
+                resultSummaries[name[1]] = SharedArrays.Attach(sharedSummary,
+                                                               own=True)
+                AddCounters(resultCacheCounters, counters)
+            elif name[0] == 'video':
+                AddCounters(resultCacheCounters, output)
             self.progressBar['value'] += 1
             self.PrintProgress()
-
-        print('\r\033[2KProcess results total')
-        self.PrintProgress()
-        aggSize = len(self.resultsContainers)
-        dumpPath = PATH_TO_STATISTIC_RESULTS+'/total/{}.dump'.format('total')
-        ac = AggregateContainer.Load(dumpPath, step, aggSize)
-        if ac.isNew:
-            aggTotal = sum(self.resultsContainers.values())
-            aggTotal.StorePositions(
-                PATH_TO_STATISTIC_RESULTS+'/total/{}'.format('total'),
-                vmax=None
-            )
-            aggTotal.StoreVision(
-                PATH_TO_STATISTIC_RESULTS+'/total/{}_vision'.format('total')
-            )
-            aggTotal.StoreAngularVelocity(
-                PATH_TO_STATISTIC_RESULTS+'/total/{}.txt'.format('total')
-            )
-            aggTotal.StoreOrthodromicDistance(
-                PATH_TO_STATISTIC_RESULTS+'/total/{}.txt'.format('orthoDist')
-            )
-            for segmentSize in [1, 2, 3]:
-                aggTotal.StoreAngularVelocityPerSegment(
-                    segmentSize=segmentSize,
-                    filePath=PATH_TO_STATISTIC_RESULTS+'/total/' +
-                    '{}_angVelPerSegment_{}s.txt'.format('total',
-                                                         segmentSize),
-                    useRealTimestamp=False
-                )
-            Store(ac, dumpPath)
-        self.progressBar['value'] += 1
-        self.PrintProgress()
+        # the summaries of the results done after a failure are not owned
+        # yet: they are removed with the others
+        def TaskAbandoned(name, output):
+            if name[0] == 'result':
+                sharedSummaries[name[1]] = output[0]
+        startTime = time.time()
+        try:
+            graph.Run(pool, onDone=TaskDone, onAbandoned=TaskAbandoned)
+        except BaseException:
+            for sharedSummary in sharedSummaries.values():
+                SharedArrays.Release(sharedSummary)
+            raise
+        wallTime = time.time() - startTime
+        criticalPathTime, criticalPath = graph.GetCriticalPath()
+        logger = logging.getLogger('TestManager.Helpers.Statistics')
+        logger.info(
+            '{} tasks in {:.2f}s: {:.2f}s of work, critical path {:.2f}s '
+            '({} tasks)'.format(len(graph.timings), wallTime,
+                                sum(duration for _, duration in
+                                    graph.timings.values()),
+                                criticalPathTime, len(criticalPath)))
+        for name in sorted(graph.timings, key=lambda name:
+                           -graph.timings[name][1])[:SLOWEST_TASKS_LOGGED]:
+            logger.debug('Task {}: {:.2f}s'.format(name,
+                                                   graph.timings[name][1]))
+        Store(dict((name, duration) for name, (_, duration) in
+                   graph.timings.items()), timingsPath)
 
         # def worker(videoId, processedResult):
         #     processedResult.WriteVideo(
@@ -1304,16 +2359,23 @@ class Statistics(object):
         # pool.join()
         # del self.workingThread
 
-        listProcessedResult = list()
+        listResultSummary = list()
         for resultId in self.resultsContainers:
-            rc = self.resultsContainers[resultId]
             videoId = resultId.split('_')[-1]
             userId = resultId[:-len(videoId)-1]
-            listProcessedResult.append((userId, videoId,
-                                        rc.GetProcessedResult(step)))
-        ProcessedResult.StoreAngVelStats(listProcessedResult,
-                                         PATH_TO_STATISTIC_RESULTS +
-                                         '/total/stats')
+            listResultSummary.append((userId, videoId,
+                                      resultSummaries[resultId]))
+        ResultSummary.StoreAngVelStats(listResultSummary,
+                                       PATH_TO_STATISTIC_RESULTS +
+                                       '/total/stats')
+        del listResultSummary, resultSummaries
+        for sharedSummary in sharedSummaries.values():
+            SharedArrays.Release(sharedSummary)
+        logger.info(
+            'Processed result cache: {} hits, {} misses, {} evictions'.format(
+                resultCacheCounters.get('hits', 0),
+                resultCacheCounters.get('misses', 0),
+                resultCacheCounters.get('evictions', 0)))
         self.done = True
         self.progressBar = None
         self.workingThread = None
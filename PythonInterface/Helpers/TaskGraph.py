@@ -0,0 +1,201 @@
+"""Run a graph of dependent tasks in a process pool.
+
+A task runs as soon as all the tasks it depends on are done: their results
+are appended to its arguments. The ready tasks are dispatched by decreasing
+priority: the cost of the longest path from the task to the end of the
+graph (critical path first). At most one task by process of the pool is
+dispatched at a time, so a task that becomes ready is never queued behind
+less urgent tasks.
+
+The start time and the duration of each task (measured in the process that
+runs it) are recorded in TaskGraph.timings.
+
+When a task fails no other task is dispatched: the tasks already running
+are waited for and their results are handed to onAbandoned (to free the
+resources they hold) before the error is raised again.
+
+Author: Xavier Corbillon
+IMT Atlantique
+"""
+
+import heapq
+import time
+
+# time (in second) waited for a running task before checking the others
+POLL_INTERVAL = 0.005
+
+
+def _RunTask(function, args):
+    """Run the task, return (result, startTime, duration)."""
+    startTime = time.time()
+    result = function(*args)
+    return result, startTime, time.time() - startTime
+
+
+class Task(object):
+    """A node of the TaskGraph."""
+
+    def __init__(self, name, function, args, dependencies, cost):
+        """Init the task.
+
+        :param name: unique (hashable) name of the task
+        :param function: function run by the task (picklable by dill)
+        :param args: tuple of the first arguments of the function
+        :param dependencies: list of the names of the tasks whose results
+        are the next arguments of the function
+        :param cost: estimated duration of the task (used for the
+        priorities)
+        """
+        self.name = name
+        self.function = function
+        self.args = tuple(args)
+        self.dependencies = list(dependencies)
+        self.cost = cost
+        self.successors = list()
+
+
+class TaskGraph(object):
+    """Directed acyclic graph of tasks."""
+
+    def __init__(self):
+        """Init an empty graph."""
+        self.tasks = dict()  # key: name, value: Task (in insertion order)
+        self.timings = dict()  # key: name, value: (startTime, duration)
+
+    def AddTask(self, name, function, args=(), dependencies=(), cost=1.0):
+        """Add a task to the graph (see Task).
+
+        The dependencies have to be added before the task: the graph cannot
+        have cycles.
+        """
+        if name in self.tasks:
+            raise ValueError('Task {} already added'.format(name))
+        task = Task(name, function, args, dependencies, cost)
+        for dependency in task.dependencies:
+            if dependency not in self.tasks:
+                raise ValueError('Unknown dependency {} of task {}'.format(
+                    dependency, name))
+            self.tasks[dependency].successors.append(name)
+        self.tasks[name] = task
+
+    def _GetPathLengths(self, costs):
+        """Return the length of the longest path from each task to the end.
+
+        :param costs: dict name: cost of the task
+        :return: dict name: (length of the path, next task on the path or
+        None)
+        """
+        lengths = dict()
+        # the successors of a task are added after it
+        for name in reversed(list(self.tasks)):
+            nextName = max(self.tasks[name].successors, default=None,
+                           key=lambda successor: lengths[successor][0])
+            lengths[name] = (costs[name] + (lengths[nextName][0]
+                                            if nextName is not None else 0),
+                             nextName)
+        return lengths
+
+    def GetPriorities(self):
+        """Return the dict name: priority of the tasks."""
+        return dict((name, length) for name, (length, _) in
+                    self._GetPathLengths(
+                        dict((name, task.cost) for name, task in
+                             self.tasks.items())).items())
+
+    def GetCriticalPath(self):
+        """Return (duration, list of names) of the measured critical path.
+
+        The durations of the tasks are the ones recorded by Run.
+        """
+        lengths = self._GetPathLengths(
+            dict((name, self.timings[name][1] if name in self.timings else 0)
+                 for name in self.tasks))
+        firstName = max((name for name, task in self.tasks.items()
+                         if len(task.dependencies) == 0), default=None,
+                        key=lambda name: lengths[name][0])
+        path = list()
+        name = firstName
+        while name is not None:
+            path.append(name)
+            name = lengths[name][1]
+        return (lengths[firstName][0] if firstName is not None else 0), path
+
+    def Run(self, pool=None, nbWorkers=None, onDone=None, onAbandoned=None):
+        """Run all the tasks, return the dict name: result of the tasks.
+
+        An exception raised by a task (or by onDone) is raised again by Run
+        once the tasks already dispatched are done.
+
+        :param pool: pathos pool that runs the tasks, if None the tasks run
+        in this process
+        :param nbWorkers: max number of tasks dispatched at once (number of
+        processes of the pool by default)
+        :param onDone: function onDone(name, result) called in this process
+        when a task is done (in completion order)
+        :param onAbandoned: function onAbandoned(name, result) called in this
+        process for each task that succeeded after a task failed (its
+        successors are not run)
+        """
+        if nbWorkers is None:
+            nbWorkers = pool.ncpus if pool is not None else 1
+        priorities = self.GetPriorities()
+        waitingCounts = dict((name, len(task.dependencies)) for name, task
+                             in self.tasks.items())
+        # heap of (-priority, insertion index, name), the index breaks ties
+        # in the insertion order
+        ready = [(-priorities[name], k, name) for k, name in
+                 enumerate(self.tasks) if waitingCounts[name] == 0]
+        heapq.heapify(ready)
+        indexes = dict((name, k) for k, name in enumerate(self.tasks))
+        results = dict()
+        running = dict()  # key: name, value: AsyncResult
+
+        def TaskDone(name, output):
+            result, startTime, duration = output
+            results[name] = result
+            self.timings[name] = (startTime, duration)
+            if onDone is not None:
+                onDone(name, result)
+            for successor in self.tasks[name].successors:
+                waitingCounts[successor] -= 1
+                if waitingCounts[successor] == 0:
+                    heapq.heappush(ready, (-priorities[successor],
+                                           indexes[successor], successor))
+
+        try:
+            while len(ready) > 0 or len(running) > 0:
+                while len(ready) > 0 and len(running) < max(1, nbWorkers):
+                    _, _, name = heapq.heappop(ready)
+                    task = self.tasks[name]
+                    args = task.args + tuple(results[dependency] for
+                                             dependency in task.dependencies)
+                    if pool is None:
+                        TaskDone(name, _RunTask(task.function, args))
+                    else:
+                        running[name] = pool.apipe(_RunTask, task.function,
+                                                   args)
+                doneNames = [name for name, r in running.items() if r.ready()]
+                if len(doneNames) == 0 and len(running) > 0:
+                    next(iter(running.values())).wait(POLL_INTERVAL)
+                for name in doneNames:
+                    TaskDone(name, running.pop(name).get())
+        except BaseException:
+            self._Abandon(running, onAbandoned)
+            raise
+        return results
+
+    def _Abandon(self, running, onAbandoned):
+        """Wait for the running tasks, hand their results to onAbandoned.
+
+        The errors of these tasks are ignored (the first error is raised).
+
+        :param running: dict name: AsyncResult of the running tasks
+        """
+        for name, asyncResult in running.items():
+            try:
+                result, startTime, duration = asyncResult.get()
+            except Exception:
+                continue
+            self.timings[name] = (startTime, duration)
+            if onAbandoned is not None:
+                onAbandoned(name, result)
@@ -0,0 +1,356 @@
+"""Array based processing of head movement trajectories.
+
+A trajectory is a sorted (N,) array of timestamps and a QuaternionArray of
+the N head orientations.
+
+Author: Xavier Corbillon
+IMT Atlantique
+"""
+
+from .Quaternion import Vector, VectorArray, QuaternionArray
+import math
+import numpy as np
+
+# max number of float64 values of a temporary array (~64 MB)
+MAX_CHUNK_VALUES = 8 * 1024 * 1024
+
+# number of offsets of the first chunk of the early termination mode of
+# ComputeMaxOrthodromicDistances, the next chunks are twice larger
+FIRST_CHUNK_SIZE = 64
+
+# margin on the bound used to stop the windows early, larger than the
+# rounding errors of the orthodromic distances
+EARLY_TERMINATION_MARGIN = 1e-12
+
+
+def GetResamplingGrid(firstTimestamp, minTimestamp, maxTimestamp, step):
+    """Return the timestamps used to resample a trajectory.
+
+    The grid is np.arange(minTimestamp, maxTimestamp, step/2) restarted at
+    its first value greater or equal to firstTimestamp.
+
+    :param firstTimestamp: timestamp of the first sample of the trajectory
+    """
+    grid = np.arange(minTimestamp, maxTimestamp, step/2)
+    startIndex = np.searchsorted(grid, firstTimestamp, side='left')
+    if startIndex < len(grid):
+        minTimestamp = grid[startIndex]
+    return np.arange(minTimestamp, maxTimestamp, step/2)
+
+
+def ResampleQuaternions(timestamps, quaternions, minTimestamp, maxTimestamp,
+                        step):
+    """Resample the trajectory on a regular grid with SLERP interpolations.
+
+    For each timestamp t of the grid (see GetResamplingGrid), t1 is the
+    last sample timestamp lower or equal to t and t2 the first sample
+    timestamp greater or equal to t. The orientation at t is the SLERP
+    interpolation between the orientations at t1 and t2.
+
+    :param timestamps: sorted (N,) array of sample timestamps
+    :param quaternions: QuaternionArray of the N normalized orientations
+    :return: (gridTimestamps, QuaternionArray of normalized orientations)
+    """
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    if len(timestamps) == 0:
+        return np.zeros(0), QuaternionArray()
+    grid = GetResamplingGrid(timestamps[0], minTimestamp, maxTimestamp, step)
+    index2 = np.minimum(np.searchsorted(timestamps, grid, side='left'),
+                        len(timestamps) - 1)
+    index1 = np.maximum(np.searchsorted(timestamps, grid, side='right') - 1,
+                        0)
+    output = quaternions.wxyz[index1].copy()
+    toInterpolate = index1 != index2
+    if toInterpolate.any():
+        i1 = index1[toInterpolate]
+        i2 = index2[toInterpolate]
+        t1 = timestamps[i1]
+        k = (grid[toInterpolate] - t1)/(timestamps[i2] - t1)
+        output[toInterpolate] = \
+            QuaternionArray.SLERP(quaternions[i1], quaternions[i2], k).wxyz
+    return grid, QuaternionArray(output).Normalize()
+
+
+def ComputeAngularVelocities(timestamps, quaternions):
+    """Compute the average angular velocity between consecutive samples.
+
+    The angular velocity between q1 at t1 and q2 at t2 is the one of the
+    position p = q.Rotation(Vector(1, 0, 0)): 2 * p1 ^ (p2 - p1) / (t2 - t1)
+    (see Quaternion.AverageAngularVelocity).
+
+    :param timestamps: sorted (N,) array of timestamps
+    :param quaternions: QuaternionArray of the N orientations
+    :return: (midTimestamps, orientations, velocities) with midTimestamps
+    the (N-1,) middle of each interval, orientations the QuaternionArray of
+    the orientation at the end of each interval and velocities the
+    VectorArray of the angular velocities
+    """
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    if len(timestamps) < 2:
+        return np.zeros(0), QuaternionArray(), VectorArray()
+    deltaT = timestamps[1:] - timestamps[:-1]
+    midTimestamps = timestamps[:-1] + deltaT/2
+    positions = quaternions.Rotation(Vector(1, 0, 0)).xyz
+    p1 = positions[:-1]
+    velocities = np.cross(p1, positions[1:] - p1) * \
+        (2.0/deltaT)[:, np.newaxis]
+    return midTimestamps, quaternions[1:], VectorArray(velocities)
+
+
+# columns of the array returned by ComputeVelocityComponents
+VELOCITY_COMPONENTS = ('angVelNorm', 'verticalAngVel', 'horizontalAngVel',
+                       'yawAngVel', 'pitchAngVel', 'rollAngVel')
+
+
+def ComputeVelocityComponents(quaternions, velocities):
+    """Decompose the angular velocities in the frame of the head.
+
+    The yaw, pitch and roll axis of the head are the z, y and x axis rotated
+    by its orientation q. The three projections of w are read from R(q)^T w,
+    with R(q) the rotation matrix of q.
+
+    :param quaternions: QuaternionArray of the N head orientations
+    :param velocities: VectorArray of the N angular velocities
+    :return: (N, 6) array, the columns are given by VELOCITY_COMPONENTS
+    """
+    w = velocities.xyz
+    components = np.empty((len(w), len(VELOCITY_COMPONENTS)))
+    if len(w) == 0:
+        return components
+    components[:, 0] = np.linalg.norm(w, axis=1)
+    components[:, 1] = np.hypot(w[:, 0], w[:, 1])
+    components[:, 2] = np.abs(w[:, 2])
+    # (roll, pitch, yaw) projections
+    projections = np.abs(np.einsum('nij,ni->nj',
+                                   quaternions.RotationMatrices(), w))
+    components[:, 3:6] = projections[:, ::-1]
+    return components
+
+
+def GetPixelSolidAngles(width, height):
+    """Return the (height,) solid angles of the pixels of each row.
+
+    The pixel (i, j) of the equirectangular picture covers the azimuths
+    [2pi*i/width - pi, 2pi*(i+1)/width - pi] and the inclinations
+    [pi*j/height, pi*(j+1)/height].
+    """
+    cosPhi = np.cos(np.pi*np.arange(height + 1)/height)
+    return (2*np.pi/width)*(cosPhi[:-1] - cosPhi[1:])
+
+
+def ComputePositionMatrix(quaternions, origin, width, height,
+                          solidAngleWeighting=False):
+    """Compute the equirectangular matrix of the positions of the head.
+
+    :param quaternions: QuaternionArray of the N orientations
+    :param origin: position of the head when the orientation is identity
+    :param solidAngleWeighting: if True, the number of positions of each
+    pixel is divided by its solid angle before the normalization (i.e.
+    the output is a density on the sphere)
+    :return: (countMatrix, positionMatrix) two (height, width) arrays:
+    the integer number of positions in each pixel and the normalized
+    position matrix (sum equal to 1, or 0 without positions)
+    """
+    theta, phi = quaternions.Rotation(origin).ToSpherical()
+    i = np.minimum((width*(theta + math.pi)/(2*math.pi)).astype(np.int64),
+                   width - 1)
+    j = np.minimum((height*phi/math.pi).astype(np.int64), height - 1)
+    countMatrix = np.bincount(j*width + i, minlength=width*height)\
+        .reshape(height, width)
+    positionMatrix = countMatrix.astype(np.float64)
+    if solidAngleWeighting:
+        positionMatrix /= GetPixelSolidAngles(width, height)[:, np.newaxis]
+    total = positionMatrix.sum()
+    if total > 0:
+        positionMatrix /= total
+    return countMatrix, positionMatrix
+
+
+def OrthodromicDistances(p1, p2):
+    """Return the orthodromic distances between two arrays of positions.
+
+    :param p1: array of unit vectors of shape (..., 3)
+    :param p2: array of unit vectors of shape (..., 3), broadcastable with p1
+    """
+    vectProd = np.cross(p1, p2)
+    return np.arctan2(np.sqrt(np.einsum('...i,...i->...', vectProd,
+                                        vectProd)),
+                      np.einsum('...i,...i->...', p1, p2))
+
+
+def GetWindowEnds(timestamps, segSize):
+    """Return, for each timestamp t1, the index of the first t2 >= t1 with
+    t2 - t1 >= segSize (len(timestamps) if none).
+    """
+    n = len(timestamps)
+    index = np.arange(n)
+    ends = np.searchsorted(timestamps, timestamps + segSize, side='left')
+    # t1 + segSize is rounded: fix the ends to match the t2 - t1 test
+    while True:
+        previous = np.maximum(ends - 1, index)
+        tooFar = timestamps[previous] - timestamps >= segSize
+        ends[tooFar] -= 1
+        following = np.minimum(ends, n - 1)
+        tooClose = (ends < n) & (timestamps[following] - timestamps < segSize)
+        ends[tooClose] += 1
+        if not tooFar.any() and not tooClose.any():
+            return ends
+
+
+def ComputeMaxOrthodromicDistances(timestamps, quaternions, segSizeList,
+                                   earlyTermination=False):
+    """Compute the max orthodromic distance on moving windows.
+
+    For each segment size segSize and each timestamp t1 the output is the
+    max orthodromic distance between the position at t1 and the positions
+    at t2 with t2 - t1 < segSize. Only the t2 with a complete window
+    (maxTimestamp - t2 >= segSize) are considered. The output keys are the
+    same as the ones of CQuaternion.ComputeMaxOrthodromicDistances.
+
+    All the segment sizes are computed in one pass: the distances between
+    each t1 and the positions of its largest window are computed by blocks
+    of timestamps and the max of each smaller window is read in the running
+    max of the largest one.
+
+    :param timestamps: sorted (N,) array of timestamps
+    :param quaternions: QuaternionArray of the N orientations
+    :param segSizeList: the list of segment size to use
+    :param earlyTermination: if True, the windows are processed by chunks
+    of growing size and the processing of a window stops as soon as the
+    distance travelled by the head in the rest of the window cannot change
+    its max (the result is the same).
+    :return: dict segSize: array of max orthodromic distances sorted by
+    timestamps
+    """
+    segSizeList = [float(segSize) for segSize in segSizeList]
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    n = len(timestamps)
+    if n == 0:
+        return dict((segSize, np.zeros(0)) for segSize in segSizeList)
+    maxSegSize = max(segSizeList)
+    maxTimestamp = timestamps[-1]
+    index = np.arange(n)
+    # windowSizes[k, i]: number of t2 in the window of size k of t1 = i
+    windowSizes = np.empty((len(segSizeList), n), dtype=np.int64)
+    isKey = np.empty((len(segSizeList), n), dtype=bool)
+    # a t2 with a previous sample close enough is an output key
+    hasPrevious = np.zeros(n, dtype=bool)
+    hasPrevious[1:] = timestamps[1:] - timestamps[:-1] <= maxSegSize
+    for k, segSize in enumerate(segSizeList):
+        isComplete = maxTimestamp - timestamps >= segSize
+        windowEnds = np.minimum(GetWindowEnds(timestamps, segSize),
+                                np.count_nonzero(isComplete))
+        windowSizes[k] = np.maximum(windowEnds - index - 1, 0)
+        isKey[k] = (windowSizes[k] > 0) | (hasPrevious & isComplete)
+    maxDistances = _ComputeWindowMax(
+        quaternions.Rotation(Vector(1, 0, 0)).xyz, windowSizes,
+        earlyTermination)
+    return dict((segSize, maxDistances[k][isKey[k]])
+                for k, segSize in enumerate(segSizeList))
+
+
+def _ComputeWindowMax(positions, windowSizes, earlyTermination):
+    """Return the max distance between p[i] and p[i+1:i+1+windowSizes[k,i]].
+
+    The windows are compared with the squared chord lengths |p2 - p1|^2
+    (same order than the orthodromic distances but faster to compute), the
+    orthodromic distance is only computed for the pair with the max chord.
+
+    :return: (K, N) array (0 for empty windows)
+    """
+    nbSegSizes, n = windowSizes.shape
+    # maxIndexes[k, i]: index of the farthest position in the window
+    maxIndexes = np.arange(n)[np.newaxis, :].repeat(nbSegSizes, axis=0)
+    largestWindows = windowSizes.max(axis=0)
+    maxWindow = int(largestWindows.max())
+    if maxWindow > 0:
+        # the unused positions of the last windows are read in the padding
+        paddedCoordinates = np.ascontiguousarray(
+            np.concatenate((positions, np.zeros((maxWindow + 1, 3)))).T)
+        pathLengths = None
+        if earlyTermination:
+            # path length travelled from the first position
+            pathLengths = np.zeros(n)
+            np.cumsum(OrthodromicDistances(positions[:-1], positions[1:]),
+                      out=pathLengths[1:])
+        rowsPerBlock = max(1, MAX_CHUNK_VALUES // (4*maxWindow))
+        for blockStart in range(0, n, rowsPerBlock):
+            rows = np.arange(blockStart, min(n, blockStart + rowsPerBlock))
+            rows = rows[largestWindows[rows] > 0]
+            _ComputeBlockMax(paddedCoordinates, rows, windowSizes[:, rows],
+                             maxIndexes, pathLengths)
+    maxDistances = OrthodromicDistances(positions[np.newaxis, :, :],
+                                        positions[maxIndexes])
+    maxDistances[windowSizes == 0] = 0
+    return maxDistances
+
+
+def _ComputeBlockMax(paddedCoordinates, rows, sizes, maxIndexes,
+                     pathLengths):
+    """Fill maxIndexes for the windows of a block of rows.
+
+    :param paddedCoordinates: (3, N + maxWindow + 1) array of the positions
+    :param sizes: (K, R) window sizes of the rows
+    :param pathLengths: path length travelled from the first position, or
+    None to disable the early termination
+    """
+    positions = paddedCoordinates.T
+    currentMax = np.full(len(rows), -1.0)
+    currentIndexes = rows.copy()
+    done = 0
+    chunkSize = FIRST_CHUNK_SIZE if pathLengths is not None \
+        else int(sizes.max(initial=0))
+    while len(rows) > 0:
+        width = min(chunkSize, int(sizes.max()) - done)
+        if rows[-1] - rows[0] + 1 == len(rows):
+            # contiguous rows: read the windows without copy
+            rowSelection = slice(rows[0], rows[-1] + 1)
+        else:
+            rowSelection = rows
+        chords = np.zeros((len(rows), width))
+        for coordinates in paddedCoordinates:
+            delta = np.lib.stride_tricks.sliding_window_view(
+                coordinates[1 + done:], width)[rowSelection] - \
+                coordinates[rowSelection, np.newaxis]
+            np.square(delta, out=delta)
+            chords += delta
+        runningMax = np.maximum.accumulate(chords, axis=1)
+        # index of the running max
+        runningIndexes = np.where(chords == runningMax,
+                                  np.arange(1 + done, 1 + done + width), 0)
+        runningIndexes += rows[:, np.newaxis]
+        np.maximum.accumulate(runningIndexes, axis=1, out=runningIndexes)
+        if done > 0:
+            isPreviousMax = runningMax <= currentMax[:, np.newaxis]
+            runningIndexes[isPreviousMax] = np.broadcast_to(
+                currentIndexes[:, np.newaxis],
+                runningIndexes.shape)[isPreviousMax]
+        currentMax = np.maximum(currentMax, runningMax[:, -1])
+        currentIndexes = runningIndexes[:, -1]
+        for k in range(len(sizes)):
+            ends = np.flatnonzero((sizes[k] > done) &
+                                  (sizes[k] <= done + width))
+            maxIndexes[k, rows[ends]] = \
+                runningIndexes[ends, sizes[k, ends] - done - 1]
+        done += width
+        if pathLengths is not None:
+            # dist(i, j) <= dist(i, i + done) + path(i + done, j)
+            lastDistances = OrthodromicDistances(positions[rows],
+                                                 positions[rows + done])
+            currentDistances = OrthodromicDistances(positions[rows],
+                                                    positions[currentIndexes])
+            for k in range(len(sizes)):
+                pending = np.flatnonzero(sizes[k] > done)
+                bound = lastDistances[pending] + \
+                    pathLengths[rows[pending] + sizes[k, pending]] - \
+                    pathLengths[rows[pending] + done]
+                stop = pending[bound + EARLY_TERMINATION_MARGIN <=
+                               currentDistances[pending]]
+                maxIndexes[k, rows[stop]] = currentIndexes[stop]
+                sizes[k, stop] = 0
+        remaining = sizes.max(axis=0) > done
+        rows = rows[remaining]
+        sizes = sizes[:, remaining]
+        currentMax = currentMax[remaining]
+        currentIndexes = currentIndexes[remaining]
+        chunkSize *= 2
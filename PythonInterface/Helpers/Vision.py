@@ -0,0 +1,394 @@
+"""Viewport masks on equirectangular pictures.
+
+The mask of an orientation q is the set of pixels of the equirectangular
+picture inside the viewport of the head. The ViewportMaskCache stores the
+masks of quantized orientations to avoid the full width x height test for
+each sample of a trajectory.
+
+Author: Xavier Corbillon
+IMT Atlantique
+"""
+
+from .Quaternion import Vector, QuaternionArray
+from .Trajectory import MAX_CHUNK_VALUES
+from collections import OrderedDict
+import math
+import numpy as np
+
+# default size of the yaw/pitch/roll bins of the mask cache, in degree
+DEFAULT_MASK_PRECISION = 0.5
+
+# default memory budget of a mask cache (~64 MB)
+DEFAULT_MASK_CACHE_BYTES = 64 * 1024 * 1024
+
+# estimated memory used by a cache entry in addition to its mask
+MASK_ENTRY_OVERHEAD_BYTES = 200
+
+# number of buckets between two cumulative sums stored by a VisionCube
+VISION_CUBE_CHECKPOINT_BUCKETS = 16
+
+global_mask_caches = dict()
+global_pixel_directions = dict()
+
+
+def GetViewportMaskCache(width, height, horizontalFoVAngle, verticalFoVAngle,
+                         precision=DEFAULT_MASK_PRECISION):
+    """Return the ViewportMaskCache of the parameters (one by process)."""
+    global global_mask_caches
+    key = (width, height, horizontalFoVAngle, verticalFoVAngle, precision)
+    if key not in global_mask_caches:
+        global_mask_caches[key] = ViewportMaskCache(*key)
+    return global_mask_caches[key]
+
+
+def GetPixelDirections(width, height):
+    """Return the (width, height, 3) direction vectors of the pixels.
+
+    The grid of each resolution is computed once by process (the returned
+    array is read only).
+    """
+    global global_pixel_directions
+    if (width, height) not in global_pixel_directions:
+        directions = _ComputePixelDirections(width, height)
+        directions.setflags(write=False)
+        global_pixel_directions[(width, height)] = directions
+    return global_pixel_directions[(width, height)]
+
+
+def _ComputePixelDirections(width, height):
+    """Compute the (width, height, 3) direction vectors of the pixels."""
+    i = np.arange(width, dtype=np.float64)
+    j = np.arange(height, dtype=np.float64)
+    theta = math.pi - (2.0*math.pi*i)/width
+    phi = (math.pi*j)/height
+    sinP = np.sin(phi)
+    directions = np.empty((width, height, 3))
+    directions[:, :, 0] = np.outer(np.cos(theta), sinP)
+    directions[:, :, 1] = np.outer(np.sin(theta), sinP)
+    directions[:, :, 2] = np.cos(phi)[np.newaxis, :]
+    return directions
+
+
+def GetViewportNormals(horizontalFoVAngle, verticalFoVAngle):
+    """Return the (4, 3) inward normals of the viewport delimitation plans."""
+    y = math.sqrt(1-math.cos(horizontalFoVAngle))
+    z = math.sqrt(1-math.cos(verticalFoVAngle))
+    a = np.array([1, y, z])
+    b = np.array([1, y, -z])
+    c = np.array([1, -y, -z])
+    d = np.array([1, -y, z])
+    normals = np.array([np.cross(a, b), np.cross(b, c),
+                        np.cross(c, d), np.cross(d, a)])
+    return normals / np.linalg.norm(normals, axis=1)[:, np.newaxis]
+
+
+def ViewportMasks(quaternions, directions, normals):
+    """Yield (start, masks) with masks the (n, nbPixels) inside-viewport test.
+
+    A pixel p is inside the viewport of q if (q^-1 p q).n > 0 for the four
+    normals n, i.e. if p.(q n q^-1) > 0. The normals are rotated once per
+    quaternion and the test of each plan for a chunk of quaternions is one
+    matrix product. The chunks are sized to keep the temporary arrays under
+    MAX_CHUNK_VALUES values.
+    """
+    flatDirectionsT = directions.reshape(-1, 3).T
+    nbPixels = flatDirectionsT.shape[1]
+    chunkSize = max(1, MAX_CHUNK_VALUES // nbPixels)
+    dots = np.empty((min(chunkSize, len(quaternions)), nbPixels))
+    for start in range(0, len(quaternions), chunkSize):
+        q = quaternions[start:start+chunkSize]
+        n = len(q)
+        masks = np.ones((n, nbPixels), dtype=bool)
+        for normal in normals:
+            rotatedNormals = q.Rotation(Vector(*normal.tolist())).xyz
+            np.dot(rotatedNormals, flatDirectionsT, out=dots[:n])
+            masks &= dots[:n] > 0
+        yield start, masks
+
+
+def ToEulerAngles(quaternions):
+    """Return the (N, 3) yaw, pitch, roll angles of the orientations.
+
+    q is the rotation of yaw around z, then of pitch around y, then of roll
+    around x (in the head frame).
+    """
+    r = quaternions.RotationMatrices()
+    angles = np.empty((len(r), 3))
+    angles[:, 0] = np.arctan2(r[:, 1, 0], r[:, 0, 0])
+    angles[:, 1] = np.arcsin(np.clip(-r[:, 2, 0], -1, 1))
+    angles[:, 2] = np.arctan2(r[:, 2, 1], r[:, 2, 2])
+    return angles
+
+
+def FromEulerAngles(angles):
+    """Return the QuaternionArray of the (N, 3) yaw, pitch, roll angles."""
+    cy, cp, cr = np.cos(angles/2).T
+    sy, sp, sr = np.sin(angles/2).T
+    return QuaternionArray(np.stack((cr*cp*cy + sr*sp*sy,
+                                     sr*cp*cy - cr*sp*sy,
+                                     cr*sp*cy + sr*cp*sy,
+                                     cr*cp*sy - sr*sp*cy), axis=1))
+
+
+class ViewportMaskCache(object):
+    """LRU cache of the viewport masks of quantized orientations.
+
+    The orientations are quantized on yaw/pitch/roll bins of precision
+    degrees and all the orientations of a bin share the mask of the center
+    of the bin. The masks are stored bit-packed.
+    """
+
+    def __init__(self, width, height, horizontalFoVAngle, verticalFoVAngle,
+                 precision=DEFAULT_MASK_PRECISION,
+                 maxBytes=DEFAULT_MASK_CACHE_BYTES):
+        """Init an empty cache.
+
+        :param precision: size of the yaw/pitch/roll bins in degree
+        :param maxBytes: memory budget of the stored masks
+        """
+        self.width = width
+        self.height = height
+        self.binSize = math.radians(precision)
+        self.maxBytes = maxBytes
+        self.directions = GetPixelDirections(width, height)
+        self.normals = GetViewportNormals(horizontalFoVAngle,
+                                          verticalFoVAngle)
+        self.masks = OrderedDict()  # key: bins, value: (packedMask, hits)
+        self.usedBytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def HitRate(self):
+        """Return the ratio of the samples that did not compute a mask."""
+        total = self.hits + self.misses
+        return self.hits/total if total > 0 else 0
+
+    def GetBins(self, quaternions):
+        """Return the (N, 3) integer yaw/pitch/roll bins of the orientations.
+        """
+        return np.rint(ToEulerAngles(quaternions)/self.binSize)\
+            .astype(np.int64)
+
+    def GetMasks(self, bins, counts=None):
+        """Return the (packedMasks, hitsCount) of the unique bins.
+
+        packedMasks is the (U, ceil(width*height/8)) bit-packed masks and
+        hitsCount the (U,) number of pixels inside each viewport.
+
+        :param counts: number of samples of each bin (used by the hit rate)
+        """
+        if counts is None:
+            counts = np.ones(len(bins), dtype=np.int64)
+        keys = [tuple(b) for b in bins.tolist()]
+        packedMasks = np.empty((len(keys), (self.width*self.height + 7)//8),
+                               dtype=np.uint8)
+        hitsCount = np.empty(len(keys), dtype=np.int64)
+        missing = list()
+        for k, key in enumerate(keys):
+            entry = self.masks.get(key)
+            if entry is None:
+                missing.append(k)
+            else:
+                packedMasks[k], hitsCount[k] = entry
+                self.masks.move_to_end(key)
+        self.misses += len(missing)
+        self.hits += int(counts.sum()) - len(missing)
+        if len(missing) > 0:
+            centers = FromEulerAngles(bins[missing] * self.binSize)
+            for start, masks in ViewportMasks(centers, self.directions,
+                                              self.normals):
+                index = missing[start:start+len(masks)]
+                packedMasks[index] = np.packbits(masks, axis=1)
+                hitsCount[index] = masks.sum(axis=1)
+            for k in missing:
+                self.__Insert(keys[k], packedMasks[k].copy(),
+                              int(hitsCount[k]))
+        return packedMasks, hitsCount
+
+    def ComputeVision(self, quaternions):
+        """Compute the vision matrix of the orientations.
+
+        Same output as NpQuaternion.ComputeVision: a (width, height) array,
+        ans[i][j] is the probability of vision of the pixel (i, j).
+        """
+        nbPixels = self.width*self.height
+        ans = np.zeros(nbPixels)
+        length = len(quaternions)
+        if length == 0:
+            return ans.reshape(self.width, self.height)
+        uniqueBins, counts = np.unique(self.GetBins(quaternions), axis=0,
+                                       return_counts=True)
+        chunkSize = max(1, MAX_CHUNK_VALUES // nbPixels)
+        for start in range(0, len(uniqueBins), chunkSize):
+            chunkCounts = counts[start:start+chunkSize]
+            packedMasks, hitsCount = \
+                self.GetMasks(uniqueBins[start:start+chunkSize], chunkCounts)
+            weights = np.zeros(len(hitsCount))
+            isVisible = hitsCount > 0
+            weights[isVisible] = chunkCounts[isVisible] / \
+                (length*hitsCount[isVisible])
+            masks = np.unpackbits(packedMasks, axis=1, count=nbPixels)
+            ans += np.dot(weights, masks)
+        return ans.reshape(self.width, self.height)
+
+    def __Insert(self, key, packedMask, hitsCount):
+        """Store a mask and remove the least recently used ones."""
+        self.masks[key] = (packedMask, hitsCount)
+        self.usedBytes += packedMask.nbytes + MASK_ENTRY_OVERHEAD_BYTES
+        # keep at least the new mask
+        while self.usedBytes > self.maxBytes and len(self.masks) > 1:
+            _, (oldMask, _) = self.masks.popitem(last=False)
+            self.usedBytes -= oldMask.nbytes + MASK_ENTRY_OVERHEAD_BYTES
+
+
+class VisionCube(object):
+    """Cumulative vision of a trajectory over time buckets.
+
+    The buckets are the intervals [boundaries[b], boundaries[b+1]). The
+    vision of any range of buckets is the difference of two cumulative
+    sums. The cube is stored compressed:
+     - the cumulative sums are kept every VISION_CUBE_CHECKPOINT_BUCKETS
+       buckets only,
+     - the samples are stored as rows (mask, weight) sorted by bucket, the
+       masks are bit-packed and shared by the samples with the same
+       orientation bin.
+    The cumulative sum at any bucket is the previous checkpoint plus the
+    rows of the buckets in between.
+    """
+
+    def __init__(self, timestamps, quaternions, boundaries, width, height,
+                 horizontalFoVAngle, verticalFoVAngle,
+                 maskPrecision=None):
+        """Build the cube.
+
+        :param timestamps: sorted (N,) array of timestamps
+        :param quaternions: QuaternionArray of the N orientations
+        :param boundaries: sorted (B+1,) array of the bucket boundaries
+        :param maskPrecision: None to compute the exact mask of each sample
+        or precision of the approximate masks (see ViewportMaskCache)
+        """
+        self.width = width
+        self.height = height
+        nbPixels = width*height
+        nbBuckets = len(boundaries) - 1
+        buckets = np.searchsorted(boundaries, timestamps, side='right') - 1
+        inside = np.flatnonzero((buckets >= 0) & (buckets < nbBuckets))
+        buckets = buckets[inside]
+        quaternions = quaternions[inside]
+        if len(inside) > 0:
+            if maskPrecision is None:
+                rowBuckets, self.rowMasks, self.rowWeights, \
+                    self.packedMasks = self.__ExactMasks(
+                        buckets, quaternions, horizontalFoVAngle,
+                        verticalFoVAngle)
+            else:
+                rowBuckets, self.rowMasks, self.rowWeights, \
+                    self.packedMasks = self.__CachedMasks(
+                        buckets, quaternions, horizontalFoVAngle,
+                        verticalFoVAngle, maskPrecision)
+        else:
+            rowBuckets = np.zeros(0, dtype=np.int64)
+            self.rowMasks = np.zeros(0, dtype=np.int64)
+            self.rowWeights = np.zeros(0)
+            self.packedMasks = np.zeros((0, (nbPixels + 7)//8),
+                                        dtype=np.uint8)
+        # rowOffsets[b]: index of the first row of the bucket b
+        self.rowOffsets = np.searchsorted(rowBuckets,
+                                          np.arange(nbBuckets + 1))
+        # checkpoints[c]: vision of the buckets [0, c*checkpointBuckets)
+        self.checkpointBuckets = VISION_CUBE_CHECKPOINT_BUCKETS
+        nbCheckpoints = nbBuckets // self.checkpointBuckets + 1
+        self.checkpoints = np.zeros((nbCheckpoints, nbPixels))
+        nbRows = self.rowOffsets[(nbCheckpoints - 1)*self.checkpointBuckets]
+        chunkSize = max(1, MAX_CHUNK_VALUES // nbPixels)
+        for start in range(0, nbRows, chunkSize):
+            rows = slice(start, min(nbRows, start + chunkSize))
+            # the rows are sorted: reduce each block of rows
+            chunkCheckpoints, first = np.unique(
+                rowBuckets[rows] // self.checkpointBuckets + 1,
+                return_index=True)
+            self.checkpoints[chunkCheckpoints] += np.add.reduceat(
+                self.__UnpackRows(rows) *
+                self.rowWeights[rows, np.newaxis], first, axis=0)
+        for c in range(1, nbCheckpoints):
+            self.checkpoints[c] += self.checkpoints[c-1]
+        self.cumulativeCounts = np.zeros(nbBuckets + 1, dtype=np.int64)
+        np.cumsum(np.bincount(buckets, minlength=nbBuckets),
+                  out=self.cumulativeCounts[1:])
+
+    def __UnpackRows(self, rows):
+        """Return the (R, width*height) uint8 masks of a slice of rows."""
+        return np.unpackbits(self.packedMasks[self.rowMasks[rows]], axis=1,
+                             count=self.width*self.height)
+
+    def __ExactMasks(self, buckets, quaternions, horizontalFoVAngle,
+                     verticalFoVAngle):
+        """Return (buckets, masks, weights, packedMasks) of the rows.
+
+        There is one row and one mask by sample.
+        """
+        packedMasks = list()
+        weights = list()
+        for _, masks in ViewportMasks(
+                quaternions, GetPixelDirections(self.width, self.height),
+                GetViewportNormals(horizontalFoVAngle, verticalFoVAngle)):
+            hitsCount = masks.sum(axis=1)
+            chunkWeights = np.zeros(len(hitsCount))
+            chunkWeights[hitsCount > 0] = 1.0/hitsCount[hitsCount > 0]
+            weights.append(chunkWeights)
+            packedMasks.append(np.packbits(masks, axis=1))
+        return buckets, np.arange(len(buckets)), np.concatenate(weights), \
+            np.concatenate(packedMasks)
+
+    def __CachedMasks(self, buckets, quaternions, horizontalFoVAngle,
+                      verticalFoVAngle, maskPrecision):
+        """Return (buckets, masks, weights, packedMasks) of the rows.
+
+        There is one mask by orientation bin and one row by (bucket, bin)
+        pair: the samples of a bucket that share the same orientation bin
+        are counted once with a weight multiplied by their number.
+        """
+        maskCache = GetViewportMaskCache(self.width, self.height,
+                                         horizontalFoVAngle, verticalFoVAngle,
+                                         maskPrecision)
+        uniqueBins, inverse, counts = np.unique(
+            maskCache.GetBins(quaternions), axis=0, return_inverse=True,
+            return_counts=True)
+        packedMasks, hitsCount = maskCache.GetMasks(uniqueBins, counts)
+        nbBins = len(uniqueBins)
+        pairs, pairCounts = np.unique(buckets*nbBins + inverse.ravel(),
+                                      return_counts=True)
+        pairBins = pairs % nbBins
+        weights = np.zeros(len(pairs))
+        isVisible = hitsCount[pairBins] > 0
+        weights[isVisible] = pairCounts[isVisible] / \
+            hitsCount[pairBins[isVisible]]
+        return pairs // nbBins, pairBins, weights, packedMasks
+
+    def __GetCumulativeVision(self, bucket):
+        """Return the (width*height,) vision of the buckets [0, bucket)."""
+        c = bucket // self.checkpointBuckets
+        rows = slice(self.rowOffsets[c*self.checkpointBuckets],
+                     self.rowOffsets[bucket])
+        return self.checkpoints[c] + np.dot(self.rowWeights[rows],
+                                            self.__UnpackRows(rows))
+
+    def ComputeVision(self, firstBuckets, lastBuckets):
+        """Return the vision of the samples of the buckets [first, last).
+
+        Same output as ViewportMaskCache.ComputeVision for each range.
+
+        :param firstBuckets: (K,) array of the first bucket of each range
+        :param lastBuckets: (K,) array of the bucket after each range
+        :return: (K, width, height) array
+        """
+        lengths = self.cumulativeCounts[lastBuckets] - \
+            self.cumulativeCounts[firstBuckets]
+        ans = np.zeros((len(lengths), self.width*self.height))
+        for k in np.flatnonzero(lengths > 0):
+            ans[k] = (self.__GetCumulativeVision(lastBuckets[k]) -
+                      self.__GetCumulativeVision(firstBuckets[k])) / \
+                lengths[k]
+        # remove the rounding errors of the differences of the sums
+        np.maximum(ans, 0, out=ans)
+        return ans.reshape(-1, self.width, self.height)
@@ -8,8 +8,11 @@ IMT Atlantique
 import argparse
 import os
 import logging
+import sys
 
 from Helpers import GetIniConfParser, GetGlobalUserManager, GetGlobalStatistics
+from Helpers.DatasetPack import DatasetPack, GetPackPaths
+from Helpers.Statistics import VerifyCache
 
 if __name__ == '__main__':
     # create logger with 'spam_application'
@@ -44,9 +47,37 @@ if __name__ == '__main__':
     parser.add_argument('--withVideo', action='store_true',
                         help='if set compute heatmap videos',
                         )
+    parser.add_argument('--withOverlay', action='store_true',
+                        help='if set compute the heatmaps overlaid on the '
+                        'source videos',
+                        )
+    parser.add_argument('--datasetPack',
+                        type=str,
+                        help='path (without extension) to the dataset pack '
+                        'used to read the results (built if it does not '
+                        'exist)',
+                        default=None
+                        )
+    parser.add_argument('--rebuildDatasetPack', action='store_true',
+                        help='if set rebuild the dataset pack',
+                        )
+    parser.add_argument('--resultCacheSize',
+                        type=int,
+                        help='memory budget in MB of the processed results '
+                        'kept in memory by each process [256]',
+                        default=256
+                        )
+    parser.add_argument('--verifyCache', action='store_true',
+                        help='if set only check the cached statistics and '
+                        'remove the damaged ones (exit status 1 if any)',
+                        )
 
     args = parser.parse_args()
 
+    if args.verifyCache:
+        logger.info('Verify the cached statistics')
+        sys.exit(1 if len(VerifyCache()) > 0 else 0)
+
     # parse the ini file
     iniConfParser = GetIniConfParser(args.configFile, ch=ch, fh=fh)
 
@@ -58,8 +89,19 @@ if __name__ == '__main__':
                                       iniConfParser.resultFolder
                                       )
 
+    if args.datasetPack is not None and \
+            (args.rebuildDatasetPack or
+             not all(os.path.exists(p)
+                     for p in GetPackPaths(args.datasetPack))):
+        logger.info('Build the dataset pack {}'.format(args.datasetPack))
+        DatasetPack.Build(iniConfParser.resultFolder, args.datasetPack)
+
     # Init the global statistics object
-    stats = GetGlobalStatistics(userManager)
+    stats = GetGlobalStatistics(userManager,
+                                datasetPackPath=args.datasetPack,
+                                videoManager=iniConfParser.videoManager,
+                                resultCacheBytes=args.resultCacheSize *
+                                1024 * 1024)
 
     print(args.withVideo)
-    stats.RunComputation(args.withVideo)
+    stats.RunComputation(args.withVideo, args.withOverlay)
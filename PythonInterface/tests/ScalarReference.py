@@ -0,0 +1,144 @@
+"""Scalar reference implementations used by the tests.
+
+The functions are line by line ports of the functions of the C++
+Helpers.CQuaternion module (CQuaternion.cpp) built on the scalar
+Helpers.Quaternion classes: they are slow but follow the original
+algorithms.
+
+Author: Xavier Corbillon
+IMT Atlantique
+"""
+
+from Helpers.Quaternion import Vector, Quaternion
+import math
+import numpy as np
+
+
+def RandomQuaternion(rng):
+    """Return a random unit Quaternion."""
+    w, x, y, z = rng.normal(size=4)
+    return Quaternion(w=w, v=Vector(x, y, z)).Normalize()
+
+
+def RandomFilteredQuaternions(rng, n, step=0.2, maxGap=3, maxAngle=0.6):
+    """Return a random trajectory: a dict timestamp: Quaternion.
+
+    The timestamps are sorted, on a grid of period step with random gaps of
+    up to maxGap steps (the trajectories built with the same step share
+    some timestamps). The head turns by random rotations.
+
+    :param n: number of samples
+    :param maxAngle: max angle (in radian) of the rotation between two
+    samples
+    """
+    ans = dict()
+    q = RandomQuaternion(rng)
+    gridIndex = int(rng.integers(0, maxGap))
+    for _ in range(n):
+        ans[round(gridIndex*step, 10)] = q
+        gridIndex += int(rng.integers(1, maxGap + 1))
+        u = Vector(*rng.normal(size=3))
+        rotation = Quaternion.QuaternionFromAngleAxis(
+            rng.uniform(0, maxAngle), u)
+        q = (rotation * q).Normalize()
+    return ans
+
+
+def _GetViewportNormals(horizontalFoVAngle, verticalFoVAngle):
+    """Return the 4 inward normals of the viewport delimitation plans."""
+    y = math.sqrt(1-math.cos(horizontalFoVAngle))
+    z = math.sqrt(1-math.cos(verticalFoVAngle))
+    a = Vector(1, y, z)
+    b = Vector(1, y, -z)
+    c = Vector(1, -y, -z)
+    d = Vector(1, -y, z)
+    normals = list()
+    for first, second in ((a, b), (b, c), (c, d), (d, a)):
+        n = first ^ second
+        normals.append(n/n.Norm())
+    return normals
+
+
+def _VisionHits(q, width, height, normals):
+    """Return the list of the pixels (i, j) inside the viewport of q."""
+    hits = list()
+    for i in range(width):
+        for j in range(height):
+            theta = math.pi-((2.0*math.pi*i)/width)
+            phi = (math.pi*j)/height
+            p = Vector.FromSpherical(theta, phi)
+            pHeadFrame = q.Conj().Rotation(p)
+            if all(pHeadFrame * n > 0 for n in normals):
+                hits.append((i, j))
+    return hits
+
+
+def ComputeVision(filteredQuaternions, width, height,
+                  horizontalFoVAngle, verticalFoVAngle):
+    """Port of CQuaternion.ComputeVision, return a list of lists."""
+    ans = [[0]*height for _ in range(width)]
+    normals = _GetViewportNormals(horizontalFoVAngle, verticalFoVAngle)
+    length = len(filteredQuaternions)
+    for q in filteredQuaternions.values():
+        hits = _VisionHits(q, width, height, normals)
+        for i, j in hits:
+            ans[i][j] += 1.0/(length*len(hits))
+    return ans
+
+
+def ComputeMaxOrthodromicDistances(filteredQuaternions, segSizeList):
+    """Port of CQuaternion.ComputeMaxOrthodromicDistances.
+
+    The timestamps of filteredQuaternions have to be sorted.
+    """
+    ans = dict((float(segSize), dict()) for segSize in segSizeList)
+    maxSegSize = max(float(segSize) for segSize in segSizeList)
+    quaternionMap = dict()
+    for t, q in filteredQuaternions.items():
+        quaternionMap[t] = Quaternion(w=q.w, v=q.v).Normalize()
+    maxTimestamp = max(quaternionMap.keys(), default=0)
+    keysToCheck = list()
+    for t2 in quaternionMap:
+        q2 = quaternionMap[t2]
+        while len(keysToCheck) > 0 and t2 - keysToCheck[0] > maxSegSize:
+            keysToCheck.pop(0)
+        for t1 in keysToCheck:
+            for segSize in ans:
+                if maxTimestamp - t2 >= segSize:
+                    ans[segSize][t2] = 0
+                    if t2 - t1 < segSize:
+                        orthoDist = Quaternion.OrthodromicDistance(
+                            quaternionMap[t1], q2)
+                        ans[segSize][t1] = max(ans[segSize].get(t1, 0),
+                                               orthoDist)
+        keysToCheck.append(t2)
+    return dict((segSize, [distances[t] for t in sorted(distances)])
+                for segSize, distances in ans.items())
+
+
+def ComputeVisionDistanceCdfs(listOfFilteredQuaternions, width, height,
+                              horizontalFoVAngle, verticalFoVAngle):
+    """Port of CQuaternion.ComputeVisionDistanceCdfs."""
+    countMap = dict()
+    for filteredQuaternions in listOfFilteredQuaternions:
+        for timestamp in filteredQuaternions:
+            countMap[timestamp] = countMap.get(timestamp, 0) + 1
+    normals = _GetViewportNormals(horizontalFoVAngle, verticalFoVAngle)
+    pixelWeights = np.array([[2*math.pi*math.pi*math.sin((math.pi*j)/height) /
+                              (width*height) for j in range(height)]
+                             for _ in range(width)])
+    ans = dict()
+    for timestamp in sorted(t for t in countMap if countMap[t] >= 2):
+        visionMats = list()
+        for filteredQuaternions in listOfFilteredQuaternions:
+            if timestamp in filteredQuaternions:
+                visionMat = np.zeros((width, height), dtype=int)
+                for i, j in _VisionHits(filteredQuaternions[timestamp],
+                                        width, height, normals):
+                    visionMat[i, j] = 1
+                visionMats.append(visionMat)
+        ans[timestamp] = [float((np.abs(visionMats[i] - visionMats[j]) *
+                                 pixelWeights).sum())
+                          for i in range(len(visionMats))
+                          for j in range(len(visionMats)) if i != j]
+    return ans
@@ -0,0 +1,12 @@
+"""Configuration of the tests: the Helpers package is imported from the
+PythonInterface folder.
+
+Author: Xavier Corbillon
+IMT Atlantique
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
@@ -0,0 +1,101 @@
+"""Content-hash keys of the cached results and aggregates.
+
+Author: Xavier Corbillon
+IMT Atlantique
+"""
+
+import Helpers.Statistics as Statistics
+from Helpers.Statistics import AggregateContainer, ResultContainer, \
+    GetCacheKey, Load
+import dill
+import os
+import pytest
+import types
+
+LOG_LINES = ['0.011942 0 1.0 0.0 0.0 0.0',
+             '0.021361 0 0.9 0.1 0.0 0.0',
+             '0.034057 1 0.8 0.2 0.1 0.0']
+
+
+def WriteLog(resultPath, lines, startOffsetInSecond=40):
+    """Write the log of the result and the config of its test."""
+    with open(resultPath, 'w') as o:
+        o.write('\n'.join(lines) + '\n')
+    with open('{}.ini'.format(os.path.dirname(resultPath)), 'w') as o:
+        o.write('[Config]\ntextureConfig=Video\n[Video]\n'
+                'startOffsetInSecond={}\n'.format(startOffsetInSecond))
+
+
+@pytest.fixture
+def resultPath(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(os.path.join(Statistics.PATH_TO_STATISTIC_RESULTS,
+                             'individual'))
+    os.makedirs('results/uid-1/test0/video')
+    resultPath = 'results/uid-1/test0/video/video_0.txt'
+    WriteLog(resultPath, LOG_LINES)
+    return resultPath
+
+
+def MakeContainer(resultPath):
+    return ResultContainer(resultPath, '1_test0_video',
+                           types.SimpleNamespace(uid=1), 'test0', 'video')
+
+
+def test_GetCacheKey():
+    assert GetCacheKey(1, 'a', [0.5, 2]) == GetCacheKey(1, 'a', [0.5, 2])
+    assert GetCacheKey(1, 'a', [0.5, 2]) != GetCacheKey(1, 'a', [2, 0.5])
+    assert GetCacheKey(['a', 'b']) != GetCacheKey(['a'], ['b'])
+    assert GetCacheKey({'step': 0.03}) != GetCacheKey({'step': 0.04})
+
+
+def test_ResultKeySamples(resultPath):
+    key = MakeContainer(resultPath).GetCacheKey(0.03)
+    assert MakeContainer(resultPath).GetCacheKey(0.03) == key
+    WriteLog(resultPath, LOG_LINES[:2] + ['0.034057 1 0.8 0.2 0.1 0.05'])
+    assert MakeContainer(resultPath).GetCacheKey(0.03) != key
+    WriteLog(resultPath, LOG_LINES)
+    assert MakeContainer(resultPath).GetCacheKey(0.03) == key
+    WriteLog(resultPath, LOG_LINES, startOffsetInSecond=41)
+    assert MakeContainer(resultPath).GetCacheKey(0.03) != key
+
+
+def test_ResultKeyParameters(resultPath, monkeypatch):
+    rc = MakeContainer(resultPath)
+    key = rc.GetCacheKey(0.03)
+    assert rc.GetCacheKey(0.04) != key
+    monkeypatch.setitem(Statistics.RESULT_PARAMETERS, 'visionWidth', 17)
+    assert rc.GetCacheKey(0.03) != key
+    monkeypatch.undo()
+    assert rc.GetCacheKey(0.03) == key
+    monkeypatch.setattr(Statistics, 'PROCESSED_RESULT_VERSION', -1)
+    assert rc.GetCacheKey(0.03) != key
+
+
+def test_FingerprintSentNotStored(resultPath):
+    rc = MakeContainer(resultPath)
+    fingerprint = rc.GetSourceFingerprint()
+    # sent to the workers with the container
+    assert dill.loads(dill.dumps(rc))._sourceFingerprint == fingerprint
+    # not stored in the dump of the container
+    rc.StoreContainer()
+    storedRc = Load(rc.resultContainerDumpPath)
+    assert storedRc._sourceFingerprint is None
+    assert storedRc.user is None
+    assert storedRc.GetSourceFingerprint() == fingerprint
+    assert rc._sourceFingerprint == fingerprint
+    assert rc.user.uid == 1
+
+
+def test_AggregateContainerLoad(tmp_path):
+    dumpPath = str(tmp_path / 'aggregate.dump')
+    key = GetCacheKey(['k1', 'k2'], (1, 2))
+    ac = AggregateContainer.Load(dumpPath, key)
+    assert ac.isNew
+    Statistics.Store(ac, dumpPath)
+    assert not AggregateContainer.Load(dumpPath, key).isNew
+    # an other member with the same count of members
+    assert AggregateContainer.Load(
+        dumpPath, GetCacheKey(['k1', 'k3'], (1, 2))).isNew
+    assert AggregateContainer.Load(
+        dumpPath, GetCacheKey(['k1', 'k2'], (1, 3))).isNew
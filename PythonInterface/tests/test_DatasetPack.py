@@ -0,0 +1,65 @@
+"""Results read from a DatasetPack.
+
+Author: Xavier Corbillon
+IMT Atlantique
+"""
+
+import Helpers.DatasetPack as DatasetPack
+import Helpers.LogCache as LogCache
+from Helpers.Statistics import ResultContainer
+import numpy as np
+import os
+import pytest
+import types
+
+LOG_LINES = ['0.011942 0 1.0 0.0 0.0 0.0',
+             '0.021361 0 0.9 0.1 0.0 0.0',
+             '0.034057 1 0.8 0.2 0.1 0.0']
+
+
+def WriteResult(testPath, videoId, lines):
+    """Write the log and the config of a result, return the log path."""
+    os.makedirs(os.path.join(testPath, videoId))
+    logPath = os.path.join(testPath, videoId, '{}_0.txt'.format(videoId))
+    with open(logPath, 'w') as o:
+        o.write('\n'.join(lines) + '\n')
+    with open(os.path.join(testPath, '{}.ini'.format(videoId)), 'w') as o:
+        o.write('[Config]\ntextureConfig=Video\n[Video]\n'
+                'startOffsetInSecond=40\n')
+    return logPath
+
+
+@pytest.fixture
+def resultFolder(tmp_path):
+    resultFolder = str(tmp_path / 'results')
+    WriteResult(os.path.join(resultFolder, 'uid-1', 'test0'), 'video',
+                LOG_LINES)
+    # the logs can be in sub-folders of the test folder
+    WriteResult(os.path.join(resultFolder, 'uid-1', 'test1', 'session'),
+                'video', LOG_LINES[:2])
+    return resultFolder
+
+
+def test_Build(resultFolder, tmp_path):
+    packPath = str(tmp_path / 'pack')
+    datasetPack = DatasetPack.DatasetPack.Build(resultFolder, packPath)
+    assert sorted(datasetPack.Keys()) == [('1', 'test0', 'video'),
+                                          ('1', 'test1', 'video')]
+    assert len(datasetPack.GetSamples('1', 'test1', 'video')) == 2
+    assert datasetPack.GetStartOffsetInSecond('1', 'test0', 'video') == 40
+
+
+@pytest.mark.parametrize('testId', ['test0', 'test1'])
+def test_ResultContainerPackKey(resultFolder, tmp_path, testId):
+    packPath = str(tmp_path / 'pack')
+    DatasetPack.DatasetPack.Build(resultFolder, packPath)
+    logPath = [path for _, tId, _, path in
+               DatasetPack.ListResultLogs(resultFolder) if tId == testId][0]
+    rc = ResultContainer(logPath, '1_{}_video'.format(testId),
+                         types.SimpleNamespace(uid=1), testId, 'video',
+                         packPath)
+    assert rc.GetPackKey() == ('1', testId, 'video')
+    datasetPack = rc.GetDatasetPack()
+    assert datasetPack is not None
+    np.testing.assert_array_equal(datasetPack.GetSamples(*rc.GetPackKey()),
+                                  LogCache.LoadLog(logPath, useCache=False))
@@ -0,0 +1,62 @@
+"""End of the stream and errors of the VideoRead decoder.
+
+ffmpeg is replaced by shell scripts that write raw frames of 2x2 pixels.
+
+Author: Xavier Corbillon
+IMT Atlantique
+"""
+
+import Helpers.FFmpeg as FFmpeg
+import os
+import pytest
+
+FRAME_SIZE = 2*2*3
+
+
+def FakeFFmpeg(tmp_path, monkeypatch, script):
+    """Use the shell script as ffmpeg for the decoders of 2x2 videos."""
+    path = tmp_path / 'ffmpeg'
+    path.write_text('#!/bin/sh\n' + script)
+    os.chmod(str(path), 0o755)
+    monkeypatch.setattr(FFmpeg, 'FFMPEG_BIN', str(path))
+    monkeypatch.setattr(FFmpeg, 'ProbeVideo', lambda inputPath: (2, 2, 30))
+
+
+def test_ReadAll(tmp_path, monkeypatch):
+    FakeFFmpeg(tmp_path, monkeypatch,
+               'head -c {} /dev/zero\n'.format(5*FRAME_SIZE))
+    with FFmpeg.VideoRead('in.mkv') as vi:
+        frames = list(vi)
+    assert len(frames) == 5
+    assert frames[0].shape == (2, 2, 3)
+
+
+def test_LateExitError(tmp_path, monkeypatch):
+    # ffmpeg fails after closing its output
+    FakeFFmpeg(tmp_path, monkeypatch,
+               'head -c {} /dev/zero\nexec >&-\nsleep 0.3\n'
+               'echo late error >&2\nexit 3\n'.format(3*FRAME_SIZE))
+    vi = FFmpeg.VideoRead('in.mkv')
+    with pytest.raises(RuntimeError, match='code 3'):
+        for _ in vi:
+            pass
+    assert vi.framesCount == 3
+    assert 'late error' in '\n'.join(vi.stderrTail)
+
+
+def test_TruncatedFrame(tmp_path, monkeypatch):
+    FakeFFmpeg(tmp_path, monkeypatch,
+               'head -c {} /dev/zero\n'.format(2*FRAME_SIZE + 5))
+    with pytest.raises(RuntimeError, match='truncated frame'):
+        with FFmpeg.VideoRead('in.mkv') as vi:
+            list(vi)
+
+
+def test_StopEarly(tmp_path, monkeypatch):
+    # the decoder is killed, not waited for
+    FakeFFmpeg(tmp_path, monkeypatch,
+               'while true; do head -c {} /dev/zero; done\n'.format(
+                   FRAME_SIZE))
+    with FFmpeg.VideoRead('in.mkv', queueSize=2) as vi:
+        assert vi.ReadFrame() is not None
+    assert vi.pipe.returncode is not None
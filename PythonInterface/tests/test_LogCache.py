@@ -0,0 +1,59 @@
+"""Cache files of the parsed head movement logs.
+
+Author: Xavier Corbillon
+IMT Atlantique
+"""
+
+import Helpers.LogCache as LogCache
+import numpy as np
+import os
+import pytest
+
+LOG_LINES = ['0.011942 0 1.0 0.0 0.0 0.0',
+             '0.021361 0 0.9 0.1 0.0 0.0',
+             '0.034057 1 0.8 0.2 0.1 0.0']
+
+
+@pytest.fixture
+def logPath(tmp_path):
+    logPath = str(tmp_path / 'video_0.txt')
+    with open(logPath, 'w') as o:
+        o.write('\n'.join(LOG_LINES) + '\n')
+    return logPath
+
+
+def test_LoadLog(logPath):
+    samples = LogCache.LoadLog(logPath)
+    assert os.path.exists(LogCache.GetCachePath(logPath))
+    cachedSamples = LogCache.LoadLog(logPath)
+    assert isinstance(cachedSamples, np.memmap)
+    np.testing.assert_array_equal(cachedSamples, samples)
+    np.testing.assert_array_equal(samples['frameId'], [0, 0, 1])
+    np.testing.assert_array_equal(samples['x'], [0.0, 0.1, 0.2])
+
+
+def test_LoadEmptyLog(tmp_path):
+    logPath = str(tmp_path / 'video_0.txt')
+    open(logPath, 'w').close()
+    assert len(LogCache.LoadLog(logPath)) == 0
+    assert len(LogCache.LoadLog(logPath)) == 0
+
+
+@pytest.mark.parametrize('damage', ['truncated', 'garbage', 'wrongDtype'])
+def test_DamagedCacheFile(logPath, damage, caplog):
+    expected = LogCache.LoadLog(logPath, useCache=False)
+    LogCache.LoadLog(logPath)
+    cachePath = LogCache.GetCachePath(logPath)
+    if damage == 'truncated':
+        with open(cachePath, 'r+b') as f:
+            f.truncate(os.path.getsize(cachePath) - 10)
+    elif damage == 'garbage':
+        with open(cachePath, 'wb') as f:
+            f.write(b'not a npy file')
+    else:
+        np.save(cachePath, np.arange(3))
+    np.testing.assert_array_equal(LogCache.LoadLog(logPath), expected)
+    assert 'damaged cache file' in caplog.text
+    # the cache file is written again
+    np.testing.assert_array_equal(LogCache.LoadCacheFile(cachePath),
+                                  expected)
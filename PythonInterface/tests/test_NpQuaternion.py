@@ -0,0 +1,177 @@
+"""Numerical equivalence of the numpy implementations with the scalar
+reference (Helpers.Quaternion and ports of the C++ CQuaternion functions).
+
+Author: Xavier Corbillon
+IMT Atlantique
+"""
+
+from Helpers.Quaternion import Vector, Quaternion, VectorArray, \
+    QuaternionArray
+import Helpers.NpQuaternion as NpQuaternion
+import ScalarReference
+import math
+import numpy as np
+import pytest
+
+WIDTH = 24
+HEIGHT = 12
+HORIZONTAL_FOV = math.radians(110)
+VERTICAL_FOV = math.radians(90)
+SEG_SIZES = [0.5, 1, 2.5]
+
+
+def GetWxyz(q):
+    """Return the (w, x, y, z) tuple of a Quaternion."""
+    return (q.w, q.v.x, q.v.y, q.v.z)
+
+
+def GetXyz(v):
+    """Return the (x, y, z) tuple of a Vector."""
+    return (v.x, v.y, v.z)
+
+
+def RandomQuaternions(rng, n, normalized=False):
+    """Return a list of n random Quaternion (not normalized by default)."""
+    quaternions = [Quaternion(w=w, v=Vector(x, y, z)) for w, x, y, z in
+                   rng.normal(size=(n, 4))*rng.uniform(0.5, 2, (n, 1))]
+    if normalized:
+        quaternions = [q.Normalize() for q in quaternions]
+    return quaternions
+
+
+@pytest.fixture
+def rng():
+    return np.random.default_rng(1234)
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_ComputeVision(seed):
+    rng = np.random.default_rng(seed)
+    filteredQuaternions = ScalarReference.RandomFilteredQuaternions(rng, 15)
+    expected = ScalarReference.ComputeVision(
+        filteredQuaternions, WIDTH, HEIGHT, HORIZONTAL_FOV, VERTICAL_FOV)
+    ans = NpQuaternion.ComputeVision(
+        filteredQuaternions, WIDTH, HEIGHT, HORIZONTAL_FOV, VERTICAL_FOV)
+    assert ans.shape == (WIDTH, HEIGHT)
+    np.testing.assert_allclose(ans, expected, rtol=0, atol=1e-12)
+
+
+def test_ComputeVisionEmpty():
+    ans = NpQuaternion.ComputeVision(dict(), WIDTH, HEIGHT, HORIZONTAL_FOV,
+                                     VERTICAL_FOV)
+    assert ans.shape == (WIDTH, HEIGHT)
+    assert not ans.any()
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_ComputeMaxOrthodromicDistances(seed):
+    rng = np.random.default_rng(seed)
+    filteredQuaternions = ScalarReference.RandomFilteredQuaternions(
+        rng, 60, maxGap=8)
+    expected = ScalarReference.ComputeMaxOrthodromicDistances(
+        filteredQuaternions, SEG_SIZES)
+    ans = NpQuaternion.ComputeMaxOrthodromicDistances(filteredQuaternions,
+                                                      SEG_SIZES)
+    assert sorted(ans.keys()) == sorted(expected.keys())
+    for segSize in expected:
+        np.testing.assert_allclose(ans[segSize], expected[segSize],
+                                   rtol=0, atol=1e-12)
+
+
+@pytest.mark.parametrize('seed', range(2))
+def test_ComputeVisionDistanceCdfs(seed):
+    rng = np.random.default_rng(seed)
+    listOfFilteredQuaternions = [
+        ScalarReference.RandomFilteredQuaternions(rng, 6) for _ in range(3)]
+    expected = ScalarReference.ComputeVisionDistanceCdfs(
+        listOfFilteredQuaternions, WIDTH, HEIGHT, HORIZONTAL_FOV,
+        VERTICAL_FOV)
+    ans = NpQuaternion.ComputeVisionDistanceCdfs(
+        listOfFilteredQuaternions, WIDTH, HEIGHT, HORIZONTAL_FOV,
+        VERTICAL_FOV)
+    assert len(expected) > 0
+    assert sorted(ans.keys()) == sorted(expected.keys())
+    for timestamp in expected:
+        np.testing.assert_allclose(ans[timestamp], expected[timestamp],
+                                   rtol=0, atol=1e-12)
+
+
+def test_QuaternionArrayProducts(rng):
+    q1 = RandomQuaternions(rng, 20)
+    q2 = RandomQuaternions(rng, 20)
+    a1 = QuaternionArray.FromQuaternions(q1)
+    a2 = QuaternionArray.FromQuaternions(q2)
+    k = rng.uniform(-2, 2)
+    for ans, expected in (
+            (a1 * a2, [p * q for p, q in zip(q1, q2)]),
+            (a1 + a2, [p + q for p, q in zip(q1, q2)]),
+            (a1 - a2, [p - q for p, q in zip(q1, q2)]),
+            (-a1, [-p for p in q1]),
+            (a1 * k, [p * k for p in q1]),
+            (a1 / k, [p / k for p in q1]),
+            (a1.Conj(), [p.Conj() for p in q1]),
+            (a1.Inv(), [p.Inv() for p in q1]),
+            (a1.Normalize(), [Quaternion(p.w, p.v).Normalize()
+                              for p in q1]),
+            (QuaternionArray.Exp(a1), [Quaternion.Exp(p) for p in q1]),
+            (QuaternionArray.Log(a1), [Quaternion.Log(p) for p in q1])):
+        np.testing.assert_allclose(ans.wxyz, [GetWxyz(q) for q in expected],
+                                   rtol=1e-12, atol=1e-12)
+    np.testing.assert_allclose(a1.Norm(), [p.Norm() for p in q1],
+                               rtol=1e-12)
+    np.testing.assert_allclose(a1.Dot(a2), [p.Dot(q) for p, q in
+                                            zip(q1, q2)], rtol=1e-12,
+                               atol=1e-12)
+    np.testing.assert_allclose(QuaternionArray.Distance(a1, a2),
+                               [Quaternion.Distance(p, q) for p, q in
+                                zip(q1, q2)], rtol=1e-12)
+
+
+def test_QuaternionArrayRotations(rng):
+    q1 = RandomQuaternions(rng, 20, normalized=True)
+    q2 = RandomQuaternions(rng, 20, normalized=True)
+    a1 = QuaternionArray.FromQuaternions(q1)
+    a2 = QuaternionArray.FromQuaternions(q2)
+    vectors = VectorArray(rng.normal(size=(20, 3)))
+    np.testing.assert_allclose(
+        a1.Rotation(vectors).xyz,
+        [GetXyz(q.Rotation(v)) for q, v in zip(q1, vectors.ToVectors())],
+        rtol=1e-12, atol=1e-12)
+    np.testing.assert_allclose(
+        np.einsum('nij,nj->ni', a1.RotationMatrices(), vectors.xyz),
+        a1.Rotation(vectors).xyz, rtol=1e-12, atol=1e-12)
+    np.testing.assert_allclose(
+        QuaternionArray.OrthodromicDistance(a1, a2),
+        [Quaternion.OrthodromicDistance(p, q) for p, q in zip(q1, q2)],
+        rtol=1e-12, atol=1e-12)
+    k = rng.uniform(0, 1)
+    np.testing.assert_allclose(
+        QuaternionArray.SLERP(a1, a2, k).wxyz,
+        [GetWxyz(Quaternion.SLERP(p, q, k)) for p, q in zip(q1, q2)],
+        rtol=1e-10, atol=1e-10)
+    np.testing.assert_allclose(
+        (a1 ** k).wxyz, [GetWxyz(p ** k) for p in q1], rtol=1e-10,
+        atol=1e-10)
+
+
+def test_VectorArray(rng):
+    v1 = VectorArray(rng.normal(size=(20, 3)))
+    v2 = VectorArray(rng.normal(size=(20, 3)))
+    s1 = v1.ToVectors()
+    s2 = v2.ToVectors()
+    np.testing.assert_allclose(VectorArray.ScalarProduct(v1, v2),
+                               [p * q for p, q in zip(s1, s2)], rtol=1e-12,
+                               atol=1e-12)
+    np.testing.assert_allclose((v1 ^ v2).xyz,
+                               [GetXyz(p ^ q) for p, q in zip(s1, s2)],
+                               rtol=1e-12, atol=1e-12)
+    np.testing.assert_allclose(v1.Norm(), [p.Norm() for p in s1],
+                               rtol=1e-12)
+    theta, phi = v1.ToSpherical()
+    np.testing.assert_allclose(np.stack((theta, phi), axis=-1),
+                               [p.ToSpherical() for p in s1], rtol=1e-12,
+                               atol=1e-12)
+    np.testing.assert_allclose(
+        VectorArray.FromSpherical(theta, phi).xyz,
+        [GetXyz(Vector.FromSpherical(t, p)) for t, p in zip(theta, phi)],
+        rtol=1e-12, atol=1e-12)
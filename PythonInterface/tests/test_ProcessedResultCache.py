@@ -0,0 +1,69 @@
+"""LRU eviction and counters of the ProcessedResultCache.
+
+Author: Xavier Corbillon
+IMT Atlantique
+"""
+
+from Helpers.Statistics import ProcessedResult, ProcessedResultCache
+import numpy as np
+
+
+def MakeResult(nbytes):
+    """Return a ProcessedResult with arrays of nbytes bytes."""
+    processedResult = ProcessedResult.__new__(ProcessedResult)
+    processedResult.positionMatrix = np.zeros(nbytes, dtype=np.uint8)
+    return processedResult
+
+
+def test_Eviction():
+    cache = ProcessedResultCache(maxBytes=300)
+    results = dict((key, MakeResult(100)) for key in 'abcd')
+    for key in 'abc':
+        cache.Put(key, results[key])
+    assert cache.usedBytes == 300
+    assert cache.Get('a') is results['a']
+    cache.Put('d', results['d'])
+    # b is the least recently used
+    assert list(cache.results) == ['c', 'a', 'd']
+    assert cache.usedBytes == 300
+    assert cache.Get('b') is None
+    assert cache.PopCounters() == {'hits': 1, 'misses': 1, 'evictions': 1}
+    assert cache.PopCounters() == {'hits': 0, 'misses': 0, 'evictions': 0}
+
+
+def test_ByteBudget():
+    cache = ProcessedResultCache(maxBytes=250)
+    cache.Put('small', MakeResult(50))
+    cache.Put('large', MakeResult(200))
+    assert list(cache.results) == ['small', 'large']
+    cache.Put('medium', MakeResult(150))
+    assert list(cache.results) == ['medium']
+    # a result larger than the budget is not kept
+    cache.Put('huge', MakeResult(1000))
+    assert list(cache.results) == []
+    assert cache.usedBytes == 0
+    assert cache.PopCounters()['evictions'] == 4
+
+
+def test_SizeMeasuredAtAccess():
+    cache = ProcessedResultCache(maxBytes=300)
+    a = MakeResult(100)
+    cache.Put('a', a)
+    cache.Put('b', MakeResult(100))
+    # the arrays loaded on demand make the result grow
+    a.visionMatrix = np.zeros(150, dtype=np.uint8)
+    assert cache.Get('a') is a
+    assert cache.usedBytes == 350 - 100
+    assert list(cache.results) == ['a']
+
+
+def test_SetMaxBytes():
+    cache = ProcessedResultCache(maxBytes=1000)
+    for key in range(5):
+        cache.Put(key, MakeResult(100))
+    cache.SetMaxBytes(250)
+    assert list(cache.results) == [3, 4]
+    cache.SetMaxBytes(0)
+    assert len(cache.results) == 0
+    assert cache.Get(4) is None
+    assert cache.PopCounters() == {'hits': 0, 'misses': 1, 'evictions': 5}
@@ -0,0 +1,78 @@
+"""Checks of the damaged ResultStore.
+
+Author: Xavier Corbillon
+IMT Atlantique
+"""
+
+import Helpers.ResultStore as ResultStore
+import numpy as np
+import os
+import pytest
+
+
+@pytest.fixture
+def storePath(tmp_path):
+    path = str(tmp_path / 'store')
+    ResultStore.WriteStore(path, {'a': np.arange(100, dtype=np.float64),
+                                  'b': np.ones((3, 4), dtype=np.int32),
+                                  'empty': np.zeros(0)},
+                           {'version': 1})
+    return path
+
+
+def test_OpenStore(storePath):
+    store = ResultStore.OpenStore(storePath)
+    assert store.names == frozenset(('a', 'b', 'empty'))
+    assert store.meta == {'version': 1}
+    np.testing.assert_array_equal(store.LoadArray('a'), np.arange(100))
+    np.testing.assert_array_equal(store.LoadArray('b'), np.ones((3, 4)))
+    assert store.LoadArray('empty').shape == (0,)
+    assert ResultStore.VerifyStore(storePath) is None
+
+
+@pytest.mark.parametrize('newSize', [0, 50, 200, 1000])
+def test_OpenStoreWrongSize(storePath, newSize, caplog):
+    arrayPath = ResultStore.GetArrayPath(storePath, 'a')
+    with open(arrayPath, 'r+b') as f:
+        f.truncate(newSize)
+    assert ResultStore.OpenStore(storePath) is None
+    assert 'Damaged store' in caplog.text
+    assert not os.path.exists(os.path.join(storePath,
+                                           ResultStore.META_FILE_NAME))
+
+
+def test_OpenStoreMissingArray(storePath):
+    os.remove(ResultStore.GetArrayPath(storePath, 'b'))
+    assert ResultStore.OpenStore(storePath) is None
+
+
+def test_LoadArrayWrongChecksum(storePath, caplog):
+    arrayPath = ResultStore.GetArrayPath(storePath, 'a')
+    store = ResultStore.OpenStore(storePath)
+    np.testing.assert_array_equal(store.LoadArray('b'), np.ones((3, 4)))
+    with open(arrayPath, 'r+b') as f:
+        f.seek(-1, os.SEEK_END)
+        f.write(b'\xff')
+    # same size: only the checksum detects it
+    assert ResultStore.CheckArrayFile(arrayPath) is None
+    with pytest.raises(ValueError):
+        store.LoadArray('a')
+    assert 'Damaged store' in caplog.text
+    assert ResultStore.OpenStore(storePath) is None
+
+
+def test_WriteStoreKeepsOldStore(storePath, monkeypatch):
+    rename = os.rename
+
+    def FailingRename(src, dst):
+        if src.endswith('.tmp'):
+            raise OSError('rename failed')
+        rename(src, dst)
+
+    monkeypatch.setattr(os, 'rename', FailingRename)
+    with pytest.raises(OSError):
+        ResultStore.WriteStore(storePath, {'a': np.zeros(2)}, {'version': 2})
+    monkeypatch.undo()
+    store = ResultStore.OpenStore(storePath)
+    assert store.meta == {'version': 1}
+    assert sorted(os.listdir(os.path.dirname(storePath))) == ['store']
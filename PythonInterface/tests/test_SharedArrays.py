@@ -0,0 +1,142 @@
+"""Hand-off of arrays between the processes of a pool.
+
+Author: Xavier Corbillon
+IMT Atlantique
+"""
+
+import Helpers.SharedArrays as SharedArrays
+from Helpers.TaskGraph import TaskGraph
+from pathos.multiprocessing import ProcessingPool
+import numpy as np
+import os
+import pytest
+import time
+
+SHM_PATH = '/dev/shm'
+
+
+def GetSegmentNames():
+    """Return the set of the names of the segments in /dev/shm."""
+    return set(os.listdir(SHM_PATH))
+
+
+def ShareArrays(k, *dependencyResults):
+    return SharedArrays.Share({'k': k, 'array': np.arange(1000)*k,
+                               'matrix': np.full((10, 10), k, dtype=np.int8)})
+
+
+def SlowShareArrays(k, *dependencyResults):
+    time.sleep(0.3)
+    return ShareArrays(k)
+
+
+def Fail(*dependencyResults):
+    time.sleep(0.05)
+    raise RuntimeError('task failed')
+
+
+def SumShared(sharedObject):
+    value = SharedArrays.Attach(sharedObject)
+    ans = int(value['array'].sum())
+    del value
+    SharedArrays.Detach(sharedObject)
+    return ans
+
+
+@pytest.fixture(scope='module')
+def pool():
+    pool = ProcessingPool(nodes=4)
+    yield pool
+    pool.close()
+    pool.join()
+    pool.clear()
+
+
+@pytest.fixture
+def segmentNames():
+    """Check that the test leaves no segment in /dev/shm."""
+    if not os.path.isdir(SHM_PATH):
+        pytest.skip('no {}'.format(SHM_PATH))
+    segmentNames = GetSegmentNames()
+    yield segmentNames
+    assert GetSegmentNames() == segmentNames
+
+
+def test_ShareAttach(segmentNames):
+    sharedObject = ShareArrays(3)
+    assert sharedObject.segmentName in GetSegmentNames()
+    value = SharedArrays.Attach(sharedObject, own=True)
+    np.testing.assert_array_equal(value['array'], np.arange(1000)*3)
+    assert value['matrix'].dtype == np.int8
+    assert value['k'] == 3
+    # the arrays are views of the segment
+    assert not value['array'].flags.owndata
+    del value
+    SharedArrays.Release(sharedObject)
+    assert sharedObject.segmentName not in \
+        SharedArrays.global_attached_segments
+
+
+def test_ShareWithoutArrays(segmentNames):
+    sharedObject = SharedArrays.Share({'a': 1})
+    assert sharedObject.segmentName is None
+    assert SharedArrays.Attach(sharedObject, own=True) == {'a': 1}
+    SharedArrays.Release(sharedObject)
+
+
+def test_DetachKeepsArrays(segmentNames):
+    sharedObject = ShareArrays(2)
+    value = SharedArrays.Attach(sharedObject, own=True)
+    SharedArrays.Detach(sharedObject)
+    # still mapped while the arrays are alive
+    assert value['array'][-1] == 1998
+    SharedArrays.Release(sharedObject)
+    assert value['array'][1] == 2
+    del value
+    SharedArrays.Detach(sharedObject)
+    assert len(SharedArrays.global_closing_segments) == 0
+
+
+def test_ReleaseWithoutAttach(segmentNames):
+    sharedObject = ShareArrays(1)
+    SharedArrays.Release(sharedObject)
+
+
+def test_Pool(pool, segmentNames):
+    sharedObjects = pool.map(ShareArrays, range(1, 9))
+    values = [SharedArrays.Attach(sharedObject, own=True)
+              for sharedObject in sharedObjects]
+    assert [int(value['array'].sum()) for value in values] == \
+        [499500*k for k in range(1, 9)]
+    # attached (and detached) by the other processes of the pool
+    assert pool.map(SumShared, sharedObjects) == \
+        [499500*k for k in range(1, 9)]
+    del values
+    for sharedObject in sharedObjects:
+        SharedArrays.Release(sharedObject)
+
+
+def test_PoolOwn(pool, segmentNames):
+    sharedObject = pool.pipe(ShareArrays, 5)
+    SharedArrays.Own(sharedObject)
+    assert SumShared(sharedObject) == 499500*5
+    SharedArrays.Release(sharedObject)
+
+
+def test_FailedGraph(pool, segmentNames):
+    graph = TaskGraph()
+    for k in range(3):
+        graph.AddTask(k, SlowShareArrays, (k,))
+    graph.AddTask('fail', Fail)
+    sharedObjects = dict()
+
+    def TaskDone(name, sharedObject):
+        sharedObjects[name] = sharedObject
+        SharedArrays.Own(sharedObject)
+
+    with pytest.raises(RuntimeError):
+        graph.Run(pool, onDone=TaskDone,
+                  onAbandoned=sharedObjects.__setitem__)
+    assert sorted(sharedObjects) == [0, 1, 2]
+    for sharedObject in sharedObjects.values():
+        SharedArrays.Release(sharedObject)
@@ -0,0 +1,127 @@
+"""Dispatch order, arguments and failures of the TaskGraph.
+
+Author: Xavier Corbillon
+IMT Atlantique
+"""
+
+from Helpers.TaskGraph import TaskGraph
+from pathos.multiprocessing import ProcessingPool
+import pytest
+import time
+
+
+def Add(*values):
+    return sum(values)
+
+
+def Sleep(duration, value, *dependencyResults):
+    time.sleep(duration)
+    return value
+
+
+def Fail(*dependencyResults):
+    raise RuntimeError('task failed')
+
+
+@pytest.fixture(scope='module')
+def pool():
+    pool = ProcessingPool(nodes=4)
+    yield pool
+    pool.close()
+    pool.join()
+    pool.clear()
+
+
+def test_DependencyArguments():
+    graph = TaskGraph()
+    graph.AddTask('a', Add, (1,))
+    graph.AddTask('b', Add, (10,))
+    graph.AddTask('c', Add, (100,), dependencies=['a', 'b'])
+    graph.AddTask('d', Add, (), dependencies=['c', 'a'])
+    assert graph.Run() == {'a': 1, 'b': 10, 'c': 111, 'd': 112}
+
+
+def test_DependencyArgumentsPool(pool):
+    graph = TaskGraph()
+    for k in range(8):
+        graph.AddTask(k, Add, (k,))
+    graph.AddTask('sum', Add, (), dependencies=range(8))
+    assert graph.Run(pool)['sum'] == 28
+
+
+def test_AddTaskErrors():
+    graph = TaskGraph()
+    graph.AddTask('a', Add)
+    with pytest.raises(ValueError):
+        graph.AddTask('a', Add)
+    with pytest.raises(ValueError):
+        graph.AddTask('b', Add, dependencies=['c'])
+
+
+def test_CriticalPathFirst():
+    graph = TaskGraph()
+    graph.AddTask('short', Add, cost=5)
+    graph.AddTask('first', Add, cost=1)
+    graph.AddTask('second', Add, dependencies=['first'], cost=10)
+    graph.AddTask('tie', Add, cost=5)
+    assert graph.GetPriorities() == {'short': 5, 'first': 11, 'second': 10,
+                                     'tie': 5}
+    order = list()
+    graph.Run(onDone=lambda name, result: order.append(name))
+    # the ties are dispatched in insertion order
+    assert order == ['first', 'second', 'short', 'tie']
+
+
+def test_GetCriticalPath():
+    graph = TaskGraph()
+    graph.AddTask('a', Add)
+    graph.AddTask('b', Add)
+    graph.AddTask('c', Add, dependencies=['a'])
+    graph.AddTask('d', Add, dependencies=['a', 'b'])
+    graph.AddTask('e', Add, dependencies=['c', 'd'])
+    assert graph.GetCriticalPath() == (0, ['a', 'c', 'e'])
+    graph.timings = {'a': (0, 1), 'b': (0, 3), 'c': (1, 1), 'd': (3, 2),
+                     'e': (5, 1)}
+    assert graph.GetCriticalPath() == (6, ['b', 'd', 'e'])
+    assert TaskGraph().GetCriticalPath() == (0, [])
+
+
+def test_RunTimings(pool):
+    graph = TaskGraph()
+    graph.AddTask('a', Sleep, (0.05, 1))
+    graph.AddTask('b', Sleep, (0.05, 2), dependencies=['a'])
+    graph.Run(pool)
+    assert set(graph.timings) == {'a', 'b'}
+    assert graph.timings['a'][1] >= 0.05
+    assert graph.timings['b'][0] >= graph.timings['a'][0] + 0.05
+    duration, path = graph.GetCriticalPath()
+    assert path == ['a', 'b']
+
+
+def test_Failure(pool):
+    graph = TaskGraph()
+    graph.AddTask('fail', Sleep, (0.1, None))
+    for k in range(3):
+        graph.AddTask(k, Sleep, (0.5, k))
+    graph.AddTask('failed', Fail, dependencies=['fail'])
+    graph.AddTask('never', Add, (), dependencies=[0, 1, 2])
+    done = list()
+    abandoned = dict()
+    with pytest.raises(RuntimeError):
+        graph.Run(pool, onDone=lambda name, result: done.append(name),
+                  onAbandoned=abandoned.__setitem__)
+    # the running tasks are waited for, their successors are not run
+    assert done == ['fail']
+    assert abandoned == {0: 0, 1: 1, 2: 2}
+    assert 'never' not in graph.timings
+
+
+def test_FailureInOnDone():
+    graph = TaskGraph()
+    graph.AddTask('a', Add, (1,))
+
+    def OnDone(name, result):
+        raise KeyError(name)
+
+    with pytest.raises(KeyError):
+        graph.Run(onDone=OnDone)
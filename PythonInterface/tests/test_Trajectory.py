@@ -0,0 +1,124 @@
+"""Tests of the sliding-window max orthodromic distances of
+Helpers.Trajectory against the port of the C++ function.
+
+Author: Xavier Corbillon
+IMT Atlantique
+"""
+
+from Helpers.Quaternion import Vector, Quaternion, QuaternionArray
+import Helpers.Trajectory as Trajectory
+import ScalarReference
+import numpy as np
+import pytest
+
+SEG_SIZES = [0.2, 1, 2.5]
+
+
+def ComputeMaxOrthodromicDistances(filteredQuaternions, segSizeList,
+                                   earlyTermination):
+    """Run Trajectory.ComputeMaxOrthodromicDistances on a dict."""
+    timestamps = np.array(list(filteredQuaternions.keys()))
+    quaternions = QuaternionArray.FromQuaternions(
+        filteredQuaternions.values()).Normalize()
+    return Trajectory.ComputeMaxOrthodromicDistances(
+        timestamps, quaternions, segSizeList, earlyTermination)
+
+
+def CheckMaxOrthodromicDistances(filteredQuaternions, earlyTermination,
+                                 segSizeList=SEG_SIZES):
+    """Compare the output with the one of the port of the C++ code."""
+    expected = ScalarReference.ComputeMaxOrthodromicDistances(
+        filteredQuaternions, segSizeList)
+    ans = ComputeMaxOrthodromicDistances(filteredQuaternions, segSizeList,
+                                         earlyTermination)
+    assert sorted(ans.keys()) == sorted(expected.keys())
+    for segSize in expected:
+        np.testing.assert_allclose(ans[segSize], expected[segSize], rtol=0,
+                                   atol=1e-12)
+
+
+@pytest.fixture
+def smallChunks(monkeypatch):
+    # small chunks and blocks to go through all the branches of the block
+    # processing with short trajectories
+    monkeypatch.setattr(Trajectory, 'FIRST_CHUNK_SIZE', 2)
+    monkeypatch.setattr(Trajectory, 'MAX_CHUNK_VALUES', 200)
+
+
+@pytest.mark.parametrize('earlyTermination', [False, True])
+@pytest.mark.parametrize('seed', range(8))
+def test_RandomTrajectories(seed, earlyTermination):
+    rng = np.random.default_rng(seed)
+    filteredQuaternions = ScalarReference.RandomFilteredQuaternions(
+        rng, 120, step=0.05, maxGap=4, maxAngle=0.3)
+    CheckMaxOrthodromicDistances(filteredQuaternions, earlyTermination)
+
+
+@pytest.mark.parametrize('earlyTermination', [False, True])
+@pytest.mark.parametrize('maxAngle', [0.01, 0.3, 3])
+@pytest.mark.parametrize('seed', range(4))
+def test_RandomTrajectoriesSmallChunks(seed, maxAngle, earlyTermination,
+                                       smallChunks):
+    # slow heads stop the windows early, fast heads do not
+    rng = np.random.default_rng(seed)
+    filteredQuaternions = ScalarReference.RandomFilteredQuaternions(
+        rng, 80, step=0.05, maxGap=3, maxAngle=maxAngle)
+    CheckMaxOrthodromicDistances(filteredQuaternions, earlyTermination)
+
+
+@pytest.mark.parametrize('earlyTermination', [False, True])
+def test_LargeGaps(earlyTermination, smallChunks):
+    # gaps longer than the largest segment size
+    rng = np.random.default_rng(0)
+    filteredQuaternions = ScalarReference.RandomFilteredQuaternions(
+        rng, 60, step=0.5, maxGap=8)
+    CheckMaxOrthodromicDistances(filteredQuaternions, earlyTermination)
+
+
+@pytest.mark.parametrize('earlyTermination', [False, True])
+def test_Empty(earlyTermination):
+    ans = ComputeMaxOrthodromicDistances(dict(), SEG_SIZES,
+                                         earlyTermination)
+    assert sorted(ans.keys()) == sorted(SEG_SIZES)
+    for distances in ans.values():
+        assert len(distances) == 0
+
+
+@pytest.mark.parametrize('earlyTermination', [False, True])
+@pytest.mark.parametrize('n', [1, 2, 3, 5])
+def test_ShortTrajectories(n, earlyTermination):
+    # shorter than some of the segment sizes: no complete window
+    rng = np.random.default_rng(n)
+    filteredQuaternions = ScalarReference.RandomFilteredQuaternions(
+        rng, n, step=0.2, maxGap=2)
+    CheckMaxOrthodromicDistances(filteredQuaternions, earlyTermination)
+
+
+def TurnAndComeBack(rng, n, step=0.05):
+    """Return a trajectory with a head that turns, comes halfway back and
+    stays almost still: the windows of the first samples are stopped early.
+    """
+    angles = np.concatenate((np.linspace(0, 1.5, 10), np.linspace(1.5, 0.8, 6),
+                             np.full(max(0, n - 16), 0.8)))[:n]
+    angles += rng.uniform(-1e-3, 1e-3, len(angles))
+    return dict((round(k*step, 10), Quaternion.QuaternionFromAngleAxis(
+        angle, Vector(0, 0, 1))) for k, angle in enumerate(angles))
+
+
+@pytest.mark.parametrize('earlyTermination', [False, True])
+@pytest.mark.parametrize('seed', range(3))
+def test_TurnAndComeBack(seed, earlyTermination, smallChunks):
+    rng = np.random.default_rng(seed)
+    CheckMaxOrthodromicDistances(TurnAndComeBack(rng, 80), earlyTermination)
+
+
+@pytest.mark.parametrize('earlyTermination', [False, True])
+def test_StillHead(earlyTermination, smallChunks):
+    rng = np.random.default_rng(0)
+    filteredQuaternions = ScalarReference.RandomFilteredQuaternions(
+        rng, 50, step=0.05, maxAngle=0)
+    ans = ComputeMaxOrthodromicDistances(filteredQuaternions, SEG_SIZES,
+                                         earlyTermination)
+    for distances in ans.values():
+        np.testing.assert_allclose(distances, 0, rtol=0, atol=1e-12)
+    CheckMaxOrthodromicDistances(filteredQuaternions, earlyTermination)
@@ -0,0 +1,77 @@
+"""Tests of the vision cube of Helpers.Vision.
+
+Author: Xavier Corbillon
+IMT Atlantique
+"""
+
+from Helpers.Quaternion import QuaternionArray
+import Helpers.NpQuaternion as NpQuaternion
+import Helpers.Vision as Vision
+from Helpers.Statistics import ProcessedResult
+import math
+import numpy as np
+import pytest
+
+WIDTH = 24
+HEIGHT = 12
+HORIZONTAL_FOV = math.radians(110)
+VERTICAL_FOV = math.radians(90)
+
+
+@pytest.mark.parametrize('checkpointBuckets', [1, 3, 16])
+@pytest.mark.parametrize('maskPrecision', [None, 0.5])
+@pytest.mark.parametrize('seed', range(3))
+def test_VisionCube(seed, maskPrecision, checkpointBuckets, monkeypatch):
+    monkeypatch.setattr(Vision, 'VISION_CUBE_CHECKPOINT_BUCKETS',
+                        checkpointBuckets)
+    # small chunks of rows
+    monkeypatch.setattr(Vision, 'MAX_CHUNK_VALUES', 5*WIDTH*HEIGHT)
+    rng = np.random.default_rng(seed)
+    timestamps = np.sort(rng.uniform(0, 10, 200))
+    quaternions = QuaternionArray(rng.normal(size=(200, 4))).Normalize()
+    boundaries = np.sort(rng.uniform(-1, 11, 41))
+    firstBuckets = rng.integers(0, 40, 50)
+    lastBuckets = np.minimum(40, firstBuckets + rng.integers(0, 12, 50))
+    visionCube = Vision.VisionCube(timestamps, quaternions, boundaries,
+                                   WIDTH, HEIGHT, HORIZONTAL_FOV,
+                                   VERTICAL_FOV, maskPrecision)
+    ans = visionCube.ComputeVision(firstBuckets, lastBuckets)
+    assert ans.shape == (len(firstBuckets), WIDTH, HEIGHT)
+    buckets = np.searchsorted(boundaries, timestamps, side='right') - 1
+    for first, last, vision in zip(firstBuckets, lastBuckets, ans):
+        selected = np.flatnonzero((buckets >= first) & (buckets < last))
+        if maskPrecision is None:
+            expected = NpQuaternion.ComputeVision(
+                dict((float(t), q) for t, q in
+                     zip(timestamps[selected],
+                         quaternions[selected].ToQuaternions())),
+                WIDTH, HEIGHT, HORIZONTAL_FOV, VERTICAL_FOV)
+        else:
+            expected = Vision.GetViewportMaskCache(
+                WIDTH, HEIGHT, HORIZONTAL_FOV, VERTICAL_FOV,
+                maskPrecision).ComputeVision(quaternions[selected])
+        np.testing.assert_allclose(vision, expected, rtol=0, atol=1e-12)
+
+
+def test_VisionCubeEmpty():
+    visionCube = Vision.VisionCube(np.zeros(0), QuaternionArray(),
+                                   np.arange(5.0), WIDTH, HEIGHT,
+                                   HORIZONTAL_FOV, VERTICAL_FOV)
+    ans = visionCube.ComputeVision(np.array([0, 1]), np.array([4, 3]))
+    assert ans.shape == (2, WIDTH, HEIGHT)
+    assert not ans.any()
+
+
+def test_ComputeVisionExactByDefault():
+    rng = np.random.default_rng(7)
+    processedResult = ProcessedResult.__new__(ProcessedResult)
+    processedResult.filteredTimestamps = np.arange(30)*0.1
+    processedResult.filteredQuaternionArray = \
+        QuaternionArray(rng.normal(size=(30, 4))).Normalize()
+    processedResult._filteredQuaternions = None
+    processedResult.ComputeVision(WIDTH, HEIGHT, HORIZONTAL_FOV, VERTICAL_FOV)
+    expected = np.array(NpQuaternion.ComputeVision(
+        processedResult.filteredQuaternions, WIDTH, HEIGHT, HORIZONTAL_FOV,
+        VERTICAL_FOV)).T
+    np.testing.assert_allclose(processedResult.visionMatrix,
+                               expected/expected.sum(), rtol=0, atol=1e-15)